@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the video compiler.
+
+Generates synthetic clips and music with ffmpeg's lavfi sources (no storage or
+Supabase access), then runs normalize_clips_streaming plus the compile step over
+a matrix of clip counts x aspect ratios x transition types. Transition 'none' is
+the production path (compile_video_basic_fades); the others go through
+compile_video and its transition filters. Every case records wall time, CPU time
+(this process plus the ffmpeg children), peak process-tree RSS, peak scratch
+space and output size.
+
+    python benchmark.py run --out baseline.json
+    python benchmark.py run --clips 4 --aspects 9:16 --transitions none --out current.json
+    python benchmark.py compare baseline.json current.json --threshold 0.10
+
+`compare` exits with status 1 when a metric regressed by more than the threshold.
+The compiler calls ./bin/ffmpeg and ./bin/ffprobe; `run` links them into its work
+directory from --ffmpeg-dir (default: whichever ffmpeg is on PATH).
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent / 'src'
+
+DEFAULT_CLIP_COUNTS = [3, 6, 12]
+DEFAULT_ASPECTS = ['16:9', '9:16', '1:1']
+DEFAULT_TRANSITIONS = ['none', 'fade', 'crossfade', 'slide']
+
+# Source variety seen in uploads: phone portrait/landscape, old 4:3, odd frame rates
+SYNTHETIC_RESOLUTIONS = ['1920x1080', '1280x720', '1080x1920', '720x1280', '640x480', '1080x1080']
+SYNTHETIC_FPS = ['30', '24', '60', '30000/1001', '25']
+SYNTHETIC_CODECS = ['libx264', 'mpeg4']
+SYNTHETIC_PATTERNS = ['testsrc2', 'smptebars', 'mandelbrot', 'life']
+
+# metric -> (minimum absolute change that counts, unit); smaller changes are noise
+COMPARED_METRICS = {
+    'wall_seconds': (0.5, 's'),
+    'cpu_seconds': (0.5, 's'),
+    'normalize_seconds': (0.5, 's'),
+    'compile_seconds': (0.5, 's'),
+    'peak_rss_mb': (20.0, 'MB'),
+    'peak_scratch_mb': (5.0, 'MB'),
+    'output_mb': (0.5, 'MB'),
+}
+
+logger = logging.getLogger('benchmark')
+
+
+def run_ffmpeg(cmd: list):
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({' '.join(cmd[:6])} ...): {result.stderr[-500:]}")
+
+
+def synthetic_clip_specs(count: int, seed: int) -> list:
+    """Deterministic clip specs; the same seed always yields the same clips"""
+    rng = random.Random(seed)
+    return [{
+        'size': rng.choice(SYNTHETIC_RESOLUTIONS),
+        'fps': rng.choice(SYNTHETIC_FPS),
+        'duration': round(rng.uniform(2.0, 8.0), 1),
+        'codec': rng.choice(SYNTHETIC_CODECS),
+        'pattern': rng.choice(SYNTHETIC_PATTERNS),
+        'audio': rng.random() < 0.7,
+        'tone': rng.randrange(200, 900, 10)
+    } for _ in range(count)]
+
+
+def generate_clip(ffmpeg: str, spec: dict, output: Path):
+    if output.exists():
+        return
+    video = f"{spec['pattern']}=size={spec['size']}:rate={spec['fps']}"
+    if spec['pattern'] == 'life':
+        video += ':mold=10:ratio=0.5'
+    cmd = [ffmpeg, '-y', '-v', 'error', '-f', 'lavfi', '-i', video]
+    if spec['audio']:
+        cmd += ['-f', 'lavfi', '-i', f"sine=frequency={spec['tone']}:sample_rate=44100"]
+    cmd += ['-t', str(spec['duration']), '-pix_fmt', 'yuv420p', '-c:v', spec['codec']]
+    cmd += ['-preset', 'ultrafast'] if spec['codec'] == 'libx264' else ['-q:v', '5']
+    if spec['audio']:
+        cmd += ['-c:a', 'aac', '-b:a', '96k']
+    run_ffmpeg(cmd + [str(output)])
+
+
+def generate_music(ffmpeg: str, duration: float, output: Path):
+    """Two detuned tones plus pink noise: compressible like music, not like silence"""
+    if output.exists():
+        return
+    run_ffmpeg([
+        ffmpeg, '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f"sine=frequency=220:duration={duration}",
+        '-f', 'lavfi', '-i', f"sine=frequency=331:duration={duration}",
+        '-f', 'lavfi', '-i', f"anoisesrc=color=pink:amplitude=0.05:duration={duration}",
+        '-filter_complex', 'amix=inputs=3', '-ac', '2', '-c:a', 'aac', '-b:a', '128k', str(output)
+    ])
+
+
+def prepare_work_dir(work_dir: Path, ffmpeg_dir: str) -> Path:
+    """Link ffmpeg/ffprobe into work_dir/bin, where the compiler expects them"""
+    bin_dir = work_dir / 'bin'
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for tool in ('ffmpeg', 'ffprobe'):
+        source = Path(ffmpeg_dir) / tool if ffmpeg_dir else shutil.which(tool)
+        if not source or not Path(source).exists():
+            raise SystemExit(f"{tool} not found (use --ffmpeg-dir)")
+        link = bin_dir / tool
+        if link.is_symlink() or link.exists():
+            link.unlink()
+        link.symlink_to(Path(source).resolve())
+    return bin_dir
+
+
+def ffmpeg_version(ffmpeg: str) -> str:
+    try:
+        return subprocess.run([ffmpeg, '-version'], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=SRC_DIR).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class ScratchSampler:
+    """Background sampler of the bytes under a directory (the case's /tmp footprint)"""
+
+    def __init__(self, path: Path, interval: float = 0.2):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name='scratch-sampler', daemon=True)
+
+    def __enter__(self):
+        self._worker.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._worker.join()
+        self._measure()
+
+    def _measure(self):
+        total = 0
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass  # Removed while walking
+        self.peak = max(self.peak, total)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._measure()
+
+
+def cpu_seconds() -> float:
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def run_case(app, sampler, clip_files: list, music_file: str, clip_count: int, aspect: str, transition: str,
+             work_dir: Path) -> dict:
+    """Normalize + compile one matrix cell in a fresh scratch directory"""
+    from metrics import start_job, get_recorder
+    from scheduler import start_schedule
+
+    case_dir = Path(tempfile.mkdtemp(prefix='case-', dir=work_dir))
+    # Generous deadline: the benchmark measures the standard encoder profile, never a fallback
+    start_schedule(3600, app.ENCODE_SPEED_PRIOR)
+    start_job(memory_sampler=sampler)
+    sampler.reset_processes()
+    outcomes = []
+    output_file = case_dir / 'final_video.mp4'
+    started = time.time()
+    cpu_started = cpu_seconds()
+    try:
+        with ScratchSampler(case_dir) as scratch:
+            normalized = app.normalize_clips_streaming(clip_files[:clip_count], aspect, str(case_dir),
+                                                       outcomes=outcomes)
+            normalized_at = time.time()
+            if transition == 'none':
+                app.compile_video_basic_fades(normalized, music_file, str(output_file), music_volume=0.3,
+                                              output_aspect_ratio=aspect)
+            else:
+                app.compile_video(normalized, music_file, str(output_file),
+                                  {'transition_type': transition, 'transition_duration': 1.0,
+                                   'output_aspect_ratio': aspect}, music_volume=0.3)
+        finished = time.time()
+        return {
+            'clips': clip_count,
+            'aspect': aspect,
+            'transition': transition,
+            'wall_seconds': round(finished - started, 3),
+            'cpu_seconds': round(cpu_seconds() - cpu_started, 3),
+            'normalize_seconds': round(normalized_at - started, 3),
+            'compile_seconds': round(finished - normalized_at, 3),
+            'peak_rss_mb': round(sampler.peak_between(started, finished), 1),
+            'peak_scratch_mb': round(scratch.peak / 1024 / 1024, 1),
+            'output_mb': round(output_file.stat().st_size / 1024 / 1024, 2),
+            'normalize_paths': app.count_outcomes(outcomes),
+            'stages': get_recorder().summary()
+        }
+    finally:
+        shutil.rmtree(case_dir, ignore_errors=True)
+
+
+def case_key(case: dict) -> str:
+    return f"{case['clips']} clips / {case['aspect']} / {case['transition']}"
+
+
+def summarize_runs(runs: list) -> dict:
+    """Median of every compared metric over repeated runs; the rest from the first run"""
+    case = dict(runs[0])
+    for metric in COMPARED_METRICS:
+        case[metric] = round(statistics.median(run[metric] for run in runs), 3)
+    case['runs'] = len(runs)
+    return case
+
+
+def command_run(args) -> int:
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix='compiler-bench-')).resolve()
+    work_dir.mkdir(parents=True, exist_ok=True)
+    bin_dir = prepare_work_dir(work_dir, args.ffmpeg_dir)
+    ffmpeg = str(bin_dir / 'ffmpeg')
+
+    max_clips = max(args.clips)
+    specs = synthetic_clip_specs(max_clips, args.seed)
+    media_dir = work_dir / 'media'
+    media_dir.mkdir(exist_ok=True)
+    logger.info(f"Generating {max_clips} synthetic clips and music in {media_dir}")
+    clip_files = []
+    for index, spec in enumerate(specs):
+        suffix = '.mp4' if spec['codec'] == 'libx264' else '.mov'
+        path = media_dir / f"clip_{args.seed}_{index:03d}{suffix}"
+        generate_clip(ffmpeg, spec, path)
+        clip_files.append(str(path))
+    music_file = media_dir / f"music_{args.seed}.m4a"
+    generate_music(ffmpeg, sum(spec['duration'] for spec in specs) + 5, music_file)
+
+    # The compiler resolves ./bin/ffmpeg relative to the working directory
+    os.chdir(work_dir)
+    sys.path.insert(0, str(SRC_DIR))
+    import app
+    # Compiler logs are per clip and per command; keep the benchmark's own output readable
+    logging.getLogger().setLevel(logging.WARNING)
+
+    sampler = app.get_memory_sampler()
+    cases = []
+    for clip_count in args.clips:
+        for aspect in args.aspects:
+            for transition in args.transitions:
+                runs = []
+                for repeat in range(args.repeat):
+                    logger.info(f"▶ {clip_count} clips / {aspect} / {transition} (run {repeat + 1}/{args.repeat})")
+                    runs.append(run_case(app, sampler, clip_files, str(music_file), clip_count, aspect,
+                                         transition, work_dir))
+                case = summarize_runs(runs)
+                logger.info(f"  {case['wall_seconds']:.2f}s wall, {case['cpu_seconds']:.2f}s CPU, "
+                            f"{case['peak_rss_mb']:.0f}MB RSS, {case['peak_scratch_mb']:.0f}MB scratch, "
+                            f"{case['output_mb']:.2f}MB output")
+                cases.append(case)
+
+    report = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'revision': git_revision(),
+            'ffmpeg': ffmpeg_version(ffmpeg),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'clip_specs': specs
+        },
+        'cases': cases
+    }
+    output = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(output)
+        logger.info(f"Wrote {len(cases)} cases to {args.out}")
+    else:
+        print(output)
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float) -> list:
+    """One row per case and metric present in both reports; 'regressed' marks the ones over threshold"""
+    baseline_cases = {case_key(case): case for case in baseline['cases']}
+    rows = []
+    for case in current['cases']:
+        previous = baseline_cases.get(case_key(case))
+        if previous is None:
+            continue
+        for metric, (noise_floor, unit) in COMPARED_METRICS.items():
+            before, after = previous.get(metric), case.get(metric)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else 0.0
+            rows.append({
+                'case': case_key(case),
+                'metric': metric,
+                'unit': unit,
+                'baseline': before,
+                'current': after,
+                'change': change,
+                'regressed': change > threshold and after - before > noise_floor
+            })
+    return rows
+
+
+def command_compare(args) -> int:
+    baseline = json.loads(Path(args.baseline).read_text())
+    current = json.loads(Path(args.current).read_text())
+    if baseline['meta'].get('clip_specs') != current['meta'].get('clip_specs'):
+        logger.warning("The two runs used different synthetic clips (seed or generator changed)")
+    rows = compare_reports(baseline, current, args.threshold)
+    regressions = [row for row in rows if row['regressed']]
+
+    for row in rows if args.verbose else regressions:
+        marker = 'REGRESSION' if row['regressed'] else ''
+        print(f"{row['case']:<28} {row['metric']:<18} {row['baseline']:>10.2f} -> {row['current']:>10.2f} "
+              f"{row['unit']:<2} ({row['change']:+.1%}) {marker}")
+    compared = len({row['case'] for row in rows})
+    print(f"{compared} cases compared, {len(regressions)} regressions over {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run the benchmark matrix')
+    run.add_argument('--clips', type=int, nargs='+', default=DEFAULT_CLIP_COUNTS)
+    run.add_argument('--aspects', nargs='+', default=DEFAULT_ASPECTS)
+    run.add_argument('--transitions', nargs='+', default=DEFAULT_TRANSITIONS)
+    run.add_argument('--repeat', type=int, default=1, help='runs per case (metrics are medians)')
+    run.add_argument('--seed', type=int, default=1, help='synthetic clip generator seed')
+    run.add_argument('--work-dir', help='keep generated media here and reuse it across runs')
+    run.add_argument('--ffmpeg-dir', help='directory containing ffmpeg and ffprobe')
+    run.add_argument('--out', help='JSON report path (default: stdout)')
+    run.set_defaults(handler=command_run)
+
+    compare = commands.add_parser('compare', help='flag regressions between two reports')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=0.10, help='relative increase that counts (0.10 = 10%%)')
+    compare.add_argument('--verbose', action='store_true', help='print every metric, not only regressions')
+    compare.set_defaults(handler=command_compare)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    logger.setLevel(logging.INFO)
+    args = parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# The function's modules live in src/ and import each other by bare name, as in the Lambda package
+SRC_DIR = Path(__file__).resolve().parent / 'src'
+sys.path.insert(0, str(SRC_DIR))
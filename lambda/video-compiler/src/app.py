@@ -1,88 +1,323 @@
+import time
+_module_load_start = time.time()  # Cold-start report: everything below counts as import time
+
 import json
+import math
 import os
 import subprocess
 import tempfile
-import urllib.request
 from pathlib import Path
-import boto3
-from supabase import create_client, Client
 import logging
 import psutil
 import gc
-import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from pipeline import PipelineExecutor, PipelineCancelled
+from media_cache import MediaCache, make_cache_key
+from storage_io import StreamingUpload, StreamingUploadError, HlsPublisher, PooledSession, DownloadCancelled
+from metrics import start_job, stage, get_recorder
+from memory_monitor import ProcessTreeSampler
+from media_probe import (MediaInfo, MediaProbeError, probe_media, probe_media_many, probe_remote_media, probe_remote_media_many,
+                         parse_rate, get_probe_stats)
+from scheduler import EncoderProfile, ENCODER_PROFILES, start_schedule, finish_schedule, get_scheduler
+from distributed import split_segments, LambdaTransport, LocalProcessTransport
+from checkpoint import JobCheckpoint
+from filter_graph import FilterGraph, Filter, Pad, parse_chain, render_chain
+from scratch import ScratchBudgetExceeded, scratch_space, get_scratch
+from progress import DISTRIBUTED_STAGE_WEIGHTS, start_progress, finish_progress, get_progress
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # Memory monitoring utilities
+# Process-tree RSS sampler (this process + ffmpeg children), started by the first invocation
+MEMORY_SAMPLE_INTERVAL_MS = int(os.environ.get('MEMORY_SAMPLE_INTERVAL_MS', '100'))
+_memory_sampler = None
+_last_memory_checkpoint = None
+
+def get_memory_sampler() -> ProcessTreeSampler:
+    """Lazily create and start the background memory sampler; it keeps running across warm invocations"""
+    global _memory_sampler
+    if _memory_sampler is None:
+        _memory_sampler = ProcessTreeSampler(interval=MEMORY_SAMPLE_INTERVAL_MS / 1000)
+    return _memory_sampler.start()
+
 def get_memory_usage():
-    """Get current memory usage in MB"""
+    """Get current memory usage in MB; rss_mb covers this process and its ffmpeg children"""
     try:
         process = psutil.Process()
         memory_info = process.memory_info()
+        children_rss = 0
+        for child in process.children(recursive=True):
+            try:
+                children_rss += child.memory_info().rss
+            except psutil.Error:
+                pass  # Child exited while we were looking
+        tree_rss = memory_info.rss + children_rss
         return {
-            'rss_mb': memory_info.rss / 1024 / 1024,  # Resident Set Size
-            'vms_mb': memory_info.vms / 1024 / 1024,  # Virtual Memory Size
-            'percent': process.memory_percent()
+            'rss_mb': tree_rss / 1024 / 1024,  # Resident Set Size of the whole process tree
+            'python_rss_mb': memory_info.rss / 1024 / 1024,
+            'vms_mb': memory_info.vms / 1024 / 1024,  # Virtual Memory Size (this process)
+            'percent': tree_rss / psutil.virtual_memory().total * 100
         }
     except Exception as e:
         logger.error(f"Failed to get memory usage: {e}")
-        return {'rss_mb': 0, 'vms_mb': 0, 'percent': 0}
+        return {'rss_mb': 0, 'python_rss_mb': 0, 'vms_mb': 0, 'percent': 0}
 
 def log_memory_usage(stage, extra_info=""):
     """Log current memory usage with stage information"""
     memory = get_memory_usage()
-    logger.info(f"🧠 MEMORY [{stage}]: RSS={memory['rss_mb']:.1f}MB, VMS={memory['vms_mb']:.1f}MB, %={memory['percent']:.1f}% {extra_info}")
+    logger.info(f"🧠 MEMORY [{stage}]: RSS={memory['rss_mb']:.1f}MB (Python {memory['python_rss_mb']:.1f}MB), "
+                f"VMS={memory['vms_mb']:.1f}MB, %={memory['percent']:.1f}% {extra_info}")
     return memory
 
-def cleanup_and_gc(stage=""):
-    """Force garbage collection and log memory impact"""
-    memory_before = get_memory_usage()
-    gc.collect()
-    memory_after = get_memory_usage()
-    freed_mb = memory_before['rss_mb'] - memory_after['rss_mb']
-    logger.info(f"🗑️  CLEANUP [{stage}]: Freed {freed_mb:.1f}MB (Before: {memory_before['rss_mb']:.1f}MB, After: {memory_after['rss_mb']:.1f}MB)")
+def memory_checkpoint(stage=""):
+    """
+    Log current process-tree memory and the sampled peak since the previous checkpoint.
+    Purely passive: forcing gc.collect() here freed nothing measurable, since the
+    memory that matters belongs to ffmpeg children.
+    """
+    global _last_memory_checkpoint
+    sampler = get_memory_sampler()
+    now = time.time()
+    current_mb = sampler.sample()
+    since = _last_memory_checkpoint if _last_memory_checkpoint is not None else now
+    peak_mb = max(current_mb, sampler.peak_between(since, now))
+    _last_memory_checkpoint = now
+    logger.info(f"📈 MEMORY [{stage}]: now {current_mb:.1f}MB, peak since last checkpoint {peak_mb:.1f}MB")
 
 def emergency_memory_cleanup():
-    """Emergency cleanup when memory usage is high"""
+    """Emergency cleanup when the Python process itself holds too much memory"""
     memory = get_memory_usage()
-    if memory['rss_mb'] > 2500:  # If over 2.5GB
-        logger.warning(f"⚠️  EMERGENCY CLEANUP: Memory usage high at {memory['rss_mb']:.1f}MB")
-        cleanup_and_gc("EMERGENCY")
+    if memory['python_rss_mb'] > 2500:  # If over 2.5GB
+        logger.warning(f"⚠️  EMERGENCY CLEANUP: Python memory usage high at {memory['python_rss_mb']:.1f}MB")
+        gc.collect()  # Only Python-owned memory can be reclaimed here
+        log_memory_usage("EMERGENCY")
         return True
     return False
 
-# Initialize AWS clients
-ssm_client = boto3.client('ssm')
+# Cold-start bookkeeping: module import time plus lazy client init, reported by the first invocation
+_init_timings = {}
+_cold_start = True
+
 environment = os.environ.get('ENVIRONMENT', 'prod')
+# Parameter Store values are cached per container and refreshed after this many seconds
+SSM_PARAMETER_TTL_SECONDS = int(os.environ.get('SSM_PARAMETER_TTL_SECONDS', '300'))
+
+_ssm_client = None
+_parameter_cache = {}
+_parameter_lock = threading.Lock()
+
+def get_ssm_client():
+    """Lazily create the SSM client (boto3 is only imported when Parameter Store is first needed)"""
+    global _ssm_client
+    if _ssm_client is None:
+        init_start = time.time()
+        import boto3
+        _ssm_client = boto3.client('ssm')
+        _init_timings['ssm_client_ms'] = round((time.time() - init_start) * 1000, 1)
+    return _ssm_client
+
+def get_parameters(names: list) -> dict:
+    """Get parameters from AWS Systems Manager Parameter Store in one call, cached with a TTL"""
+    now = time.time()
+    with _parameter_lock:
+        values = {}
+        missing = []
+        for name in names:
+            cached = _parameter_cache.get(name)
+            if cached is not None and now - cached[1] < SSM_PARAMETER_TTL_SECONDS:
+                values[name] = cached[0]
+            else:
+                missing.append(name)
+        if not missing:
+            return values
+        
+        try:
+            fetch_start = time.time()
+            response = get_ssm_client().get_parameters(
+                Names=[f"/echoes/{environment}/supabase/{name}" for name in missing],
+                WithDecryption=True
+            )
+            _init_timings.setdefault('ssm_fetch_ms', round((time.time() - fetch_start) * 1000, 1))
+        except Exception as e:
+            logger.error(f"Failed to get parameters {missing}: {str(e)}")
+            raise
+        
+        if response.get('InvalidParameters'):
+            raise Exception(f"Parameters not found: {response['InvalidParameters']}")
+        for parameter in response['Parameters']:
+            name = parameter['Name'].rsplit('/', 1)[-1]
+            _parameter_cache[name] = (parameter['Value'], now)
+            values[name] = parameter['Value']
+        return values
 
 def get_parameter(name):
     """Get parameter from AWS Systems Manager Parameter Store"""
+    return get_parameters([name])[name]
+
+def get_supabase_credentials() -> tuple:
+    """(url, service_role_key) from Parameter Store, falling back to environment variables"""
     try:
-        response = ssm_client.get_parameter(
-            Name=f"/echoes/{environment}/supabase/{name}",
-            WithDecryption=True
-        )
-        return response['Parameter']['Value']
+        parameters = get_parameters(['url', 'service_role_key'])
+        return parameters['url'], parameters['service_role_key']
     except Exception as e:
-        logger.error(f"Failed to get parameter {name}: {str(e)}")
-        raise
+        logger.warning(f"Failed to load from Parameter Store: {e}")
+        # Fallback to environment variables
+        url = os.environ.get('SUPABASE_URL')
+        service_role_key = os.environ.get('SUPABASE_SERVICE_ROLE_KEY')
+        if not url or not service_role_key:
+            raise Exception("Supabase credentials not found in Parameter Store or environment variables")
+        # Cache the fallback too, so a missing parameter is not re-fetched on every call
+        with _parameter_lock:
+            now = time.time()
+            _parameter_cache['url'] = (url, now)
+            _parameter_cache['service_role_key'] = (service_role_key, now)
+        return url, service_role_key
+
+_supabase_client = None
+_supabase_credentials = None
+_supabase_lock = threading.Lock()
+
+def get_supabase():
+    """
+    Supabase client, created on first use and reused by warm invocations.
+    It is rebuilt only when the cached credentials change (e.g. after a rotation).
+    """
+    global _supabase_client, _supabase_credentials
+    credentials = get_supabase_credentials()
+    with _supabase_lock:
+        if _supabase_client is None or credentials != _supabase_credentials:
+            init_start = time.time()
+            from supabase import create_client
+            _supabase_client = create_client(*credentials)
+            _supabase_credentials = credentials
+            _init_timings.setdefault('supabase_client_ms', round((time.time() - init_start) * 1000, 1))
+            logger.info("Supabase client initialized")
+        return _supabase_client
+
+# Concurrent download settings (overridable per environment)
+DEFAULT_DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_MAX_WORKERS', '6'))
+
+# Stage metrics: per-stage wall/CPU/bytes/peak memory, emitted as CloudWatch EMF at the end of each job
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'EchoesVideoCompiler')
+METRICS_EMF_ENABLED = os.environ.get('METRICS_EMF_ENABLED', 'true').lower() == 'true'
+
+# Storage HTTP: one keep-alive pool shared by all downloads/uploads, retries resume from the byte offset
+STORAGE_HTTP_POOL_SIZE = int(os.environ.get('STORAGE_HTTP_POOL_SIZE', '16'))
+STORAGE_HTTP_MAX_ATTEMPTS = int(os.environ.get('STORAGE_HTTP_MAX_ATTEMPTS', '4'))
+STORAGE_HTTP_CONNECT_TIMEOUT = float(os.environ.get('STORAGE_HTTP_CONNECT_TIMEOUT', '10'))
+STORAGE_HTTP_READ_TIMEOUT = float(os.environ.get('STORAGE_HTTP_READ_TIMEOUT', '60'))
+
+# Pipelined processing: 'streaming' overlaps download/normalize/music, 'phased' runs them in sequence
+PIPELINE_MODE = os.environ.get('PIPELINE_MODE', 'streaming')
+DEFAULT_PIPELINE_MAX_RAW_CLIPS = int(os.environ.get('PIPELINE_MAX_RAW_CLIPS', '4'))
+# Clip input: 'download' writes each raw clip to /tmp before normalizing it, 'http' lets ffmpeg read
+# the signed URL directly (ranged reads, reconnects) and falls back to a download when that fails
+INPUT_MODE = os.environ.get('INPUT_MODE', 'download')
+# ffmpeg HTTP input: stall timeout and longest reconnect back-off (seconds)
+HTTP_INPUT_RW_TIMEOUT_SECONDS = float(os.environ.get('HTTP_INPUT_RW_TIMEOUT_SECONDS', '15'))
+HTTP_INPUT_RECONNECT_DELAY_MAX = int(os.environ.get('HTTP_INPUT_RECONNECT_DELAY_MAX', '4'))
+
+# Parallel normalization: 0 = derive process count from CPUs and memory
+NORMALIZE_MAX_PROCESSES = int(os.environ.get('NORMALIZE_MAX_PROCESSES', '0'))
+NORMALIZE_MEMORY_PER_PROCESS_MB = int(os.environ.get('NORMALIZE_MEMORY_PER_PROCESS_MB', '350'))
+
+# Normalized-clip cache: local /tmp LRU tier plus a persistent tier in the compile-cache bucket
+NORMALIZED_CACHE_ENABLED = os.environ.get('NORMALIZED_CACHE_ENABLED', 'true').lower() == 'true'
+NORMALIZED_CACHE_DIR = os.environ.get('NORMALIZED_CACHE_DIR', '/tmp/normalized-cache')
+NORMALIZED_CACHE_MAX_MB = int(os.environ.get('NORMALIZED_CACHE_MAX_MB', '256'))
+# Longest the end of a job waits for normalized-clip cache uploads still in flight (never past the deadline)
+CACHE_UPLOAD_WAIT_SECONDS = float(os.environ.get('CACHE_UPLOAD_WAIT_SECONDS', '30'))
+COMPILE_CACHE_BUCKET = os.environ.get('COMPILE_CACHE_BUCKET', 'compile-cache')
+
+# Music cache: source tracks (local only) and ready-to-mux AAC renditions (local + compile-cache bucket)
+MUSIC_CACHE_ENABLED = os.environ.get('MUSIC_CACHE_ENABLED', 'true').lower() == 'true'
+MUSIC_CACHE_DIR = os.environ.get('MUSIC_CACHE_DIR', '/tmp/music-cache')
+MUSIC_CACHE_MAX_MB = int(os.environ.get('MUSIC_CACHE_MAX_MB', '128'))
+# Renditions are cut to the video duration rounded up to this step (the mux trims the copied stream
+# to the video with -t); the fade-out is timed to the exact video end and is part of the cache key
+MUSIC_DURATION_BUCKET_SECONDS = float(os.environ.get('MUSIC_DURATION_BUCKET_SECONDS', '0.5'))
+
+# Scratch space: every /tmp intermediate of a job is accounted per artifact. Before an encode whose
+# predicted output does not fit, released intermediates and unused local cache entries are evicted,
+# and the job fails fast if that is not enough. 0 = limited by free space on the filesystem only
+SCRATCH_BUDGET_MB = int(os.environ.get('SCRATCH_BUDGET_MB', '0'))
+
+# Remux (-c copy) clips that already match the normalization target instead of re-encoding
+STREAM_COPY_ENABLED = os.environ.get('STREAM_COPY_ENABLED', 'true').lower() == 'true'
+# Optional constant output frame rate for normalized clips; empty keeps the source frame rate
+NORMALIZE_TARGET_FPS = os.environ.get('NORMALIZE_TARGET_FPS', '')
+
+# Compile mode: 'single_pass' normalizes inside the final filter graph, 'two_pass' normalizes
+# every clip first, 'auto' picks single-pass when the clip count and memory model allow it
+COMPILE_MODE = os.environ.get('COMPILE_MODE', 'auto')
+SINGLE_PASS_MAX_CLIPS = int(os.environ.get('SINGLE_PASS_MAX_CLIPS', '10'))
+SINGLE_PASS_MEMORY_PER_INPUT_MB = int(os.environ.get('SINGLE_PASS_MEMORY_PER_INPUT_MB', '80'))
+SINGLE_PASS_BASE_MEMORY_MB = int(os.environ.get('SINGLE_PASS_BASE_MEMORY_MB', '400'))
+
+# Hierarchical compile: a re-encode never opens more inputs than the memory model allows; longer
+# clip lists are compiled in groups and the group outputs joined. 0 sizes groups from memory
+COMPILE_MAX_INPUTS = int(os.environ.get('COMPILE_MAX_INPUTS', '0'))
+# Decoder + frame queue cost of one normalized input in the compile filter graph
+COMPILE_MEMORY_PER_INPUT_MB = int(os.environ.get('COMPILE_MEMORY_PER_INPUT_MB', '60'))
+# Peak a single compile ffmpeg is sized for (well below the Lambda memory size)
+COMPILE_MEMORY_BUDGET_MB = int(os.environ.get('COMPILE_MEMORY_BUDGET_MB', '1536'))
 
-# Initialize Supabase client with fallback
-try:
-    SUPABASE_URL = get_parameter('url')
-    SUPABASE_SERVICE_ROLE_KEY = get_parameter('service_role_key')
-    logger.info("Successfully loaded credentials from Parameter Store")
-except Exception as e:
-    logger.warning(f"Failed to load from Parameter Store: {e}")
-    # Fallback to environment variables
-    SUPABASE_URL = os.environ.get('SUPABASE_URL')
-    SUPABASE_SERVICE_ROLE_KEY = os.environ.get('SUPABASE_SERVICE_ROLE_KEY')
-    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
-        raise Exception("Supabase credentials not found in Parameter Store or environment variables")
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# Smart render: in two-pass mode only re-encode the GOPs under the fade in/out and stream-copy the rest
+SMART_RENDER_ENABLED = os.environ.get('SMART_RENDER_ENABLED', 'true').lower() == 'true'
+# Keyframe spacing (seconds) forced on normalized clips so smart-render cut points stay close to the fades
+NORMALIZE_KEYFRAME_INTERVAL = os.environ.get('NORMALIZE_KEYFRAME_INTERVAL', '2')
+
+# Output mode: 'file' writes a faststart MP4 then uploads it, 'stream' pipes fragmented MP4
+# from ffmpeg straight into a resumable upload while encoding, 'hls' publishes HLS segments
+# (playable while encoding) and then remuxes them into the final MP4
+OUTPUT_MODE = os.environ.get('OUTPUT_MODE', 'file')
+FRAGMENTED_MP4_FLAGS = 'frag_keyframe+empty_moov+default_base_moof'
+HLS_SEGMENT_SECONDS = os.environ.get('HLS_SEGMENT_SECONDS', '4')
+
+# Deadline-aware encoding: encoder preset/CRF/resolution tier are chosen from the probed media
+# duration and the Lambda time left; ffmpeg timeouts derive from the same estimates
+DEADLINE_SAFETY_SECONDS = float(os.environ.get('DEADLINE_SAFETY_SECONDS', '45'))
+# Media seconds encoded per wall second with the 'standard' profile at full resolution (whole machine)
+ENCODE_SPEED_PRIOR = float(os.environ.get('ENCODE_SPEED_PRIOR', '1.5'))
+# Assumed clip length when a remote duration probe fails
+SCHEDULE_CLIP_SECONDS_ESTIMATE = float(os.environ.get('SCHEDULE_CLIP_SECONDS_ESTIMATE', '10'))
+SCHEDULE_HEADROOM = float(os.environ.get('SCHEDULE_HEADROOM', '0.8'))
+
+# Distributed compilation: a coordinator splits the clips into segments, worker invocations encode
+# them in parallel and the coordinator joins them with -c copy and muxes the music.
+# 'off', 'auto' (when the probed duration reaches DISTRIBUTED_MIN_SECONDS) or 'always'
+DISTRIBUTED_MODE = os.environ.get('DISTRIBUTED_MODE', 'off')
+DISTRIBUTED_MIN_SECONDS = float(os.environ.get('DISTRIBUTED_MIN_SECONDS', '180'))
+DISTRIBUTED_SEGMENT_SECONDS = float(os.environ.get('DISTRIBUTED_SEGMENT_SECONDS', '60'))
+DISTRIBUTED_MAX_WORKERS = int(os.environ.get('DISTRIBUTED_MAX_WORKERS', '8'))
+# 'lambda' invokes this function per segment, 'local' runs segments in a local process pool
+DISTRIBUTED_TRANSPORT = os.environ.get('DISTRIBUTED_TRANSPORT', 'lambda')
+# Coordinator time kept back from the workers' deadline for downloading, joining and uploading
+DISTRIBUTED_FANIN_RESERVE_SECONDS = float(os.environ.get('DISTRIBUTED_FANIN_RESERVE_SECONDS', '90'))
+
+# Checkpointing: completed normalized clips and worker segments are recorded in
+# final_videos.checkpoint, so a retried (e.g. timed-out) invocation for the same video_id resumes
+CHECKPOINT_ENABLED = os.environ.get('CHECKPOINT_ENABLED', 'true').lower() == 'true'
+
+# Result cache: a request identical to an earlier completed one (same clips and ETags, music,
+# settings and encoder version) copies that video instead of compiling it again
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+# Bump whenever a change alters the compiled output, so older results stop matching
+ENCODER_VERSION = 'compile-v1'
+# Settings that only change how a job runs, never what it produces
+EXECUTION_ONLY_SETTINGS = ('download_workers', 'max_raw_clips', 'pipeline_mode', 'use_cache', 'music_cache',
+                           'compile_mode', 'smart_render', 'output_mode', 'distributed', 'checkpoint',
+                           'result_cache', 'compile_max_inputs', 'input_mode')
+
+# Progress (stage, percent) written to final_videos.progress while a job runs, for the UI polling
+# /api/compile/status. Events are coalesced and written by a background thread
+PROGRESS_ENABLED = os.environ.get('PROGRESS_ENABLED', 'true').lower() == 'true'
+# At most one progress write per this many seconds
+PROGRESS_INTERVAL_SECONDS = float(os.environ.get('PROGRESS_INTERVAL_SECONDS', '2'))
 
 def lambda_handler(event, context):
     """
@@ -109,8 +344,27 @@ def lambda_handler(event, context):
         }
     }
     """
+    if event.get('segment'):
+        # Worker invocation of a distributed compile (see run_distributed_segments)
+        return compile_segment(event, context)
+    
+    global _cold_start, _last_memory_checkpoint
     start_time = time.time()
+    _last_memory_checkpoint = start_time
+    cold_start = _cold_start
+    _cold_start = False
+    if cold_start:
+        logger.info(f"🧊 Cold start: module import took {_init_timings['module_import_ms']:.0f}ms")
     log_memory_usage("LAMBDA_START", f"Request ID: {context.aws_request_id}")
+    get_storage_session().reset_stats()
+    memory_sampler = get_memory_sampler()
+    memory_sampler.reset_processes()
+    start_job(memory_sampler=memory_sampler)
+    metric_properties = {'RequestId': context.aws_request_id, 'ColdStart': cold_start}
+    cache_futures = []  # Normalized-clip cache uploads still running after the pipeline
+    # Everything (encodes, uploads, the DB update) must fit in the invocation's remaining time
+    seconds_left = context.get_remaining_time_in_millis() / 1000 if hasattr(context, 'get_remaining_time_in_millis') else 900
+    start_schedule(seconds_left - DEADLINE_SAFETY_SECONDS, ENCODE_SPEED_PRIOR, headroom=SCHEDULE_HEADROOM)
     
     try:
         # Parse request body
@@ -124,6 +378,7 @@ def lambda_handler(event, context):
         # Extract parameters
         user_id = body.get('user_id')
         video_id = body.get('video_id')  # ID of existing processing record
+        metric_properties['VideoId'] = video_id
         clips = body.get('clips', [])
         music = body.get('music', {})
         settings = body.get('settings', {})
@@ -135,7 +390,7 @@ def lambda_handler(event, context):
             # Update status to failed if we have video_id
             if video_id:
                 try:
-                    supabase.from_('final_videos').update({
+                    get_supabase().from_('final_videos').update({
                         'user_id': user_id,  # FIX: Include user_id for consistency
                         'status': 'failed',
                         'error_message': 'Missing required parameters: user_id and clips'
@@ -161,7 +416,7 @@ def lambda_handler(event, context):
             # Update status to failed if we have video_id
             if video_id:
                 try:
-                    supabase.from_('final_videos').update({
+                    get_supabase().from_('final_videos').update({
                         'user_id': user_id,  # FIX: Include user_id for consistency
                         'status': 'failed',
                         'error_message': 'No clips with valid video_file_path found'
@@ -174,78 +429,279 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'No clips with valid video_file_path found'})
             }
         
+        if video_id and PROGRESS_ENABLED:
+            start_progress(lambda state: get_supabase().from_('final_videos').update({'progress': state})
+                           .eq('id', video_id).execute(), PROGRESS_INTERVAL_SECONDS)
+        
         # Create temporary directory for processing
-        with tempfile.TemporaryDirectory() as temp_dir:
+        with tempfile.TemporaryDirectory() as temp_dir, job_scratch_space(temp_dir):
             temp_path = Path(temp_dir)
             log_memory_usage("TEMP_DIR_CREATED")
             
-            # Download clips from Supabase storage with memory monitoring
-            clip_files = []
-            logger.info(f"Starting download of {len(valid_clips)} clips")
-            for i, clip in enumerate(sorted(valid_clips, key=lambda x: x.get('order', 0))):
-                clip_path = temp_path / f"clip_{i:03d}.mp4"
-                download_from_supabase_storage(clip['video_file_path'], clip_path)
-                clip_files.append(str(clip_path))
+            ordered_clips = sorted(valid_clips, key=lambda x: x.get('order', 0))
             
-                # Log progress and check memory every 5 clips
-                if (i + 1) % 5 == 0 or i == len(valid_clips) - 1:
-                    log_memory_usage("DOWNLOAD_PROGRESS", f"Downloaded {i+1}/{len(valid_clips)} clips")
-                    emergency_memory_cleanup()
+            # An identical request that already completed is copied instead of compiled again
+            result_fingerprint = None
+            clip_etags = None
+            if video_id and settings.get('result_cache', RESULT_CACHE_ENABLED):
+                with stage('result_cache'):
+                    clip_etags = get_clip_etags(ordered_clips)
+                    result_fingerprint = job_fingerprint(ordered_clips, clip_etags, music, settings)
+                    cached_result = find_cached_result(user_id, video_id, result_fingerprint) if result_fingerprint else None
+                    final_video_path = f"final_videos/{user_id}/{context.aws_request_id}.mp4"
+                    reused = cached_result is not None and reuse_cached_result(cached_result, final_video_path)
+                if reused:
+                    return complete_from_cached_result(cached_result, final_video_path, user_id, video_id,
+                                                       result_fingerprint, len(valid_clips), start_time,
+                                                       metric_properties)
             
-            # Streaming normalization with aggressive cleanup
+            download_workers = int(settings.get('download_workers', DEFAULT_DOWNLOAD_WORKERS))
             output_aspect_ratio = settings.get('output_aspect_ratio', '16:9')
-            logger.info(f"Starting streaming normalization of {len(clip_files)} clips to {output_aspect_ratio}")
-            log_memory_usage("NORMALIZATION_START")
+            pipeline_timings = None
+            compile_mode = choose_compile_mode(len(ordered_clips), settings.get('compile_mode', COMPILE_MODE))
             
-            normalized_clip_files = normalize_clips_streaming(clip_files, output_aspect_ratio, str(temp_path))
-            cleanup_and_gc("NORMALIZATION_COMPLETE")
+            # A retry of this video_id resumes from its checkpoint with the same mode and resolution tier
+            checkpoint = open_job_checkpoint(video_id, ordered_clips, settings)
+            resumed_mode = checkpoint.get_meta('compile_mode') if checkpoint else None
+            resumed_scale = checkpoint.get_meta('scale') if checkpoint else None
+            resumed_profile = checkpoint.get_meta('encoder_profile') if checkpoint else None
             
-            # Download music if provided
-            music_file = None
-            if music and music.get('file_path'):
-                logger.info(f"Music requested: {music}")
-                music_file = temp_path / "music.mp3"
-                download_music_from_supabase_storage(music['file_path'], music_file)
-                log_memory_usage("MUSIC_DOWNLOADED")
+            # Sign every clip once; the URLs feed both the duration probes and the downloads
+            signed_urls = sign_storage_urls([clip['video_file_path'] for clip in ordered_clips])
+            clip_seconds = probe_clip_seconds(ordered_clips, signed_urls)
+            segments = None
+            distributed_stats = None
+            if resumed_mode == 'distributed' or (resumed_mode is None and use_distributed_compile(clip_seconds, settings)):
+                compile_mode = 'distributed'
+                segments = split_segments(clip_seconds, DISTRIBUTED_SEGMENT_SECONDS, DISTRIBUTED_MAX_WORKERS)
+                # Workers share one profile, sized for the longest segment: the segments are joined with -c copy
+                longest = max(sum(clip_seconds[i] for i in segment) for segment in segments)
+                encoder_profile = get_scheduler().plan([], longest,
+                                                       profile_name=settings.get('encoder_profile') or resumed_profile,
+                                                       scale=resumed_scale)
+            else:
+                compile_mode = resumed_mode or compile_mode
+                encoder_profile = plan_encode_schedule(clip_seconds, compile_mode,
+                                                       smart_render=settings.get('smart_render', SMART_RENDER_ENABLED),
+                                                       requested_profile=settings.get('encoder_profile'),
+                                                       scale=resumed_scale)
+            single_pass = compile_mode == 'single_pass'
+            metric_properties['EncoderProfile'] = encoder_profile.name
+            if checkpoint is not None:
+                checkpoint.set_meta('compile_mode', compile_mode)
+                checkpoint.set_meta('scale', encoder_profile.scale)
+                checkpoint.set_meta('encoder_profile', encoder_profile.name)
+            
+            if compile_mode == 'distributed':
+                log_memory_usage("DISTRIBUTED_START", f"{len(ordered_clips)} clips in {len(segments)} segments")
+                get_progress().set_weights(DISTRIBUTED_STAGE_WEIGHTS)
+                pipeline_result = run_distributed_segments(
+                    ordered_clips, segments, music, user_id, context.aws_request_id, settings, temp_path,
+                    deadline_at=get_scheduler().deadline - DISTRIBUTED_FANIN_RESERVE_SECONDS,
+                    profile=encoder_profile,
+                    checkpoint=checkpoint
+                )
+                download_results = pipeline_result['download_results']
+                normalized_clip_files = pipeline_result['normalized_files']
+                music_file = Path(pipeline_result['music_file']) if pipeline_result['music_file'] else None
+                music_track = pipeline_result['music_track']
+                pipeline_timings = pipeline_result['timings']
+                normalize_paths = pipeline_result['normalize_paths']
+                distributed_stats = pipeline_result['distributed']
+                memory_checkpoint("SEGMENTS_COMPLETE")
+            elif settings.get('pipeline_mode', PIPELINE_MODE) == 'streaming':
+                # Overlap clip downloads, normalization and the music download
+                log_memory_usage("PIPELINE_START", f"Streaming {len(ordered_clips)} clips to {output_aspect_ratio}")
+                pipeline_result = run_clip_pipeline(
+                    ordered_clips, music, output_aspect_ratio, temp_path,
+                    download_workers=download_workers,
+                    max_raw_clips=int(settings.get('max_raw_clips', DEFAULT_PIPELINE_MAX_RAW_CLIPS)),
+                    use_cache=settings.get('use_cache', NORMALIZED_CACHE_ENABLED),
+                    normalize=not single_pass,
+                    use_music_cache=settings.get('music_cache', MUSIC_CACHE_ENABLED),
+                    signed_urls=signed_urls,
+                    checkpoint=checkpoint,
+                    etags=clip_etags,
+                    input_mode=settings.get('input_mode', INPUT_MODE)
+                )
+                download_results = pipeline_result['download_results']
+                normalized_clip_files = pipeline_result['normalized_files']
+                music_file = Path(pipeline_result['music_file']) if pipeline_result['music_file'] else None
+                music_track = pipeline_result['music_track']
+                pipeline_timings = pipeline_result['timings']
+                pipeline_timings['cache'] = pipeline_result['cache']
+                pipeline_timings['input'] = pipeline_result['input']
+                normalize_paths = pipeline_result['normalize_paths']
+                cache_futures = pipeline_result['cache_futures']
+                memory_checkpoint("PIPELINE_COMPLETE")
+            else:
+                # Download clips from Supabase storage concurrently (order preserved)
+                download_results = download_clips_concurrently(ordered_clips, temp_path, max_workers=download_workers,
+                                                               signed_urls=signed_urls)
+                clip_files = [result['local_path'] for result in download_results]
+                log_memory_usage("DOWNLOAD_COMPLETE", f"Downloaded {len(clip_files)}/{len(valid_clips)} clips")
+                emergency_memory_cleanup()
+                
+                # Streaming normalization with aggressive cleanup
+                logger.info(f"Starting streaming normalization of {len(clip_files)} clips to {output_aspect_ratio}")
+                log_memory_usage("NORMALIZATION_START")
                 
-                # Verify music file was downloaded
-                if music_file.exists():
-                    music_size = music_file.stat().st_size
-                    logger.info(f"Music file downloaded successfully: {music_size} bytes")
+                if single_pass:
+                    # Normalization happens inside the compile filter graph
+                    normalized_clip_files = clip_files
+                    normalize_paths = {'in_graph': len(clip_files)}
                 else:
-                    logger.error("Music file was not downloaded successfully")
-                    music_file = None
-            else:
-                logger.info("No music requested or no file_path provided")
+                    normalize_outcomes = []
+                    normalized_clip_files = normalize_clips_streaming(clip_files, output_aspect_ratio, str(temp_path),
+                                                                      outcomes=normalize_outcomes)
+                    normalize_paths = count_outcomes(normalize_outcomes)
+                    memory_checkpoint("NORMALIZATION_COMPLETE")
+                
+                # Download music if provided
+                music_file = None
+                music_track = None
+                if music and music.get('file_path'):
+                    logger.info(f"Music requested: {music}")
+                    music_file = Path(get_scratch().track(temp_path / "music.mp3", 'music'))
+                    music_track = fetch_music_track(music, music_file, settings.get('music_cache', MUSIC_CACHE_ENABLED))
+                    log_memory_usage("MUSIC_DOWNLOADED")
+                    
+                    # Verify music file was downloaded
+                    if music_file.exists():
+                        music_size = music_file.stat().st_size
+                        logger.info(f"Music file downloaded successfully: {music_size} bytes")
+                    else:
+                        logger.error("Music file was not downloaded successfully")
+                        music_file = None
+                else:
+                    logger.info("No music requested or no file_path provided")
+            
+            # Pre-render the music stream so the compile can mux it with -c:a copy
+            music_volume = music.get('volume', 0.3) if music else 0.3
+            music_prepared = False
+            music_stats = None
+            if music_file and music_volume > 0 and settings.get('music_cache', MUSIC_CACHE_ENABLED):
+                video_duration = sum(media.duration for media in probe_media_many(normalized_clip_files))
+                rendition = prepare_music_rendition(str(music_file), music_track['source_key'] if music_track else None,
+                                                    video_duration, music_volume, str(temp_path))
+                if rendition is not None:
+                    get_scratch().release(music_file)  # The rendition replaces the source track
+                    music_file = Path(rendition['path'])
+                    music_prepared = True
+                    music_stats = {
+                        'track_cache': music_track['cache'] if music_track else None,
+                        'rendition_cache': rendition['cache'],
+                        'rendition_seconds': rendition['duration']
+                    }
             
             # Compile video with basic fades (memory optimized)
             output_file = temp_path / "final_video.mp4"
+            final_video_path = f"final_videos/{user_id}/{context.aws_request_id}.mp4"
             log_memory_usage("COMPILATION_START", f"Processing {len(normalized_clip_files)} normalized clips")
             
-            compile_video_basic_fades(
-                clip_files=normalized_clip_files,
-                music_file=str(music_file) if music_file else None,
-                output_file=str(output_file),
-                music_volume=music.get('volume', 0.3) if music else 0.3,
-                output_aspect_ratio=output_aspect_ratio
-            )
+            output_mode = settings.get('output_mode', OUTPUT_MODE)
+            open_sink = None
+            open_hls = None
+            if output_mode == 'stream':
+                # Upload fragmented MP4 parts while ffmpeg is still encoding
+                open_sink = lambda: StreamingUpload(*get_supabase_credentials(),
+                                                    'final-videos', final_video_path,
+                                                    session=get_storage_session()).start()
+            elif output_mode == 'hls':
+                # Publish HLS segments as they are produced so playback can start before the MP4 exists
+                hls_remote_root = f"final_videos/{user_id}/{context.aws_request_id}/hls"
+                
+                open_hls = lambda local_dir, attempt_number: open_hls_publisher(
+                    # Each compile attempt gets its own remote directory so a fallback never mixes segments
+                    local_dir, f"{hls_remote_root}/{attempt_number}", video_id, user_id)
             
-            cleanup_and_gc("COMPILATION_COMPLETE")
+            get_progress().complete('download', 'normalize', 'segments')
+            get_progress().report('compile', 0.0)
+            with stage('compile') as compile_timing:
+                compile_result = compile_final_video(
+                    normalized_clip_files,
+                    compile_mode=compile_mode,
+                    compile_kwargs={
+                        'music_file': str(music_file) if music_file else None,
+                        'output_file': str(output_file),
+                        'music_volume': music_volume,
+                        'music_prepared': music_prepared,
+                        'output_aspect_ratio': output_aspect_ratio
+                    },
+                    temp_dir=str(temp_path),
+                    smart_render=settings.get('smart_render', SMART_RENDER_ENABLED),
+                    open_sink=open_sink,
+                    open_hls=open_hls,
+                    max_inputs=int(settings.get('compile_max_inputs', COMPILE_MAX_INPUTS))
+                )
+                compile_timing.add_bytes(compile_result['output_bytes'])
+            get_progress().complete('compile')
+            finish_schedule()
+            compile_mode = compile_result['compile_mode']
+            metric_properties['CompileMode'] = compile_mode
+            if compile_result['normalize_paths'] is not None:
+                normalize_paths = compile_result['normalize_paths']
             
-            # Upload result to Supabase storage
-            final_video_path = f"final_videos/{user_id}/{context.aws_request_id}.mp4"
-            output_file_size = os.path.getsize(str(output_file)) / 1024 / 1024  # MB
-            log_memory_usage("UPLOAD_START", f"Uploading {output_file_size:.1f}MB video")
+            memory_checkpoint("COMPILATION_COMPLETE")
             
-            upload_to_supabase_storage(str(output_file), final_video_path)
-            cleanup_and_gc("UPLOAD_COMPLETE")
+            output_file_size = compile_result['output_bytes'] / 1024 / 1024  # MB
+            if compile_result['streamed']:
+                logger.info(f"Output already uploaded while encoding ({output_file_size:.1f}MB)")
+            else:
+                # Upload result to Supabase storage
+                log_memory_usage("UPLOAD_START", f"Uploading {output_file_size:.1f}MB video")
+                get_progress().report('upload', 0.0)
+                with stage('upload') as upload_timing:
+                    upload_to_supabase_storage(str(output_file), final_video_path)
+                    upload_timing.add_bytes(compile_result['output_bytes'])
+                memory_checkpoint("UPLOAD_COMPLETE")
             
             # Generate public URL for the video
             public_url = generate_public_url(final_video_path)
             
             # Calculate total processing time and final memory stats
             total_time = time.time() - start_time
-            final_memory = log_memory_usage("PROCESSING_COMPLETE", f"Total time: {total_time:.1f}s, Output: {output_file_size:.1f}MB")
+            log_memory_usage("PROCESSING_COMPLETE", f"Total time: {total_time:.1f}s, Output: {output_file_size:.1f}MB")
+            # True peak of the whole job, including every ffmpeg child
+            peak_memory_mb = max(memory_sampler.peak_between(start_time), memory_sampler.sample())
+            logger.info(f"🌐 Storage HTTP: {json.dumps(get_storage_session().stats())}")
+            
+            processing_stats = {
+                'clips_processed': len(valid_clips),
+                'output_size_mb': round(output_file_size, 1),
+                'processing_time_seconds': round(total_time, 1),
+                'peak_memory_mb': round(peak_memory_mb, 1),
+                'downloads': {
+                    'workers': download_workers,
+                    'total_mb': round(sum(r['bytes'] for r in download_results) / 1024 / 1024, 1),
+                    'clip_seconds': [r['seconds'] for r in download_results]
+                },
+                'pipeline': pipeline_timings,
+                'normalize_paths': normalize_paths,
+                'compile_mode': compile_mode,
+                'compile_groups': compile_result['groups'],
+                'probe': get_probe_stats(),
+                'output_streamed': compile_result['streamed'],
+                'music': music_stats,
+                'http': get_storage_session().stats(),
+                'init': dict(_init_timings, cold_start=cold_start),
+                'hls': compile_result['hls'],
+                'schedule': get_scheduler().summary(),
+                'distributed': distributed_stats,
+                'checkpoint': checkpoint.summary() if checkpoint is not None else None,
+                'result_cache': {'fingerprint': result_fingerprint, 'hit': False} if result_fingerprint else None,
+                'scratch': get_scratch().summary(),
+                'stages': get_recorder().summary(),
+                'process_cpu_seconds': get_recorder().process_cpu_seconds(),
+                'memory': {
+                    'sample_interval_ms': MEMORY_SAMPLE_INTERVAL_MS,
+                    'samples': memory_sampler.sample_count(),
+                    'top_processes': memory_sampler.process_peaks(since=start_time, limit=5)
+                }
+            }
+            
+            # The reporter's last state goes out with the final update instead of racing it
+            progress_state = finish_progress('completed', flush=False)
             
             # Update existing record in database
             if video_id:
@@ -255,13 +711,33 @@ def lambda_handler(event, context):
                     'file_path': final_video_path,
                     'public_url': public_url,
                     'status': 'completed',
-                    'completed_at': 'now()'
+                    'completed_at': 'now()',
+                    # Per-stage breakdown is stored so regressions can be queried per stage
+                    'processing_stats': processing_stats,
+                    'progress': progress_state
                 }
+                if compile_result['hls'] is not None:
+                    update_data['hls_playlist_url'] = generate_public_url(compile_result['hls']['playlist_path'])
+                # Only full-quality output is offered for reuse; a deadline-degraded job compiles again
+                if result_fingerprint and (settings.get('encoder_profile') or
+                                           get_scheduler().profile.name == ENCODER_PROFILES[0].name):
+                    update_data['result_fingerprint'] = result_fingerprint
                 
-                result = supabase.from_('final_videos').update(update_data).eq('id', video_id).execute()
+                with stage('db_update'):
+                    result = get_supabase().from_('final_videos').update(update_data).eq('id', video_id).execute()
+                # Their checkpoint records must land before the manifest is cleared
+                wait_for_cache_uploads(cache_futures)
+                if checkpoint is not None:
+                    # Nothing left to resume: drop the manifest and the artifacts only it referenced
+                    checkpoint.clear()
                 
                 # Log final success metrics
-                logger.info(f"🎉 VIDEO COMPILATION SUCCESS: {len(valid_clips)} clips → {output_file_size:.1f}MB in {total_time:.1f}s (Peak Memory: {final_memory['rss_mb']:.1f}MB)")
+                logger.info(f"🎉 VIDEO COMPILATION SUCCESS: {len(valid_clips)} clips → {output_file_size:.1f}MB in {total_time:.1f}s (Peak Memory: {peak_memory_mb:.1f}MB)")
+                
+                # Response carries the final breakdown, including the DB update itself
+                processing_stats['stages'] = get_recorder().summary()
+                processing_stats['process_cpu_seconds'] = get_recorder().process_cpu_seconds()
+                emit_job_metrics(metric_properties)
                 
                 return {
                     'statusCode': 200,
@@ -269,12 +745,7 @@ def lambda_handler(event, context):
                         'message': 'Video compilation completed successfully',
                         'video_id': video_id,
                         'video_file_path': final_video_path,
-                        'processing_stats': {
-                            'clips_processed': len(valid_clips),
-                            'output_size_mb': round(output_file_size, 1),
-                            'processing_time_seconds': round(total_time, 1),
-                            'peak_memory_mb': round(final_memory['rss_mb'], 1)
-                        }
+                        'processing_stats': processing_stats
                     })
                 }
             else:
@@ -290,7 +761,9 @@ def lambda_handler(event, context):
                     'status': 'completed'
                 }
                 
-                result = supabase.from_('final_videos').insert(final_video_record).execute()
+                result = get_supabase().from_('final_videos').insert(final_video_record).execute()
+                wait_for_cache_uploads(cache_futures)
+                emit_job_metrics(metric_properties)
                 
                 return {
                     'statusCode': 200,
@@ -303,76 +776,771 @@ def lambda_handler(event, context):
             
     except Exception as e:
         logger.error(f"Error in video compilation: {str(e)}")
+        # Stage and percent reached stay on the failed record
+        progress_state = finish_progress(flush=False)
         
         # Update status to failed if we have video_id
         if 'video_id' in locals() and video_id:
             try:
-                supabase.from_('final_videos').update({
+                get_supabase().from_('final_videos').update({
                     'user_id': user_id,  # FIX: Include user_id for consistency
                     'status': 'failed',
-                    'error_message': str(e)
+                    'error_message': str(e),
+                    'progress': progress_state,
+                    'hls_playlist_url': None  # Published HLS objects of a failed job are deleted
                 }).eq('id', video_id).execute()
             except Exception as update_error:
                 logger.error(f"Failed to update status to failed: {update_error}")
         
+        # Clips already cached or checkpointed let a retry skip their encodes
+        wait_for_cache_uploads(cache_futures)
+        metric_properties['Failed'] = True
+        finish_schedule()
+        emit_job_metrics(metric_properties)
         return {
             'statusCode': 500,
             'body': json.dumps({'error': f'Video compilation failed: {str(e)}'})
         }
 
-def download_from_supabase_storage(file_path: str, local_path: Path):
-    """Download file from Supabase storage to local path"""
+
+def complete_from_cached_result(source: dict, final_video_path: str, user_id: str, video_id: str,
+                                fingerprint: str, clip_count: int, start_time: float, metric_properties: dict) -> dict:
+    """Finish a job whose output was copied from an identical earlier result"""
+    public_url = generate_public_url(final_video_path)
+    source_stats = source.get('processing_stats') or {}
+    processing_stats = {
+        'clips_processed': clip_count,
+        'output_size_mb': source_stats.get('output_size_mb'),
+        'processing_time_seconds': round(time.time() - start_time, 1),
+        'compile_mode': source_stats.get('compile_mode'),
+        'result_cache': {'fingerprint': fingerprint, 'hit': True, 'source_video_id': source['id']},
+        'stages': get_recorder().summary()
+    }
+    with stage('db_update'):
+        get_supabase().from_('final_videos').update({
+            'user_id': user_id,
+            'file_path': final_video_path,
+            'public_url': public_url,
+            'status': 'completed',
+            'completed_at': 'now()',
+            'result_fingerprint': fingerprint,
+            'processing_stats': processing_stats,
+            'progress': finish_progress('completed', flush=False)
+        }).eq('id', video_id).execute()
+    logger.info(f"♻️  Identical to completed video {source['id']}: reused its output in "
+                f"{processing_stats['processing_time_seconds']}s")
+    
+    processing_stats['stages'] = get_recorder().summary()
+    metric_properties['ResultCacheHit'] = True
+    finish_schedule()
+    emit_job_metrics(metric_properties)
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'Video compilation completed successfully',
+            'video_id': video_id,
+            'video_file_path': final_video_path,
+            'processing_stats': processing_stats
+        })
+    }
+
+
+def emit_job_metrics(properties: dict):
+    """Emit the job's stage metrics as CloudWatch EMF; metrics must never fail a job"""
+    if not METRICS_EMF_ENABLED:
+        return
+    try:
+        get_recorder().emit_emf(METRICS_NAMESPACE, properties)
+    except Exception as e:
+        logger.warning(f"Failed to emit stage metrics: {e}")
+
+_storage_session = None
+
+
+def get_storage_session() -> PooledSession:
+    """Lazily create the pooled storage session; warm invocations keep its open connections"""
+    global _storage_session
+    if _storage_session is None:
+        _storage_session = PooledSession(
+            pool_size=STORAGE_HTTP_POOL_SIZE,
+            connect_timeout=STORAGE_HTTP_CONNECT_TIMEOUT,
+            read_timeout=STORAGE_HTTP_READ_TIMEOUT,
+            max_attempts=STORAGE_HTTP_MAX_ATTEMPTS
+        )
+    return _storage_session
+
+
+def create_signed_download_url(file_path: str, bucket: str = 'private-photos') -> str:
+    """Signed URL for one storage object (1 hour expiry)"""
+    response = get_supabase().storage.from_(bucket).create_signed_url(file_path, 3600)
+    logger.info(f"Signed URL response: {response}")
+    
+    if not response.get('signedURL'):
+        # Check if there's an error in the response
+        if 'error' in response:
+            raise Exception(f"Supabase storage error for {file_path}: {response['error']}")
+        else:
+            raise Exception(f"Failed to get signed URL for {file_path}: {response}")
+    return response['signedURL']
+
+
+def sign_storage_urls(file_paths: list, bucket: str = 'private-photos') -> dict:
+    """
+    Signed URLs for many objects in one storage round trip: {file_path: url}.
+    Paths the bulk call could not sign are left out (callers sign them individually);
+    a failed bulk call returns an empty dict.
+    """
+    unique_paths = list(dict.fromkeys(file_paths))
+    if not unique_paths:
+        return {}
+    sign_start = time.time()
+    try:
+        entries = get_supabase().storage.from_(bucket).create_signed_urls(unique_paths, 3600)
+    except Exception as e:
+        logger.warning(f"Bulk signed URL creation failed, signing per file: {e}")
+        return {}
+    
+    signed = {}
+    for entry in entries or []:
+        url = entry.get('signedURL') or entry.get('signedUrl')
+        if url and not entry.get('error'):
+            signed[entry.get('path')] = url
+    logger.info(f"🔏 Signed {len(signed)}/{len(unique_paths)} URLs in one call ({time.time() - sign_start:.2f}s)")
+    return signed
+
+
+def download_from_supabase_storage(file_path: str, local_path: Path, cancel_event: threading.Event = None,
+                                   bucket: str = 'private-photos', signed_url: str = None) -> int:
+    """Download file from Supabase storage to local path, returns bytes written"""
     try:
         logger.info(f"Attempting to download: {file_path}")
         
-        # Get signed URL for download
-        response = supabase.storage.from_('private-photos').create_signed_url(file_path, 3600)  # 1 hour expiry
-        logger.info(f"Signed URL response: {response}")
+        if cancel_event is not None and cancel_event.is_set():
+            raise DownloadCancelled(f"Download of {file_path} cancelled before start")
         
-        if not response.get('signedURL'):
-            # Check if there's an error in the response
-            if 'error' in response:
-                raise Exception(f"Supabase storage error for {file_path}: {response['error']}")
-            else:
-                raise Exception(f"Failed to get signed URL for {file_path}: {response}")
+        # Reuse a URL from the job's bulk signing when there is one
+        if signed_url is None:
+            signed_url = create_signed_download_url(file_path, bucket)
         
-        # Download file
-        urllib.request.urlretrieve(response['signedURL'], local_path)
-        logger.info(f"Successfully downloaded {file_path} to {local_path}")
+        # Pooled keep-alive connection; transient failures resume from the received byte offset
+        file_size = get_storage_session().download(signed_url, str(local_path), cancel_event=cancel_event)
+        logger.info(f"Successfully downloaded {file_path} to {local_path} ({file_size} bytes)")
+        return file_size
         
+    except DownloadCancelled:
+        logger.info(f"⏹️  Cancelled download of {file_path}")
+        raise
     except Exception as e:
         logger.error(f"Failed to download {file_path}: {str(e)}")
         raise
 
-def download_music_from_supabase_storage(file_path: str, local_path: Path):
-    """Download music file from Supabase music-tracks storage bucket"""
+def download_clip(index: int, clip: dict, temp_path: Path, total: int, cancel_event: threading.Event = None,
+                  signed_url: str = None) -> dict:
+    """Download one clip to clip_{index}.mp4 and return its timing and size"""
+    clip_path = temp_path / f"clip_{index:03d}.mp4"
+    clip_start = time.time()
+    get_scratch().track(clip_path, 'raw')
+    with stage('download', item=index) as timing:
+        size = download_from_supabase_storage(clip['video_file_path'], clip_path, cancel_event=cancel_event,
+                                              signed_url=signed_url)
+        timing.add_bytes(size)
+    elapsed = time.time() - clip_start
+    logger.info(f"⬇️  Clip {index+1}/{total} downloaded: {size/1024/1024:.1f}MB in {elapsed:.2f}s")
+    return {
+        'index': index,
+        'clip_id': clip.get('id'),
+        'local_path': str(clip_path),
+        'bytes': size,
+        'seconds': round(elapsed, 3)
+    }
+
+def download_clips_concurrently(clips: list, temp_path: Path, max_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+                                signed_urls: dict = None) -> list:
+    """
+    Download clips in parallel with a bounded thread pool.
+    
+    Results are returned in the same order as `clips`, one dict per clip with
+    local_path, bytes and seconds. If any download fails the remaining ones are
+    cancelled and the original error is raised. `signed_urls` ({path: url}) skips
+    signing when the caller already did it.
+    """
+    if not clips:
+        return []
+    
+    max_workers = max(1, min(max_workers, len(clips)))
+    cancel_event = threading.Event()
+    results = [None] * len(clips)
+    
+    logger.info(f"Starting concurrent download of {len(clips)} clips with {max_workers} workers")
+    download_start = time.time()
+    if signed_urls is None:
+        signed_urls = sign_storage_urls([clip['video_file_path'] for clip in clips])
+    
+    def download_one(index: int, clip: dict) -> dict:
+        result = download_clip(index, clip, temp_path, len(clips), cancel_event,
+                               signed_url=signed_urls.get(clip['video_file_path']))
+        get_progress().advance('download', len(clips))
+        return result
+    
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='clip-download')
     try:
-        logger.info(f"Attempting to download music: {file_path}")
+        futures = {executor.submit(download_one, i, clip): i for i, clip in enumerate(clips)}
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+        
+        # Surface the first real failure (cancellations are a consequence, not a cause)
+        failed = [f for f in done if f.exception() is not None and not isinstance(f.exception(), DownloadCancelled)]
+        if failed:
+            cancel_event.set()
+            for future in not_done:
+                future.cancel()
+            wait(not_done)
+            raise failed[0].exception()
+        
+        for future in done:
+            result = future.result()
+            results[result['index']] = result
+    finally:
+        cancel_event.set()
+        executor.shutdown(wait=True)
+    
+    total_time = time.time() - download_start
+    total_bytes = sum(r['bytes'] for r in results)
+    logger.info(f"✅ Downloaded {len(results)} clips ({total_bytes/1024/1024:.1f}MB) in {total_time:.2f}s "
+                f"(serial sum {sum(r['seconds'] for r in results):.2f}s)")
+    return results
+
+_normalized_clip_cache = None
+
+
+def get_normalized_clip_cache() -> MediaCache:
+    """Lazily create the normalized-clip cache; the local tier is reused by warm invocations"""
+    global _normalized_clip_cache
+    if _normalized_clip_cache is None:
+        _normalized_clip_cache = MediaCache(
+            local_dir=NORMALIZED_CACHE_DIR,
+            max_local_bytes=NORMALIZED_CACHE_MAX_MB * 1024 * 1024,
+            remote_prefix='normalized/v1',
+            remote_download=lambda remote_path, local_path: download_from_supabase_storage(
+                remote_path, Path(local_path), bucket=COMPILE_CACHE_BUCKET),
+            remote_upload=lambda local_path, remote_path: upload_to_supabase_storage(
+                local_path, remote_path, bucket=COMPILE_CACHE_BUCKET, upsert=True)
+        )
+    return _normalized_clip_cache
+
+
+def wait_for_cache_uploads(futures: list):
+    """Give the background cache stores a bounded chance to finish before the sandbox freezes"""
+    if not futures:
+        return
+    _, pending = wait(futures, timeout=get_scheduler().cap_timeout(CACHE_UPLOAD_WAIT_SECONDS, minimum=0))
+    if pending:
+        logger.warning(f"📦 {len(pending)} normalized-clip cache uploads still running at the end of the job")
+
+
+def get_storage_etag(file_path: str, bucket: str = 'private-photos') -> str:
+    """ETag of a storage object (falls back to size + updated_at), or None if unavailable"""
+    folder, _, name = file_path.rpartition('/')
+    try:
+        entries = get_supabase().storage.from_(bucket).list(folder, {'limit': 100, 'search': name})
+    except Exception as e:
+        logger.warning(f"Could not list {file_path} for ETag: {e}")
+        return None
+    for entry in entries or []:
+        if entry.get('name') == name:
+            metadata = entry.get('metadata') or {}
+            if metadata.get('eTag'):
+                return metadata['eTag'].strip('"')
+            if metadata.get('size') is not None and entry.get('updated_at'):
+                return f"{metadata['size']}-{entry['updated_at']}"
+    return None
+
+
+def normalized_clip_cache_key(file_path: str, etag: str, config: dict, profile: EncoderProfile) -> str:
+    """Cache key for a normalized clip: source path + ETag + target filter + encoder settings"""
+    if not etag:
+        return None
+    return make_cache_key('normalized-clip', file_path, etag, get_normalize_filter(config),
+                          normalize_encoder_args(profile))
+
+
+def get_clip_etags(clips: list) -> dict:
+    """ETags of the clips' source objects by video_file_path (None where unavailable), looked up in parallel"""
+    paths = list(dict.fromkeys(clip['video_file_path'] for clip in clips))
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(paths))), thread_name_prefix='etag') as executor:
+        return dict(zip(paths, executor.map(get_storage_etag, paths)))
+
+
+def job_fingerprint(clips: list, clip_etags: dict, music: dict, settings: dict) -> str:
+    """
+    Deterministic identity of a compile request's output: clips in order with their
+    source ETags, the music track and its ETag, output settings and ENCODER_VERSION.
+    None when a source ETag is unavailable, since the request cannot be pinned down then.
+    """
+    clip_parts = []
+    for clip in clips:
+        etag = clip_etags.get(clip['video_file_path'])
+        if not etag:
+            return None
+        clip_parts.append([{key: value for key, value in clip.items() if key != 'order'}, etag])
+    music_part = None
+    if music and music.get('file_path'):
+        music_etag = get_storage_etag(music['file_path'], bucket='music-tracks')
+        if not music_etag:
+            return None
+        music_part = [music, music_etag]
+    output_settings = {key: value for key, value in settings.items() if key not in EXECUTION_ONLY_SETTINGS}
+    return make_cache_key('final-video', ENCODER_VERSION, clip_parts, music_part, output_settings)
+
+
+def find_cached_result(user_id: str, video_id: str, fingerprint: str) -> dict:
+    """Latest completed video of this user with the same fingerprint, or None"""
+    try:
+        rows = get_supabase().from_('final_videos').select('id, file_path, processing_stats') \
+            .eq('user_id', user_id).eq('result_fingerprint', fingerprint).eq('status', 'completed') \
+            .neq('id', video_id).order('completed_at', desc=True).limit(1).execute().data
+    except Exception as e:
+        logger.warning(f"Result cache lookup failed: {e}")
+        return None
+    return rows[0] if rows and rows[0].get('file_path') else None
+
+
+def reuse_cached_result(source: dict, final_video_path: str) -> bool:
+    """
+    Server-side copy of a cached result to this job's output path. A copy rather than
+    a shared reference, because deleting a video removes its file from storage.
+    """
+    try:
+        get_supabase().storage.from_('final-videos').copy(source['file_path'], final_video_path)
+        return True
+    except Exception as e:
+        logger.warning(f"Could not copy cached result {source['file_path']}: {e}")
+        return False
+
+
+def open_job_checkpoint(video_id: str, clips: list, settings: dict) -> JobCheckpoint:
+    """
+    Load (or start) the checkpoint for a job; None when checkpointing is off
+    (per-request override: settings.checkpoint). The manifest lives in
+    final_videos.checkpoint and its artifacts under jobs/<video_id>/ in the
+    compile-cache bucket.
+    """
+    if not video_id or not settings.get('checkpoint', CHECKPOINT_ENABLED):
+        return None
+    # A retry carries the same event; anything else that reuses the video_id starts over
+    fingerprint = make_cache_key('job-checkpoint', [clip['video_file_path'] for clip in clips],
+                                 settings.get('output_aspect_ratio', '16:9'), NORMALIZE_TARGET_FPS,
+                                 NORMALIZE_KEYFRAME_INTERVAL)
+    manifest = None
+    try:
+        rows = get_supabase().from_('final_videos').select('checkpoint').eq('id', video_id).execute().data
+        manifest = rows[0].get('checkpoint') if rows else None
+    except Exception as e:
+        logger.warning(f"Could not read checkpoint for {video_id}: {e}")
+    
+    return JobCheckpoint(
+        fingerprint,
+        remote_prefix=f"jobs/{video_id}",
+        manifest=manifest,
+        save_manifest=lambda data: get_supabase().from_('final_videos').update(
+            {'checkpoint': data}).eq('id', video_id).execute(),
+        remote_download=lambda remote_path, local_path: download_from_supabase_storage(
+            remote_path, Path(local_path), bucket=COMPILE_CACHE_BUCKET),
+        remote_upload=lambda local_path, remote_path: upload_to_supabase_storage(
+            local_path, remote_path, bucket=COMPILE_CACHE_BUCKET, upsert=True),
+        remote_remove=lambda paths: get_supabase().storage.from_(COMPILE_CACHE_BUCKET).remove(paths)
+    )
+
+
+def run_clip_pipeline(clips: list, music: dict, target_aspect: str, temp_path: Path,
+                      download_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+                      max_raw_clips: int = DEFAULT_PIPELINE_MAX_RAW_CLIPS,
+                      use_cache: bool = NORMALIZED_CACHE_ENABLED, normalize: bool = True,
+                      use_music_cache: bool = MUSIC_CACHE_ENABLED, signed_urls: dict = None,
+                      checkpoint: JobCheckpoint = None, etags: dict = None, input_mode: str = INPUT_MODE) -> dict:
+    """
+    Stream clips through download -> normalize instead of running the phases back to back.
+    
+    Each clip is handed to normalization as soon as its download finishes, and the
+    music download runs alongside clip work. At most `max_raw_clips` raw downloads
+    exist in /tmp at once: a slot is taken before a download starts and released
+    once that clip has been normalized. With the normalized-clip cache enabled a
+    hit skips both the raw download and the encode; misses are stored back in
+    the background. With normalize=False (single-pass compile) raw clips are
+    returned as-is for the compile step to normalize in its filter graph. With a
+    `checkpoint`, clips a previous attempt normalized are restored first and every
+    new normalized clip is recorded. With input_mode='http' normalization reads each
+    clip's signed URL directly (no raw file, no raw-clip slot); a clip whose HTTP
+    read fails is downloaded and normalized from disk instead.
+    
+    Cache stores (and their checkpoint records) are still running when this returns;
+    the result's 'cache_futures' go to wait_for_cache_uploads once the job's own
+    output is uploaded.
+    """
+    config = get_aspect_config(target_aspect)
+    # Single-pass compiles the raw clips, so they have to be on disk
+    http_input = input_mode == 'http' and normalize
+    normalize_plan = plan_normalize_concurrency(len(clips)) if normalize else {'processes': 1, 'threads': 0}
+    # Every in-flight normalization holds a raw clip, so leave room for downloads to run ahead
+    max_raw_clips = max(1, max_raw_clips, normalize_plan['processes'] + 1)
+    if not normalize:
+        # Raw clips are the compile inputs, all of them have to be on disk
+        max_raw_clips = max(1, len(clips))
+    raw_slots = threading.BoundedSemaphore(max_raw_clips)
+    cache = get_normalized_clip_cache() if use_cache and normalize else None
+    executor = PipelineExecutor({
+        'download': max(1, min(download_workers, len(clips))),
+        'normalize': normalize_plan['processes'],
+        'music': 1,
+        'cache': 2
+    })
+    cancel_event = executor.cancel_event
+    
+    logger.info(f"Starting pipelined processing of {len(clips)} clips "
+                f"({download_workers} download workers, max {max_raw_clips} raw clips on disk)")
+    if signed_urls is None:
+        signed_urls = sign_storage_urls([clip['video_file_path'] for clip in clips])
+    
+    def acquire_raw_slot():
+        # Poll so a blocked download notices cancellation instead of hanging
+        while not raw_slots.acquire(timeout=0.5):
+            if cancel_event.is_set():
+                raise PipelineCancelled("Download cancelled while waiting for a raw clip slot")
+    
+    def download_step(index: int, clip: dict) -> dict:
+        if checkpoint is not None and normalize:
+            restore_start = time.time()
+            normalized_path = str(temp_path / f"normalized_{index:03d}.mp4")
+            with stage('checkpoint_restore', item=index) as timing:
+                restored = checkpoint.restore('normalize', index, normalized_path)
+                if restored:
+                    timing.add_bytes(os.path.getsize(normalized_path))
+            if restored:
+                logger.info(f"♻️  Clip {index+1}/{len(clips)} restored from checkpoint")
+                get_scheduler().mark_done(index)
+                return {
+                    'index': index,
+                    'clip_id': clip.get('id'),
+                    'local_path': normalized_path,
+                    'bytes': 0,
+                    'seconds': round(time.time() - restore_start, 3),
+                    'cache': 'checkpoint'
+                }
         
-        # Get signed URL for download from music-tracks bucket
-        response = supabase.storage.from_('music-tracks').create_signed_url(file_path, 3600)  # 1 hour expiry
-        logger.info(f"Music signed URL response: {response}")
+        etag = None
+        if cache is not None:
+            lookup_start = time.time()
+            with stage('cache_lookup', item=index) as timing:
+                etag = (etags or {}).get(clip['video_file_path']) or get_storage_etag(clip['video_file_path'])
+                cache_key = normalized_clip_cache_key(clip['video_file_path'], etag, config, get_scheduler().profile)
+                tier = None
+                if cache_key:
+                    normalized_path = str(temp_path / f"normalized_{index:03d}.mp4")
+                    tier = cache.fetch(cache_key, normalized_path)
+                    if tier:
+                        timing.add_bytes(os.path.getsize(normalized_path))
+            if tier:
+                logger.info(f"⚡ Clip {index+1}/{len(clips)} served from {tier} normalized-clip cache")
+                get_scheduler().mark_done(index)
+                return {
+                    'index': index,
+                    'clip_id': clip.get('id'),
+                    'local_path': normalized_path,
+                    'bytes': 0,
+                    'seconds': round(time.time() - lookup_start, 3),
+                    'cache': tier
+                }
         
-        if not response.get('signedURL'):
-            # Check if there's an error in the response
-            if 'error' in response:
-                raise Exception(f"Supabase music storage error for {file_path}: {response['error']}")
-            else:
-                raise Exception(f"Failed to get signed URL for music {file_path}: {response}")
+        signed_url = signed_urls.get(clip['video_file_path'])
+        if http_input and signed_url:
+            # ffmpeg reads the clip itself during normalization
+            return {
+                'index': index,
+                'clip_id': clip.get('id'),
+                'local_path': None,
+                'url': signed_url,
+                'bytes': 0,
+                'seconds': 0.0,
+                'cache': None,
+                'etag': etag,
+                'input': 'http'
+            }
         
-        # Download music file
-        urllib.request.urlretrieve(response['signedURL'], local_path)
+        acquire_raw_slot()
+        try:
+            result = download_clip(index, clip, temp_path, len(clips), cancel_event, signed_url=signed_url)
+        except Exception:
+            raw_slots.release()
+            raise
+        result['cache'] = None
+        result['etag'] = etag
+        result['input'] = 'download'
+        return result
+    
+    def normalize_step(download_result: dict) -> str:
+        if download_result['cache']:
+            normalize_outcomes.append('checkpoint' if download_result['cache'] == 'checkpoint' else 'cached')
+            return download_result['local_path']
+        if not normalize:
+            normalize_outcomes.append('in_graph')
+            return download_result['local_path']
+        # The schedule may have moved to a faster profile since the cache lookup; key by the one used
+        profile = get_scheduler().profile
+        index = download_result['index']
+        normalized_path = None
+        holds_slot = download_result['input'] == 'download'
+        if download_result['input'] == 'http':
+            normalized_path = normalize_clip(download_result['url'], index, len(clips), config, str(temp_path),
+                                             normalize_plan['threads'], normalize_outcomes, profile=profile, remote=True)
+            if normalized_path is None:
+                # No raw-clip slot here: waiting on one while holding a normalize worker could deadlock,
+                # and at most one such download exists per normalize worker
+                logger.warning(f"Clip {index+1}/{len(clips)} HTTP input failed, downloading it instead")
+                download_result.update(download_clip(index, clips[index], temp_path, len(clips), cancel_event,
+                                                     signed_url=download_result['url']))
+                download_result['input'] = 'http_fallback'
+        if normalized_path is None:
+            try:
+                normalized_path = normalize_clip(download_result['local_path'], index, len(clips), config,
+                                                 str(temp_path), normalize_plan['threads'], normalize_outcomes,
+                                                 profile=profile)
+            finally:
+                if holds_slot:
+                    raw_slots.release()
+        # Only real encodes are cached, never the fallback-to-original
+        if normalized_path == download_result['local_path']:
+            return normalized_path
+        cache_key = None
+        if cache is not None:
+            cache_key = normalized_clip_cache_key(clips[index]['video_file_path'], download_result['etag'], config, profile)
+        if cache_key:
+            def store():
+                cache.store(cache_key, normalized_path)
+                if checkpoint is not None:
+                    # The remote cache entry doubles as the checkpoint artifact
+                    checkpoint.record('normalize', index, remote_path=cache.remote_path(cache_key))
+            cache_futures.append(executor.submit('cache', store))
+        elif checkpoint is not None:
+            cache_futures.append(executor.submit('cache', checkpoint.record, 'normalize', index, normalized_path))
+        return normalized_path
+    
+    def reported(step, progress_stage: str):
+        # Counts each finished clip towards the job's progress
+        def run(*args):
+            result = step(*args)
+            get_progress().advance(progress_stage, len(clips))
+            return result
+        return run
+    
+    download_futures = []
+    normalize_futures = []
+    cache_futures = []
+    normalize_outcomes = []
+    music_future = None
+    completed = False
+    try:
+        if music and music.get('file_path'):
+            logger.info(f"Music requested: {music}")
+            music_file = Path(get_scratch().track(temp_path / "music.mp3", 'music'))
+            music_future = executor.submit('music', fetch_music_track, music, music_file, use_music_cache, label='music')
+        else:
+            logger.info("No music requested or no file_path provided")
+        
+        for i, clip in enumerate(clips):
+            download_future = executor.submit('download', reported(download_step, 'download'), i, clip, label=i)
+            download_futures.append(download_future)
+            normalize_futures.append(executor.then(download_future, 'normalize', reported(normalize_step, 'normalize'),
+                                                   label=i))
+        
+        normalized_files = executor.wait_all(normalize_futures)
+        download_results = executor.wait_all(download_futures)
+        
+        music_path = None
+        music_track = None
+        if music_future is not None:
+            music_track = executor.wait_all([music_future])[0]
+            if music_file.exists():
+                logger.info(f"Music file downloaded successfully: {music_file.stat().st_size} bytes")
+                music_path = str(music_file)
+            else:
+                logger.error("Music file was not downloaded successfully")
+        
+        completed = True
+    finally:
+        if not completed:
+            # Wake any download still waiting on a slot before tearing the pools down
+            cancel_event.set()
+        # Cache uploads are best effort and stay off the critical path (see wait_for_cache_uploads)
+        executor.shutdown(detach=('cache',) if completed else ())
+    
+    timings = executor.timings()
+    logger.info(f"⏱️  PIPELINE: wall={timings['wall_seconds']:.1f}s, overlap={timings['overlap_seconds']:.1f}s, "
+                f"stages={json.dumps(timings['stages'])}")
+    
+    cache_stats = None
+    if cache is not None:
+        cache_stats = {
+            'local_hits': sum(1 for r in download_results if r['cache'] == 'local'),
+            'remote_hits': sum(1 for r in download_results if r['cache'] == 'remote'),
+            'misses': sum(1 for r in download_results if not r['cache']),
+            'local_size_mb': round(cache.local_size() / 1024 / 1024, 1)
+        }
+        logger.info(f"📦 Normalized-clip cache: {cache_stats}")
+    
+    input_stats = {
+        'mode': 'http' if http_input else 'download',
+        'http': sum(1 for r in download_results if r.get('input') == 'http'),
+        'http_fallbacks': sum(1 for r in download_results if r.get('input') == 'http_fallback'),
+        'downloaded': sum(1 for r in download_results if r.get('input') == 'download')
+    }
+    if http_input:
+        logger.info(f"🌊 Clip input: {input_stats}")
+    
+    return {
+        'normalized_files': normalized_files,
+        'download_results': download_results,
+        'music_file': music_path,
+        'music_track': music_track,
+        'timings': timings,
+        'cache': cache_stats,
+        'input': input_stats,
+        'normalize_paths': count_outcomes(normalize_outcomes),
+        'cache_futures': list(cache_futures)
+    }
+
+def download_music_from_supabase_storage(file_path: str, local_path: Path):
+    """Download music file from Supabase music-tracks storage bucket"""
+    try:
+        logger.info(f"Attempting to download music: {file_path}")
+        download_from_supabase_storage(file_path, local_path, bucket='music-tracks')
         logger.info(f"Successfully downloaded music {file_path} to {local_path}")
         
     except Exception as e:
         logger.error(f"Failed to download music {file_path}: {str(e)}")
         raise
 
+MUSIC_ENCODER_ARGS = ['-c:a', 'aac', '-b:a', '96k']
+
+_music_track_cache = None
+_music_rendition_cache = None
+
+
+def get_music_caches() -> tuple:
+    """Lazily create the (track, rendition) music caches; both local tiers survive warm invocations"""
+    global _music_track_cache, _music_rendition_cache
+    if _music_track_cache is None:
+        max_bytes = MUSIC_CACHE_MAX_MB * 1024 * 1024
+        # Source tracks already live in the music-tracks bucket, so they only get a local tier
+        _music_track_cache = MediaCache(os.path.join(MUSIC_CACHE_DIR, 'tracks'), max_bytes, suffix='.mp3')
+        _music_rendition_cache = MediaCache(
+            local_dir=os.path.join(MUSIC_CACHE_DIR, 'renditions'),
+            max_local_bytes=max_bytes,
+            suffix='.m4a',
+            remote_prefix='music/v1',
+            remote_download=lambda remote_path, local_path: download_from_supabase_storage(
+                remote_path, Path(local_path), bucket=COMPILE_CACHE_BUCKET),
+            remote_upload=lambda local_path, remote_path: upload_to_supabase_storage(
+                local_path, remote_path, bucket=COMPILE_CACHE_BUCKET, content_type='audio/mp4', upsert=True)
+        )
+    return _music_track_cache, _music_rendition_cache
+
+
+def fetch_music_track(music: dict, local_path: Path, use_cache: bool = MUSIC_CACHE_ENABLED) -> dict:
+    """
+    Materialize the requested music track at local_path, from the local track cache when possible.
+    Returns {path, cache, source_key}; source_key identifies the track version for rendition keys.
+    """
+    with stage('music', item='track') as timing:
+        result = _fetch_music_track(music, local_path, use_cache)
+        if local_path.exists():
+            timing.add_bytes(local_path.stat().st_size)
+        return result
+
+
+def _fetch_music_track(music: dict, local_path: Path, use_cache: bool) -> dict:
+    file_path = music['file_path']
+    source_key = None
+    if use_cache:
+        etag = get_storage_etag(file_path, bucket='music-tracks')
+        if etag:
+            source_key = make_cache_key('music-track', music.get('id'), file_path, etag)
+    
+    if source_key is not None:
+        track_cache, _ = get_music_caches()
+        if track_cache.fetch(source_key, str(local_path)):
+            logger.info(f"🎵 Music track {file_path} served from local cache")
+            return {'path': str(local_path), 'cache': 'local', 'source_key': source_key}
+    
+    download_music_from_supabase_storage(file_path, local_path)
+    if source_key is not None and local_path.exists():
+        track_cache.store(source_key, str(local_path), upload=False)
+    return {'path': str(local_path), 'cache': None, 'source_key': source_key}
+
+
+def music_rendition_duration(video_duration: float) -> float:
+    """
+    Video duration rounded up to the rendition bucket. Never shorter than the video, so
+    the music runs to the last frame; the mux cuts the copied stream with -t.
+    """
+    step = MUSIC_DURATION_BUCKET_SECONDS
+    if step <= 0:
+        return round(video_duration, 3)
+    # The small tolerance keeps float noise (e.g. 12.000000001s) in its own bucket
+    return max(step, math.ceil(video_duration / step - 1e-6) * step)
+
+
+def prepare_music_rendition(music_file: str, source_key: str, video_duration: float, music_volume: float,
+                            temp_dir: str) -> dict:
+    """
+    Produce the final music stream for a compile: trimmed, volume-applied, faded in/out and
+    AAC-encoded, ready to mux with -c:a copy. The stream runs to the rounded-up duration
+    bucket, but its fade out ends exactly at the video's last frame, where the mux cuts it.
+    Renditions are cached per (track, duration bucket, fade-out start, volume). Returns {path, cache, duration}, or None when the
+    rendition cannot be produced (the compile then processes the music in its own graph).
+    """
+    with stage('music', item='rendition') as timing:
+        rendition = _prepare_music_rendition(music_file, source_key, video_duration, music_volume, temp_dir)
+        if rendition is not None:
+            timing.add_bytes(os.path.getsize(rendition['path']))
+        return rendition
+
+
+def _prepare_music_rendition(music_file: str, source_key: str, video_duration: float, music_volume: float,
+                             temp_dir: str) -> dict:
+    duration = music_rendition_duration(video_duration)
+    volume = round(music_volume, 2)
+    # The -t cut lands on the video's end, so the fade has to finish there, not at the bucket's end
+    audio_filter = render_chain(music_filters(duration, volume, fade_out_end=round(video_duration, 3)))
+    rendition_path = get_scratch().track(os.path.join(temp_dir, 'music_rendition.m4a'), 'music')
+    
+    key = None
+    if source_key is not None:
+        key = make_cache_key('music-rendition', source_key, duration, volume, audio_filter, MUSIC_ENCODER_ARGS)
+        _, rendition_cache = get_music_caches()
+        hit = rendition_cache.fetch(key, rendition_path)
+        if hit:
+            logger.info(f"🎵 Music rendition ({duration}s @ {volume}) served from {hit} cache")
+            return {'path': rendition_path, 'cache': hit, 'duration': duration}
+    
+    if os.path.exists(rendition_path):
+        os.remove(rendition_path)  # May be a hard link into the cache; never write through it
+    try:
+        run_ffmpeg(['./bin/ffmpeg', '-y', '-i', music_file, '-vn', '-af', audio_filter]
+                   + MUSIC_ENCODER_ARGS + ['-movflags', '+faststart', rendition_path],
+                   timeout=get_scheduler().cap_timeout(60), stage='Music rendition')
+    except Exception as e:
+        logger.warning(f"Music rendition failed, mixing music in the compile graph instead: {e}")
+        return None
+    
+    if key is not None:
+        rendition_cache.store(key, rendition_path)
+    logger.info(f"🎵 Music rendition encoded ({duration}s @ {volume})")
+    return {'path': rendition_path, 'cache': 'encoded' if key is not None else None, 'duration': duration}
+
 def generate_public_url(file_path: str) -> str:
     """Generate public URL for a file in the final-videos bucket"""
     try:
-        # Get the Supabase project URL from environment
-        supabase_url = get_parameter('url')
+        # Get the Supabase project URL (cached Parameter Store value)
+        supabase_url, _ = get_supabase_credentials()
         
         # Format: https://[project-id].supabase.co/storage/v1/object/public/final-videos/[file-path]
         public_url = f"{supabase_url}/storage/v1/object/public/final-videos/{file_path}"
@@ -385,16 +1553,20 @@ def generate_public_url(file_path: str) -> str:
         # Return a fallback URL structure
         return f"https://project.supabase.co/storage/v1/object/public/final-videos/{file_path}"
 
-def upload_to_supabase_storage(local_path: str, storage_path: str):
+def upload_to_supabase_storage(local_path: str, storage_path: str, bucket: str = 'final-videos',
+                               content_type: str = 'video/mp4', upsert: bool = False, cache_control: str = None):
     """Upload file from local path to Supabase storage"""
     try:
+        file_options = {"content-type": content_type}
+        if upsert:
+            file_options["upsert"] = "true"
+        if cache_control:
+            file_options["cache-control"] = cache_control
         with open(local_path, 'rb') as file:
-            response = supabase.storage.from_('final-videos').upload(
+            response = get_supabase().storage.from_(bucket).upload(
                 storage_path, 
                 file,
-                {
-                    "content-type": "video/mp4"
-                }
+                file_options
             )
             
             # Check if upload was successful
@@ -410,142 +1582,533 @@ def upload_to_supabase_storage(local_path: str, storage_path: str):
         logger.error(f"Failed to upload to {storage_path}: {str(e)}")
         raise
 
-def get_video_duration(video_file: str) -> float:
-    """Get video duration in seconds using ffprobe"""
-    try:
-        cmd = [
-            './bin/ffprobe', 
-            '-v', 'quiet',
-            '-show_entries', 'format=duration',
-            '-of', 'csv=p=0',
-            video_file
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0 and result.stdout.strip():
-            duration = float(result.stdout.strip())
-            logger.info(f"Video duration for {video_file}: {duration} seconds")
-            return duration
-        else:
-            logger.warning(f"Could not get duration for {video_file}, defaulting to 5 seconds")
-            return 5.0  # Default duration for clips
-            
-    except Exception as e:
-        logger.warning(f"Error getting video duration: {str(e)}, defaulting to 5 seconds")
-        return 5.0
+def open_hls_publisher(local_dir: str, remote_dir: str, video_id: str, user_id: str) -> HlsPublisher:
+    """
+    Start an HlsPublisher for one compile attempt that keeps the final_videos row
+    in step: the row advertises the playlist once it is live and is cleared again
+    before an aborted attempt's segments are deleted.
+    """
+    def publish_playlist_url(remote_playlist_path):
+        if video_id:
+            playlist_url = generate_public_url(remote_playlist_path)
+            get_supabase().from_('final_videos').update({
+                'user_id': user_id,
+                'hls_playlist_url': playlist_url
+            }).eq('id', video_id).execute()
+            logger.info(f"📺 Progressive playback available: {playlist_url}")
+    
+    def withdraw_playlist_url(remote_playlist_path):
+        # Only while the row still advertises this attempt's playlist, which is about to be deleted
+        if video_id:
+            get_supabase().from_('final_videos').update({
+                'user_id': user_id,
+                'hls_playlist_url': None
+            }).eq('id', video_id).eq('hls_playlist_url', generate_public_url(remote_playlist_path)).execute()
+    
+    return HlsPublisher(
+        local_dir,
+        remote_dir,
+        upload=lambda local_path, remote_path, content_type, cache_control: upload_to_supabase_storage(
+            local_path, remote_path, content_type=content_type, upsert=True, cache_control=cache_control),
+        on_first_playlist=publish_playlist_url,
+        on_abort=withdraw_playlist_url,
+        # A failed attempt's segments are deleted before the fallback publishes its own
+        remove=lambda remote_paths: get_supabase().storage.from_('final-videos').remove(remote_paths)
+    ).start()
 
+# Target resolutions and scale filters for normalization (optimized for memory)
+ASPECT_CONFIGS = {
+    "16:9": {
+        "resolution": "1280:720",  # Reduced from 1920:1080 for memory efficiency
+        "scale_filter": "scale=1280:720:force_original_aspect_ratio=decrease,pad=1280:720:(ow-iw)/2:(oh-ih)/2:black"
+    },
+    "9:16": {
+        "resolution": "720:1280", # Reduced from 1080:1920 for memory efficiency
+        "scale_filter": "scale=720:1280:force_original_aspect_ratio=decrease,pad=720:1280:(ow-iw)/2:(oh-ih)/2:black"
+    },
+    "1:1": {
+        "resolution": "720:720",  # Reduced from 1080:1080 for memory efficiency
+        "scale_filter": "scale=720:720:force_original_aspect_ratio=decrease,pad=720:720:(ow-iw)/2:(oh-ih)/2:black"
+    }
+}
 
-def normalize_clips_streaming(clip_files: list, target_aspect: str, temp_dir: str) -> list:
-    """Normalize clips one at a time with memory optimization and cleanup"""
-    try:
-        logger.info(f"Starting streaming normalization to {target_aspect}")
-        normalized_files = []
-        
-        # Define target resolutions and scale filters (optimized for memory)
-        aspect_configs = {
-            "16:9": {
-                "resolution": "1280:720",  # Reduced from 1920:1080 for memory efficiency
-                "scale_filter": "scale=1280:720:force_original_aspect_ratio=decrease,pad=1280:720:(ow-iw)/2:(oh-ih)/2:black"
-            },
-            "9:16": {
-                "resolution": "720:1280", # Reduced from 1080:1920 for memory efficiency
-                "scale_filter": "scale=720:1280:force_original_aspect_ratio=decrease,pad=720:1280:(ow-iw)/2:(oh-ih)/2:black"
-            },
-            "1:1": {
-                "resolution": "720:720",  # Reduced from 1080:1080 for memory efficiency
-                "scale_filter": "scale=720:720:force_original_aspect_ratio=decrease,pad=720:720:(ow-iw)/2:(oh-ih)/2:black"
-            }
-        }
-        
-        if target_aspect not in aspect_configs:
-            logger.warning(f"Unknown aspect ratio {target_aspect}, defaulting to 16:9")
-            target_aspect = "16:9"
-        
-        config = aspect_configs[target_aspect]
-        logger.info(f"Using memory-optimized configuration: {config}")
-        
-        for i, clip_file in enumerate(clip_files):
-            log_memory_usage("NORMALIZE_CLIP_START", f"Clip {i+1}/{len(clip_files)}")
-            
-            output_file = os.path.join(temp_dir, f"normalized_{i:03d}.mp4")
-            
-            logger.info(f"Normalizing clip {i+1}/{len(clip_files)}: {clip_file} -> {output_file}")
-            
-            # Memory-optimized FFmpeg command
-            cmd = [
-                './bin/ffmpeg', '-y',  # Overwrite output files
-                '-i', clip_file,
-                '-vf', config["scale_filter"],
-                '-c:v', 'libx264',
-                '-preset', 'faster',  # Faster preset for lower memory usage
-                '-crf', '24',  # Slightly higher CRF for smaller files
-                '-pix_fmt', 'yuv420p',
-                '-movflags', '+faststart',
-                '-bufsize', '1M',  # Limit buffer size for memory efficiency
-                '-maxrate', '2M',  # Limit bitrate for memory efficiency
-                output_file
-            ]
-            
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=120  # Reduced timeout per clip
-            )
-            
-            if result.returncode != 0:
-                logger.error(f"Failed to normalize clip {clip_file}: {result.stderr}")
-                # Fallback: use original clip if normalization fails
-                logger.warning(f"Using original clip as fallback: {clip_file}")
-                normalized_files.append(clip_file)
-            else:
-                logger.info(f"Successfully normalized clip {i+1}: {output_file}")
-                # Verify output file exists and has reasonable size
-                if os.path.exists(output_file) and os.path.getsize(output_file) > 1000:
-                    normalized_files.append(output_file)
-                    
-                    # CRITICAL: Remove original clip immediately after successful normalization
-                    try:
-                        os.remove(clip_file)
-                        logger.info(f"✅ Removed original clip: {clip_file}")
-                    except Exception as e:
-                        logger.warning(f"Failed to remove original clip {clip_file}: {e}")
-                else:
-                    logger.warning(f"Normalized file is too small or doesn't exist, using original: {clip_file}")
-                    normalized_files.append(clip_file)
-        
-            # Force cleanup after each clip
-            cleanup_and_gc(f"CLIP_{i+1}_COMPLETE")
-            
-            # Emergency cleanup check
-            emergency_memory_cleanup()
-        
-        logger.info(f"Streaming normalization completed. Normalized {len(normalized_files)} clips")
-        return normalized_files
-        
-    except Exception as e:
-        logger.error(f"Error in streaming normalization: {str(e)}")
-        # Fallback: return original clips if normalization fails completely
-        logger.warning("Falling back to original clips without normalization")
-        return clip_files
 
+def normalize_encoder_args(profile: EncoderProfile) -> list:
+    """Encoder settings for normalized clips (also part of the normalized-clip cache key)"""
+    return [
+        '-c:v', 'libx264',
+        '-preset', profile.preset,  # Chosen by the deadline scheduler ('faster' unless behind)
+        '-crf', str(profile.crf),
+        '-pix_fmt', 'yuv420p',
+        '-movflags', '+faststart',
+        '-bufsize', '1M',  # Limit buffer size for memory efficiency
+        '-maxrate', '2M',  # Limit bitrate for memory efficiency
+        '-force_key_frames', f'expr:gte(t,n_forced*{NORMALIZE_KEYFRAME_INTERVAL})',  # Regular cut points for smart render
+    ]
 
-def compile_video(clip_files: list, music_file: str, output_file: str, settings: dict, music_volume: float = 0.3):
-    """Compile video using FFmpeg with transitions and music"""
-    try:
-        logger.info(f"Starting FFmpeg video compilation with {len(clip_files)} clips")
-        logger.info(f"Settings: {settings}")
-        logger.info(f"Music file: {music_file}")
-        
-        if not clip_files:
-            raise Exception("No clip files provided for compilation")
-        
-        # Get transition settings
-        transition_type = settings.get('transition_type', 'fade')
+
+def get_aspect_config(target_aspect: str) -> dict:
+    """
+    Return the normalization config for an aspect ratio, defaulting to 16:9,
+    at the resolution tier of the job's encoder profile.
+    """
+    if target_aspect not in ASPECT_CONFIGS:
+        logger.warning(f"Unknown aspect ratio {target_aspect}, defaulting to 16:9")
+        target_aspect = "16:9"
+    config = ASPECT_CONFIGS[target_aspect]
+    scale = get_scheduler().profile.scale
+    if scale == 1.0:
+        return config
+    # Reduced tier: same aspect, even dimensions
+    width, height = (int(int(x) * scale) // 2 * 2 for x in config['resolution'].split(':'))
+    return {
+        "resolution": f"{width}:{height}",
+        "scale_filter": f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black"
+    }
+
+
+def probe_clip_seconds(clips: list, signed_urls: dict) -> list:
+    """
+    Per-clip durations from header-only probes of the signed URLs, all clips at once;
+    clips that cannot be probed count as SCHEDULE_CLIP_SECONDS_ESTIMATE. The probes are
+    memoized per URL, so HTTP-input normalization reuses them instead of probing again.
+    """
+    probes = probe_remote_media_many([signed_urls.get(clip['video_file_path']) for clip in clips],
+                                     http_input_args())
+    return [media.duration if media is not None else SCHEDULE_CLIP_SECONDS_ESTIMATE for media in probes]
+
+
+def plan_encode_schedule(clip_seconds: list, compile_mode: str, smart_render: bool = SMART_RENDER_ENABLED,
+                         requested_profile: str = None, scale: float = None) -> EncoderProfile:
+    """
+    Estimate the job's encode work and pick the encoder profile.
+    
+    Two-pass encodes every clip once, then the compile re-encodes the whole timeline (or,
+    with smart render, roughly the keyframe intervals under the two fades); single-pass
+    is one encode of the whole timeline. Smart render copies the normalized clips, so
+    its preset is pinned: a mid-job switch would only force the full re-encode.
+    """
+    total_seconds = sum(clip_seconds)
+    if compile_mode == 'single_pass':
+        return get_scheduler().plan([], total_seconds, profile_name=requested_profile, scale=scale)
+    compile_seconds = total_seconds
+    if smart_render:
+        compile_seconds = min(total_seconds, 4 * float(NORMALIZE_KEYFRAME_INTERVAL) + 1)
+    return get_scheduler().plan(clip_seconds, compile_seconds, profile_name=requested_profile, scale=scale,
+                                pin_preset=smart_render)
+
+
+def get_normalize_filter(config: dict) -> str:
+    """Full -vf chain for normalization: scale/pad, square pixels and optional constant fps"""
+    video_filter = f"{config['scale_filter']},setsar=1"
+    if NORMALIZE_TARGET_FPS:
+        video_filter += f",fps={NORMALIZE_TARGET_FPS}"
+    return video_filter
+
+
+def normalize_filters(config: dict) -> list:
+    """The normalization chain as filter-graph nodes (for single-pass graphs)"""
+    return parse_chain(get_normalize_filter(config))
+
+
+def fade_filters(fade_duration: float, fade_out_start: float, fade_in: bool = True, fade_out: bool = True) -> list:
+    """Video fade in from 0 and/or fade out from fade_out_start"""
+    fades = []
+    if fade_in:
+        fades.append(Filter('fade', options={'t': 'in', 'st': 0, 'd': fade_duration}))
+    if fade_out:
+        fades.append(Filter('fade', options={'t': 'out', 'st': fade_out_start, 'd': fade_duration}))
+    return fades
+
+
+def music_filters(duration: float, volume: float, fade_out_end: float = None) -> list:
+    """
+    Music bed for a video of `duration`: trimmed, volume-adjusted, 1s fade in and out.
+    The fade out ends at `fade_out_end` (default: `duration`), for beds trimmed longer
+    than the video they are muxed with.
+    """
+    fade_out_end = duration if fade_out_end is None else fade_out_end
+    return [
+        Filter('atrim', options={'duration': duration}),
+        Filter('volume', (volume,)),
+        Filter('afade', options={'t': 'in', 'st': 0, 'd': 1}),
+        Filter('afade', options={'t': 'out', 'st': max(1, fade_out_end-1), 'd': 1})
+    ]
+
+
+def clip_matches_target(media: MediaInfo, config: dict) -> tuple:
+    """
+    Check whether a probed clip already is what normalization would produce.
+    Returns (matches, reason) where reason names the first mismatch.
+    """
+    if media is None or not media.video:
+        return False, 'probe failed'
+    stream = media.video
+    target_width, target_height = (int(x) for x in config['resolution'].split(':'))
+    if stream.get('codec_name') != 'h264':
+        return False, f"codec {stream.get('codec_name')}"
+    if (stream.get('width'), stream.get('height')) != (target_width, target_height):
+        return False, f"resolution {stream.get('width')}x{stream.get('height')}"
+    if stream.get('pix_fmt') != 'yuv420p':
+        return False, f"pix_fmt {stream.get('pix_fmt')}"
+    if stream.get('sample_aspect_ratio') not in (None, '1:1', '0:1', 'N/A'):
+        return False, f"SAR {stream.get('sample_aspect_ratio')}"
+    if media.rotation:
+        # The copy would keep the display matrix, so players show the clip sideways or re-rotate it
+        return False, f"rotated {media.rotation}°"
+    frame_rate = media.fps
+    if frame_rate <= 0 or abs(frame_rate - media.avg_fps) > 0.01:
+        return False, 'variable frame rate'
+    if NORMALIZE_TARGET_FPS and abs(frame_rate - parse_rate(NORMALIZE_TARGET_FPS)) > 0.01:
+        return False, f"frame rate {stream.get('r_frame_rate')}"
+    # Smart render cuts at keyframes, so copied clips need the same cut points an encode forces
+    # (unknown for remote probes, which skip packets: the remuxed copy is checked instead)
+    keyframe_gap = media.max_keyframe_gap()
+    if keyframe_gap is not None and keyframe_gap > float(NORMALIZE_KEYFRAME_INTERVAL) + 1 / frame_rate + 0.01:
+        return False, f"keyframe interval {keyframe_gap:.2f}s"
+    return True, 'matches target'
+
+
+def get_cpu_count() -> int:
+    """CPUs actually available to this process (Lambda scales vCPUs with memory)"""
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except (AttributeError, OSError):
+        return max(1, psutil.cpu_count(logical=True) or 1)
+
+
+def get_available_memory_mb() -> float:
+    """Memory we can still hand to ffmpeg children, capped by the Lambda memory size"""
+    available_mb = psutil.virtual_memory().available / 1024 / 1024
+    lambda_memory = os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+    if lambda_memory:
+        lambda_headroom = float(lambda_memory) - get_memory_usage()['rss_mb']
+        available_mb = min(available_mb, lambda_headroom)
+    return max(0.0, available_mb)
+
+
+@contextmanager
+def job_scratch_space(temp_dir: str):
+    """Scratch accounting for a job's temp dir; the local cache tiers give up unused entries when space runs short"""
+    with scratch_space(temp_dir, SCRATCH_BUDGET_MB * 1024 * 1024) as scratch:
+        if NORMALIZED_CACHE_ENABLED:
+            scratch.add_evictor(get_normalized_clip_cache().free_space)
+        if MUSIC_CACHE_ENABLED:
+            for cache in get_music_caches():
+                scratch.add_evictor(cache.free_space)
+        yield scratch
+
+
+def predict_encode_bytes(seconds: float, audio_bits: int = 128000) -> int:
+    """Upper estimate of an encode's size: the 2M -maxrate video cap plus AAC audio, 10% container slack"""
+    return int(seconds * (2000000 + audio_bits) / 8 * 1.1)
+
+
+def plan_normalize_concurrency(clip_count: int, max_processes: int = NORMALIZE_MAX_PROCESSES) -> dict:
+    """
+    Decide how many ffmpeg normalizations to run at once and how many
+    threads each may use.
+    
+    Processes are bounded by CPUs, by available memory (NORMALIZE_MEMORY_PER_PROCESS_MB
+    per encoder) and by the number of clips; the CPUs are then split evenly
+    between them through -threads.
+    """
+    cpu_count = get_cpu_count()
+    available_mb = get_available_memory_mb()
+    memory_bound = max(1, int(available_mb // NORMALIZE_MEMORY_PER_PROCESS_MB))
+    
+    processes = min(cpu_count, memory_bound, max(1, clip_count))
+    if max_processes > 0:
+        processes = min(processes, max_processes)
+    processes = max(1, processes)
+    threads = max(1, cpu_count // processes)
+    
+    plan = {
+        'processes': processes,
+        'threads': threads,
+        'cpu_count': cpu_count,
+        'available_memory_mb': round(available_mb, 1)
+    }
+    logger.info(f"⚙️  Normalize plan: {plan}")
+    return plan
+
+
+def http_input_args() -> list:
+    """ffmpeg input options for a signed URL: ranged reads that reconnect after drops and stalls"""
+    return [
+        '-reconnect', '1',
+        '-reconnect_streamed', '1',
+        '-reconnect_on_network_error', '1',
+        '-reconnect_delay_max', str(HTTP_INPUT_RECONNECT_DELAY_MAX),
+        '-rw_timeout', str(int(HTTP_INPUT_RW_TIMEOUT_SECONDS * 1000000)),  # Microseconds
+    ]
+
+
+def remux_clip(clip_file: str, output_file: str, input_args: list = None, label: str = None) -> bool:
+    """Stream-copy a clip into a fresh faststart MP4 without decoding"""
+    label = label or clip_file
+    cmd = ['./bin/ffmpeg', '-y'] + list(input_args or []) + [
+        '-i', clip_file,
+        # Only the streams normalization would keep (no data, subtitle or cover-art tracks)
+        '-map', '0:v:0',
+        '-map', '0:a:0?',
+        '-c', 'copy',
+        '-movflags', '+faststart',
+        output_file
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=get_scheduler().cap_timeout(60))
+    except subprocess.TimeoutExpired:
+        logger.warning(f"Timed out remuxing {label}")
+        return False
+    if result.returncode != 0:
+        logger.warning(f"Remux failed for {label}: {result.stderr.replace(clip_file, label)}")
+        return False
+    return os.path.exists(output_file) and os.path.getsize(output_file) > 1000
+
+
+def normalize_clip(clip_file: str, index: int, total: int, config: dict, temp_dir: str, threads: int = 0,
+                   outcomes: list = None, profile: EncoderProfile = None, remote: bool = False) -> str:
+    """
+    Normalize a single clip to the target config.
+    Returns the normalized path, or the original clip if normalization fails.
+    
+    Clips that already match the target (see clip_matches_target) are remuxed
+    with -c copy instead of re-encoded. The path taken ('stream_copy', 'encoded'
+    or 'fallback') is appended to `outcomes` when given. Encodes use `profile`
+    (default: the schedule's current one) and report their speed to the schedule.
+    
+    With remote=True clip_file is a signed URL that ffmpeg reads over HTTP. A failed
+    or truncated read returns None instead of the original, so the caller can
+    download the clip and normalize the local copy.
+    """
+    with stage('normalize', item=index) as timing:
+        output_file = _normalize_clip(clip_file, index, total, config, temp_dir, threads, outcomes,
+                                      profile or get_scheduler().profile, remote)
+        if output_file is not None and output_file != clip_file:
+            timing.add_bytes(os.path.getsize(output_file))
+        return output_file
+
+
+def _normalize_clip(clip_file: str, index: int, total: int, config: dict, temp_dir: str, threads: int,
+                    outcomes: list, profile: EncoderProfile, remote: bool = False) -> str:
+    scheduler = get_scheduler()
+    # Signed URL tokens stay out of the logs
+    name = clip_file.split('?', 1)[0] if remote else clip_file
+    input_args = http_input_args() if remote else []
+    
+    def record(outcome):
+        if outcomes is not None:
+            outcomes.append(outcome)
+        if outcome != 'encoded':
+            scheduler.mark_done(index)
+    
+    def fall_back(message):
+        logger.warning(message)
+        if remote:
+            return None  # The caller downloads the clip and tries again locally
+        logger.warning(f"Using original clip as fallback: {clip_file}")
+        record('fallback')
+        return clip_file
+    
+    def read_complete(path):
+        # A dropped connection can end the input early without ffmpeg failing
+        if not remote:
+            return True
+        try:
+            produced = probe_media(path).duration
+        except MediaProbeError:
+            return False
+        return produced >= media.duration - max(1.0, media.duration * 0.05)
+    
+    def copy_usable(path):
+        # Remote probes have no keyframe list, so a copy's cut points are checked on the result
+        if not read_complete(path):
+            return False
+        if not remote:
+            return True
+        usable, problem = clip_matches_target(probe_media(path), config)
+        if not usable:
+            logger.info(f"Stream copy of clip {index+1}/{total} discarded ({problem})")
+        return usable
+    
+    log_memory_usage("NORMALIZE_CLIP_START", f"Clip {index+1}/{total}")
+    
+    scratch = get_scratch()
+    output_file = scratch.track(os.path.join(temp_dir, f"normalized_{index:03d}.mp4"), 'normalized')
+    
+    # Duration drives the timeout and the speed measurement (probe results are cached)
+    try:
+        media = probe_remote_media(clip_file, input_args, label=name) if remote else probe_media(clip_file)
+    except MediaProbeError as e:
+        logger.warning(str(e))
+        media = None
+    if remote and media is None:
+        return fall_back(f"Clip {index+1}/{total} could not be probed over HTTP")
+    media_seconds = media.duration if media is not None else scheduler.clip_seconds.get(index, SCHEDULE_CLIP_SECONDS_ESTIMATE)
+    cpu_share = min(1.0, threads / get_cpu_count()) if threads > 0 else 1.0
+    
+    if STREAM_COPY_ENABLED:
+        matches, reason = clip_matches_target(media, config)
+        copied = False
+        if matches:
+            # A remux is about as large as its input
+            with scratch.reserve(media.size or predict_encode_bytes(media_seconds), f"remux of clip {index+1}",
+                                 path=output_file):
+                copied = remux_clip(clip_file, output_file, input_args, name)
+        if copied and copy_usable(output_file):
+            logger.info(f"⚡ Clip {index+1}/{total} already matches target, stream-copied: {output_file}")
+            record('stream_copy')
+            if not remote:
+                try:
+                    os.remove(clip_file)
+                except Exception as e:
+                    logger.warning(f"Failed to remove original clip {clip_file}: {e}")
+            return output_file
+        if copied:
+            reason = 'stream copy unusable'
+        logger.info(f"Clip {index+1}/{total} needs re-encode ({reason})")
+    
+    logger.info(f"Normalizing clip {index+1}/{total} ({profile.name} profile"
+                f"{', over HTTP' if remote else ''}): {name} -> {output_file}")
+    
+    # Memory-optimized FFmpeg command
+    cmd = ['./bin/ffmpeg', '-y'] + input_args + [  # Overwrite output files
+        '-i', clip_file,
+        '-vf', get_normalize_filter(config),
+    ] + normalize_encoder_args(profile)
+    if threads > 0:
+        cmd.extend(['-threads', str(threads)])  # Share CPUs with parallel encodes
+    cmd.append(output_file)
+    
+    reservation = scratch.reserve(predict_encode_bytes(media_seconds), f"normalization of clip {index+1}",
+                                  path=output_file)
+    encode_start = time.time()
+    try:
+        result = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            # Sized from the clip's duration and measured encode speed, never past the deadline
+            timeout=scheduler.timeout_for(media_seconds, share=cpu_share)
+        )
+    except subprocess.TimeoutExpired:
+        logger.error(f"Timed out normalizing clip {name}")
+        return fall_back(f"Clip {index+1}/{total} normalization timed out")
+    finally:
+        reservation.release()
+    
+    if result.returncode != 0:
+        logger.error(f"Failed to normalize clip {name}: {result.stderr.replace(clip_file, name)}")
+        # Fallback: use original clip if normalization fails
+        return fall_back(f"Clip {index+1}/{total} normalization failed")
+    
+    logger.info(f"Successfully normalized clip {index+1}: {output_file}")
+    # Verify output file exists and has reasonable size
+    if not (os.path.exists(output_file) and os.path.getsize(output_file) > 1000):
+        return fall_back(f"Normalized file is too small or doesn't exist: {output_file}")
+    if not read_complete(output_file):
+        return fall_back(f"Clip {index+1}/{total} HTTP read ended early ({media.duration:.1f}s expected)")
+    
+    record('encoded')
+    scheduler.record_encode(media_seconds, time.time() - encode_start, profile, share=cpu_share, index=index)
+    
+    if remote:
+        return output_file
+    
+    # CRITICAL: Remove original clip immediately after successful normalization
+    try:
+        os.remove(clip_file)
+        logger.info(f"✅ Removed original clip: {clip_file}")
+    except Exception as e:
+        logger.warning(f"Failed to remove original clip {clip_file}: {e}")
+    
+    return output_file
+
+
+def count_outcomes(outcomes: list) -> dict:
+    """Tally of normalization paths taken, e.g. {'encoded': 3, 'stream_copy': 2}"""
+    counts = {}
+    for outcome in outcomes:
+        counts[outcome] = counts.get(outcome, 0) + 1
+    return counts
+
+
+def normalize_clips_streaming(clip_files: list, target_aspect: str, temp_dir: str, parallel: bool = True,
+                              outcomes: list = None) -> list:
+    """
+    Normalize clips with memory optimization and cleanup.
+    In parallel mode several ffmpeg processes run at once (see plan_normalize_concurrency);
+    output order always matches the input order.
+    """
+    try:
+        logger.info(f"Starting streaming normalization to {target_aspect}")
+        
+        config = get_aspect_config(target_aspect)
+        logger.info(f"Using memory-optimized configuration: {config}")
+        
+        plan = plan_normalize_concurrency(len(clip_files)) if parallel else {'processes': 1, 'threads': 0}
+        
+        def normalize_one(i: int, clip_file: str) -> str:
+            normalized_file = normalize_clip(clip_file, i, len(clip_files), config, temp_dir, plan['threads'], outcomes)
+            get_progress().advance('normalize', len(clip_files))
+            return normalized_file
+        
+        if plan['processes'] <= 1:
+            normalized_files = []
+            for i, clip_file in enumerate(clip_files):
+                normalized_files.append(normalize_one(i, clip_file))
+            
+                # Per-clip memory checkpoint
+                memory_checkpoint(f"CLIP_{i+1}_COMPLETE")
+                
+                # Emergency cleanup check
+                emergency_memory_cleanup()
+        else:
+            logger.info(f"Running {plan['processes']} parallel normalizations with {plan['threads']} threads each")
+            with ThreadPoolExecutor(max_workers=plan['processes'], thread_name_prefix='normalize') as executor:
+                futures = [executor.submit(normalize_one, i, clip_file) for i, clip_file in enumerate(clip_files)]
+                # Collect in submission order so output order matches input order
+                normalized_files = [future.result() for future in futures]
+            emergency_memory_cleanup()
+        
+        logger.info(f"Streaming normalization completed. Normalized {len(normalized_files)} clips")
+        return normalized_files
+        
+    except Exception as e:
+        logger.error(f"Error in streaming normalization: {str(e)}")
+        # Fallback: return original clips if normalization fails completely
+        logger.warning("Falling back to original clips without normalization")
+        return clip_files
+
+
+def compile_video(clip_files: list, music_file: str, output_file: str, settings: dict, music_volume: float = 0.3):
+    """Compile video using FFmpeg with transitions and music"""
+    try:
+        logger.info(f"Starting FFmpeg video compilation with {len(clip_files)} clips")
+        logger.info(f"Settings: {settings}")
+        logger.info(f"Music file: {music_file}")
+        
+        if not clip_files:
+            raise Exception("No clip files provided for compilation")
+        
+        # Get transition settings
+        transition_type = settings.get('transition_type', 'fade')
         transition_duration = float(settings.get('transition_duration', 1.0))
         output_aspect_ratio = settings.get('output_aspect_ratio', '16:9')
         
+        # Too many clips for one process: pre-compile them into transition groups
+        group_files = []
+        reservation = None
+        group_size = plan_compile_group_size(len(clip_files), max_inputs=int(settings.get('compile_max_inputs', COMPILE_MAX_INPUTS)))
+        if len(clip_files) > group_size:
+            clip_files = group_files = compile_transition_groups(clip_files, os.path.dirname(os.path.abspath(output_file)), group_size,
+                                                   transition_type, transition_duration, output_aspect_ratio)
+        
+        reservation = get_scratch().reserve(sum(os.path.getsize(path) for path in clip_files), "the compile output",
+                                            path=output_file)
+        get_scratch().track(output_file, 'output')
+        
         # Build FFmpeg command
         ffmpeg_cmd = build_ffmpeg_command(
             clip_files=clip_files,
@@ -564,7 +2127,7 @@ def compile_video(clip_files: list, music_file: str, output_file: str, settings:
             ffmpeg_cmd,
             capture_output=True,
             text=True,
-            timeout=600  # 10 minute timeout
+            timeout=get_scheduler().cap_timeout(600)  # 10 minutes at most, never past the deadline
         )
         
         if result.returncode != 0:
@@ -580,7 +2143,7 @@ def compile_video(clip_files: list, music_file: str, output_file: str, settings:
                 fallback_cmd,
                 capture_output=True,
                 text=True,
-                timeout=300  # 5 minute timeout for fallback
+                timeout=get_scheduler().cap_timeout(300)  # 5 minutes at most for fallback
             )
             
             if fallback_result.returncode != 0:
@@ -603,98 +2166,557 @@ def compile_video(clip_files: list, music_file: str, output_file: str, settings:
         if file_size == 0:
             raise Exception("Output file is empty")
         
+        for path in group_files:
+            os.remove(path)
+        
     except subprocess.TimeoutExpired:
         logger.error("FFmpeg compilation timed out")
         raise Exception("Video compilation timed out")
     except Exception as e:
         logger.error(f"Error in video compilation: {str(e)}")
         raise
+    finally:
+        if reservation is not None:
+            reservation.release()
+
+
+def compile_transition_groups(clip_files: list, work_dir: str, group_size: int, transition_type: str,
+                              transition_duration: float, output_aspect_ratio: str) -> list:
+    """
+    Reduce clip_files to at most group_size intermediates for compile_video.
+    
+    Each level compiles groups of at most group_size inputs with their transitions
+    (no whole-video fades, no music) into near-lossless intermediates. The next
+    level, and finally compile_video itself, puts the same transition between the
+    group outputs, which overlaps the last clip of one group and the first of the next.
+    """
+    level = 0
+    while len(clip_files) > group_size:
+        groups = plan_compile_groups(len(clip_files), group_size)
+        logger.info(f"🧱 Transition groups level {level}: {len(clip_files)} inputs in {len(groups)} groups")
+        outputs = []
+        for number, group in enumerate(groups):
+            group_file = get_scratch().track(os.path.join(work_dir, f"transition_group_{level}_{number:03d}.mp4"), 'group')
+            cmd = build_ffmpeg_command([clip_files[index] for index in group], None, group_file, transition_type,
+                                       transition_duration, 0, output_aspect_ratio, intermediate=True)
+            group_duration = sum(media.duration for media in probe_media_many([clip_files[index] for index in group]))
+            # Near-lossless intermediates are at least as large as their inputs
+            with get_scratch().reserve(sum(os.path.getsize(clip_files[index]) for index in group),
+                                       f"transition group {level}.{number}", path=group_file):
+                run_ffmpeg(cmd, timeout=get_scheduler().timeout_for(group_duration),
+                           stage=f'Transition group {level}.{number}')
+            outputs.append(group_file)
+        if level > 0:
+            # Previous level's intermediates are consumed
+            for path in clip_files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        clip_files = outputs
+        level += 1
+    return clip_files
+
+
+def choose_compile_mode(clip_count: int, requested_mode: str = COMPILE_MODE) -> str:
+    """
+    Pick 'single_pass' or 'two_pass' for a job.
+    
+    Single-pass keeps a decoder and scaler per input alive in one ffmpeg process, so
+    it is only chosen when the clip count is small enough and the estimated peak
+    (base + per-input cost) fits in 80% of available memory.
+    """
+    if requested_mode in ('single_pass', 'two_pass'):
+        return requested_mode
+    
+    estimated_mb = SINGLE_PASS_BASE_MEMORY_MB + clip_count * SINGLE_PASS_MEMORY_PER_INPUT_MB
+    available_mb = get_available_memory_mb()
+    if clip_count <= SINGLE_PASS_MAX_CLIPS and estimated_mb <= available_mb * 0.8:
+        mode = 'single_pass'
+    else:
+        mode = 'two_pass'
+    logger.info(f"⚙️  Compile mode: {mode} ({clip_count} clips, estimated {estimated_mb}MB of {available_mb:.0f}MB available)")
+    return mode
+
+
+def plan_compile_group_size(clip_count: int, normalize_inputs: bool = False, max_inputs: int = COMPILE_MAX_INPUTS) -> int:
+    """
+    Most inputs one compile ffmpeg may open (at least 2).
+
+    Every input keeps a decoder and its frame queue alive for the whole encode, so
+    the group size is what fits in COMPILE_MEMORY_BUDGET_MB (or 80% of available
+    memory, if less) after the encoder's base cost: SINGLE_PASS_MEMORY_PER_INPUT_MB
+    per raw input, COMPILE_MEMORY_PER_INPUT_MB per normalized one. A positive
+    max_inputs fixes the size instead.
+    """
+    if max_inputs > 0:
+        return max(2, max_inputs)
+    per_input_mb = SINGLE_PASS_MEMORY_PER_INPUT_MB if normalize_inputs else COMPILE_MEMORY_PER_INPUT_MB
+    budget_mb = min(COMPILE_MEMORY_BUDGET_MB, get_available_memory_mb() * 0.8)
+    group_size = max(2, int((budget_mb - SINGLE_PASS_BASE_MEMORY_MB) // per_input_mb))
+    if clip_count > group_size:
+        logger.info(f"⚙️  Compile groups of at most {group_size} inputs for {clip_count} clips "
+                    f"({per_input_mb}MB per input, {budget_mb:.0f}MB budget)")
+    return group_size
+
+
+def plan_compile_groups(clip_count: int, group_size: int) -> list:
+    """Split clip indices (order preserved) into the fewest groups of at most group_size, evenly sized"""
+    return split_segments([1.0] * clip_count, group_size, clip_count)
+
+
+def use_distributed_compile(clip_seconds: list, settings: dict) -> bool:
+    """Whether a job is split across worker invocations (per-request override: settings.distributed)"""
+    if len(clip_seconds) < 2:
+        return False
+    requested = settings.get('distributed')
+    if requested is not None:
+        return bool(requested)
+    if DISTRIBUTED_MODE == 'always':
+        return True
+    return DISTRIBUTED_MODE == 'auto' and sum(clip_seconds) >= DISTRIBUTED_MIN_SECONDS
+
+_lambda_client = None
+
+
+def get_lambda_client():
+    """Lazily create the Lambda client used to invoke segment workers"""
+    global _lambda_client
+    if _lambda_client is None:
+        import boto3
+        from botocore.config import Config
+        # Synchronous invocations can take a worker's full timeout; never retry a running encode
+        _lambda_client = boto3.client('lambda', config=Config(read_timeout=910, connect_timeout=10,
+                                                              retries={'max_attempts': 0}))
+    return _lambda_client
+
+
+def get_segment_transport():
+    """Transport for segment workers: this function via Lambda Invoke, or a local process pool"""
+    if DISTRIBUTED_TRANSPORT == 'local':
+        return LocalProcessTransport('app:lambda_handler', max_workers=DISTRIBUTED_MAX_WORKERS)
+    return LambdaTransport(os.environ['AWS_LAMBDA_FUNCTION_NAME'], get_lambda_client(),
+                           max_concurrency=DISTRIBUTED_MAX_WORKERS)
+
+
+def run_distributed_segments(clips: list, segments: list, music: dict, user_id: str, job_id: str, settings: dict,
+                             temp_path: Path, deadline_at: float, profile: EncoderProfile,
+                             checkpoint: JobCheckpoint = None) -> dict:
+    """
+    Coordinator side of a distributed compile.
+    
+    Each segment (a list of clip indices) goes to a worker invocation that encodes it
+    (see compile_segment) and uploads it to the compile-cache bucket; meanwhile the
+    music is fetched here. The finished segments are then downloaded in order and
+    removed from storage. Returns the same shape as run_clip_pipeline, with the
+    segment files as 'normalized_files', for compile mode 'distributed'.
+    
+    With a `checkpoint`, segments live under the job's checkpoint prefix and are
+    recorded as each worker finishes; segments a previous attempt recorded are not
+    fanned out again, and storage cleanup is left to `checkpoint.clear()`.
+    """
+    # Every worker encodes with `profile`, so the segments share codec headers for the -c copy join
+    worker_settings = {key: value for key, value in settings.items() if key != 'distributed'}
+    worker_settings['encoder_profile'] = profile.name
+    segment_keys = [f"{clip_indices[0]}-{clip_indices[-1]}" for clip_indices in segments]
+    results = [None] * len(segments)
+    payloads = []
+    for index, clip_indices in enumerate(segments):
+        entry = checkpoint.entry('segment', segment_keys[index]) if checkpoint is not None else None
+        if entry is not None:
+            results[index] = {'index': index, 'output_path': entry['path'], 'duration': entry.get('duration'),
+                              'seconds': 0, 'compile_mode': entry.get('compile_mode'),
+                              'encoder_profile': entry.get('encoder_profile'), 'normalize_paths': {},
+                              'resumed': True}
+            continue
+        if checkpoint is not None:
+            output_path = checkpoint.artifact_path(f"segment_{clip_indices[0]:03d}_{clip_indices[-1]:03d}.mp4")
+        else:
+            output_path = f"segments/{job_id}/seg_{index:03d}.mp4"
+        payloads.append({
+            'user_id': user_id,
+            'settings': worker_settings,
+            'segment': {
+                'job_id': job_id,
+                'index': index,
+                'clips': [clips[i] for i in clip_indices],
+                'fade_in': index == 0,
+                'fade_out': index == len(segments) - 1,
+                'output_path': output_path,
+                'deadline_at': deadline_at,
+                'scale': profile.scale
+            }
+        })
+    
+    def on_segment_done(payload_index: int, result: dict):
+        get_progress().advance('segments', len(payloads))
+        if checkpoint is None:
+            return
+        # Recorded as soon as the worker returns, so a later failure does not lose it
+        segment = payloads[payload_index]['segment']
+        checkpoint.record('segment', segment_keys[segment['index']], remote_path=result['output_path'], owned=True,
+                          duration=result['duration'], compile_mode=result['compile_mode'],
+                          encoder_profile=result['encoder_profile'])
+    
+    transport = get_segment_transport()
+    if len(payloads) < len(segments):
+        logger.info(f"♻️  {len(segments) - len(payloads)}/{len(segments)} segments restored from checkpoint")
+    logger.info(f"🛰️  Fanning out {len(payloads)} segments via {transport.name} transport: "
+                f"{[len(payload['segment']['clips']) for payload in payloads]} clips each")
+    fan_out_start = time.time()
+    music_path = None
+    music_track = None
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='fan-out') as executor:
+        fan_out = executor.submit(transport.invoke_all, payloads, on_segment_done)
+        # The music download overlaps the workers
+        if music and music.get('file_path'):
+            music_file = Path(get_scratch().track(temp_path / "music.mp3", 'music'))
+            music_track = fetch_music_track(music, music_file, settings.get('music_cache', MUSIC_CACHE_ENABLED))
+            if music_file.exists():
+                music_path = str(music_file)
+        with stage('segments'):
+            for payload, result in zip(payloads, fan_out.result()):
+                results[payload['segment']['index']] = result
+    fan_out_seconds = time.time() - fan_out_start
+    
+    # Fan-in: fetch the segments (in order) for the stream-copy join
+    segment_paths = [result['output_path'] for result in results]
+    signed_urls = sign_storage_urls(segment_paths, bucket=COMPILE_CACHE_BUCKET)
+    
+    def fetch_segment(index: int) -> dict:
+        local_path = Path(get_scratch().track(temp_path / f"segment_{index:03d}.mp4", 'segment'))
+        fetch_start = time.time()
+        with stage('download', item=f"segment_{index}") as timing:
+            size = download_from_supabase_storage(segment_paths[index], local_path, bucket=COMPILE_CACHE_BUCKET,
+                                                  signed_url=signed_urls.get(segment_paths[index]))
+            timing.add_bytes(size)
+        return {'index': index, 'clip_id': None, 'local_path': str(local_path), 'bytes': size,
+                'seconds': round(time.time() - fetch_start, 3)}
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(DEFAULT_DOWNLOAD_WORKERS, len(segment_paths))),
+                            thread_name_prefix='segment-download') as executor:
+        download_results = list(executor.map(fetch_segment, range(len(segment_paths))))
+    
+    if checkpoint is None:
+        try:
+            get_supabase().storage.from_(COMPILE_CACHE_BUCKET).remove(segment_paths)
+        except Exception as e:
+            logger.warning(f"Failed to remove worker segments {segment_paths}: {e}")
+    
+    normalize_paths = {}
+    for result in results:
+        for outcome, count in (result.get('normalize_paths') or {}).items():
+            normalize_paths[outcome] = normalize_paths.get(outcome, 0) + count
+    
+    return {
+        'normalized_files': [result['local_path'] for result in download_results],
+        'download_results': download_results,
+        'music_file': music_path,
+        'music_track': music_track,
+        'timings': None,
+        'normalize_paths': normalize_paths,
+        'distributed': {
+            'transport': transport.name,
+            'segments': len(segments),
+            'fan_out_seconds': round(fan_out_seconds, 1),
+            'workers': [{
+                'index': result['index'],
+                'clips': len(segments[result['index']]),
+                'media_seconds': result['duration'],
+                'seconds': result['seconds'],
+                'compile_mode': result['compile_mode'],
+                'encoder_profile': result['encoder_profile'],
+                'peak_memory_mb': result.get('peak_memory_mb'),
+                'resumed': result.get('resumed', False)
+            } for result in results]
+        }
+    }
+
+
+def compile_segment(event: dict, context) -> dict:
+    """
+    Worker side of a distributed compile: download, normalize and encode one segment
+    of clips (fades only where the segment starts or ends the video, no audio) and
+    upload it for the coordinator. Invoked directly, so it returns a plain dict.
+    """
+    segment = event['segment']
+    settings = event.get('settings', {})
+    start_time = time.time()
+    get_storage_session().reset_stats()
+    memory_sampler = get_memory_sampler()
+    memory_sampler.reset_processes()
+    start_job(memory_sampler=memory_sampler)
+    # The coordinator still has to join the segments, so finish before its deadline too
+    seconds_left = context.get_remaining_time_in_millis() / 1000 - DEADLINE_SAFETY_SECONDS
+    if segment.get('deadline_at'):
+        seconds_left = min(seconds_left, segment['deadline_at'] - time.time())
+    start_schedule(seconds_left, ENCODE_SPEED_PRIOR, headroom=SCHEDULE_HEADROOM)
+    logger.info(f"🛰️  Segment {segment['index']} of job {segment['job_id']}: {len(segment['clips'])} clips")
+    
+    try:
+        clips = segment['clips']
+        output_aspect_ratio = settings.get('output_aspect_ratio', '16:9')
+        with tempfile.TemporaryDirectory() as temp_dir, job_scratch_space(temp_dir):
+            temp_path = Path(temp_dir)
+            compile_mode = choose_compile_mode(len(clips), settings.get('compile_mode', COMPILE_MODE))
+            signed_urls = sign_storage_urls([clip['video_file_path'] for clip in clips])
+            plan_encode_schedule(probe_clip_seconds(clips, signed_urls), compile_mode, smart_render=False,
+                                 requested_profile=settings.get('encoder_profile'), scale=segment.get('scale'))
+            
+            pipeline_result = run_clip_pipeline(
+                clips, None, output_aspect_ratio, temp_path,
+                download_workers=int(settings.get('download_workers', DEFAULT_DOWNLOAD_WORKERS)),
+                max_raw_clips=int(settings.get('max_raw_clips', DEFAULT_PIPELINE_MAX_RAW_CLIPS)),
+                use_cache=settings.get('use_cache', NORMALIZED_CACHE_ENABLED),
+                normalize=compile_mode != 'single_pass',
+                signed_urls=signed_urls,
+                input_mode=settings.get('input_mode', INPUT_MODE)
+            )
+            
+            output_file = temp_path / "segment.mp4"
+            with stage('compile') as compile_timing:
+                compile_result = compile_final_video(
+                    pipeline_result['normalized_files'],
+                    compile_mode=compile_mode,
+                    compile_kwargs={
+                        'music_file': None,
+                        'output_file': str(output_file),
+                        'music_volume': 0,
+                        'output_aspect_ratio': output_aspect_ratio,
+                        'fade_in': segment['fade_in'],
+                        'fade_out': segment['fade_out']
+                    },
+                    temp_dir=str(temp_path),
+                    smart_render=False,  # Smart render always fades both ends
+                    max_inputs=int(settings.get('compile_max_inputs', COMPILE_MAX_INPUTS))
+                )
+                compile_timing.add_bytes(compile_result['output_bytes'])
+            finish_schedule()
+            duration = probe_media(str(output_file)).duration
+            
+            with stage('upload') as upload_timing:
+                upload_to_supabase_storage(str(output_file), segment['output_path'], bucket=COMPILE_CACHE_BUCKET,
+                                           upsert=True)
+                upload_timing.add_bytes(compile_result['output_bytes'])
+            wait_for_cache_uploads(pipeline_result['cache_futures'])
+        
+        return {
+            'statusCode': 200,
+            'index': segment['index'],
+            'output_path': segment['output_path'],
+            'duration': round(duration, 3),
+            'bytes': compile_result['output_bytes'],
+            'seconds': round(time.time() - start_time, 1),
+            'compile_mode': compile_result['compile_mode'],
+            'normalize_paths': compile_result['normalize_paths'] or pipeline_result['normalize_paths'],
+            'encoder_profile': get_scheduler().profile.name,
+            'peak_memory_mb': round(max(memory_sampler.peak_between(start_time), memory_sampler.sample()), 1),
+            'stages': get_recorder().summary()
+        }
+    except Exception as e:
+        logger.error(f"Error compiling segment {segment.get('index')}: {str(e)}")
+        finish_schedule()
+        return {'statusCode': 500, 'index': segment.get('index'), 'error': str(e)}
+
+
+def compile_final_video(clip_files: list, compile_mode: str, compile_kwargs: dict, temp_dir: str,
+                        smart_render: bool = SMART_RENDER_ENABLED, open_sink=None, open_hls=None,
+                        max_inputs: int = COMPILE_MAX_INPUTS) -> dict:
+    """
+    Run the compile stage for the chosen mode, including its fallbacks.
+    
+    single_pass: compile raw clips normalizing in-graph; on failure normalize and compile two-pass.
+    two_pass: smart render when eligible, otherwise the full basic-fades re-encode.
+    distributed: clip_files are finished worker segments, joined with -c copy plus music.
+    
+    `open_sink` (optional) returns a started StreamingUpload; each attempt gets a fresh
+    one and a failed attempt discards its partial upload. If a sink cannot be opened
+    the attempt writes compile_kwargs['output_file'] instead.
+    
+    `open_hls(local_dir, attempt_number)` (optional) returns a started HlsPublisher; the
+    attempt then writes HLS segments into local_dir (published while encoding) and
+    remuxes them into compile_kwargs['output_file'] afterwards.
+    
+    Full re-encodes with more clips than plan_compile_group_size allows (max_inputs
+    overrides it) go through compile_video_hierarchical.
+    """
+    result = {'compile_mode': compile_mode, 'normalize_paths': None, 'streamed': False, 'output_bytes': 0, 'hls': None,
+              'groups': None}
+    attempts = {'count': 0}
+    
+    def attempt(compile_fn, *args, **kwargs):
+        attempts['count'] += 1
+        sink = None
+        publisher = None
+        hls_dir = None
+        if open_sink is not None:
+            try:
+                sink = open_sink()
+            except StreamingUploadError as e:
+                logger.warning(f"Streaming output unavailable, writing to file instead: {e}")
+        elif open_hls is not None:
+            hls_dir = os.path.join(temp_dir, f"hls_{attempts['count']}")
+            publisher = open_hls(hls_dir, attempts['count'])
+        try:
+            outcome = compile_fn(*args, output_sink=sink, hls_dir=hls_dir, **kwargs)
+            if sink is not None:
+                if outcome is False:
+                    sink.abort()  # Smart render declined before producing output
+                else:
+                    result['output_bytes'] = sink.finish()
+                    result['streamed'] = True
+            elif outcome is not False:
+                if publisher is not None:
+                    publisher.finish()
+                    result['hls'] = {
+                        'playlist_path': publisher.remote_playlist_path,
+                        'segments': len(publisher.uploaded_segments),
+                        'first_playlist_seconds': round(publisher.first_playlist_at - publisher.started_at, 1)
+                        if publisher.first_playlist_at else None
+                    }
+                result['output_bytes'] = os.path.getsize(compile_kwargs['output_file'])
+            elif publisher is not None:
+                publisher.abort()
+            return outcome
+        except Exception:
+            if sink is not None:
+                sink.abort()
+            if publisher is not None:
+                publisher.abort()
+            raise
+    
+    def basic_fades(clip_files, normalize_inputs=False):
+        group_size = plan_compile_group_size(len(clip_files), normalize_inputs, max_inputs)
+        result['groups'] = None
+        if len(clip_files) <= group_size:
+            return attempt(compile_video_basic_fades, clip_files=clip_files, normalize_inputs=normalize_inputs,
+                           **compile_kwargs)
+        result['groups'] = {'group_size': group_size,
+                            'count': len(plan_compile_groups(len(clip_files), group_size))}
+        return attempt(compile_video_hierarchical, clip_files=clip_files, temp_dir=temp_dir, group_size=group_size,
+                       normalize_inputs=normalize_inputs, **compile_kwargs)
+    
+    if compile_mode == 'distributed':
+        attempt(compile_video_from_segments, clip_files, compile_kwargs['music_file'], compile_kwargs['output_file'],
+                temp_dir, music_volume=compile_kwargs['music_volume'],
+                music_prepared=compile_kwargs.get('music_prepared', False))
+        return result
+    
+    if compile_mode == 'single_pass':
+        try:
+            basic_fades(clip_files, normalize_inputs=True)
+            return result
+        except ScratchBudgetExceeded:
+            raise  # Two-pass needs more scratch space than single-pass, not less
+        except Exception as single_pass_error:
+            # Fall back to the two-pass path: normalize every clip, then compile
+            logger.warning(f"Single-pass compile failed, falling back to two-pass: {single_pass_error}")
+            result['compile_mode'] = 'two_pass_fallback'
+            normalize_outcomes = []
+            clip_files = normalize_clips_streaming(clip_files, compile_kwargs['output_aspect_ratio'], temp_dir,
+                                                   outcomes=normalize_outcomes)
+            result['normalize_paths'] = count_outcomes(normalize_outcomes)
+            basic_fades(clip_files)
+            return result
+    
+    if smart_render:
+        try:
+            if attempt(compile_video_smart_render, clip_files, compile_kwargs['music_file'], compile_kwargs['output_file'],
+                       temp_dir, music_volume=compile_kwargs['music_volume'],
+                       music_prepared=compile_kwargs.get('music_prepared', False)) is not False:
+                result['compile_mode'] = 'smart_render'
+                return result
+        except Exception as smart_render_error:
+            logger.warning(f"Smart render failed, re-encoding full timeline: {smart_render_error}")
+    
+    basic_fades(clip_files)
+    return result
 
 
 def compile_video_basic_fades(clip_files: list, music_file: str, output_file: str, 
-                             music_volume: float = 0.3, output_aspect_ratio: str = '9:16'):
+                             music_volume: float = 0.3, output_aspect_ratio: str = '9:16',
+                             normalize_inputs: bool = False, output_sink: StreamingUpload = None,
+                             hls_dir: str = None, music_prepared: bool = False,
+                             fade_in: bool = True, fade_out: bool = True, progress_span: tuple = (0.0, 1.0)):
     """
     Memory-optimized video compilation with basic fades and simple concatenation.
-    No complex transitions - just simple concat + fade in/out on final video.
+    No complex transitions - just simple concat + fade in/out on final video
+    (fade_in/fade_out=False leave an end unfaded, for distributed segments).
+    
+    With normalize_inputs=True the clips are raw downloads: each input gets the
+    normalization scale/pad/SAR/fps chain inside the filter graph, so every frame
+    is encoded exactly once (single-pass mode). With an output_sink the video is
+    written as fragmented MP4 to ffmpeg's stdout and streamed into the sink
+    instead of output_file. With music_prepared=True music_file is a finished
+    rendition (see prepare_music_rendition) that is muxed with -c:a copy.
+    The encode reports ffmpeg's -progress as the compile stage moving through
+    progress_span (offset, length).
     """
+    progress = get_progress().watch_ffmpeg('compile', os.path.dirname(os.path.abspath(output_file)), *progress_span)
+    reservation = None
     try:
-        logger.info(f"Starting BASIC FADES compilation with {len(clip_files)} clips")
+        logger.info(f"Starting BASIC FADES compilation with {len(clip_files)} clips"
+                    f"{' (single-pass, normalizing inputs in graph)' if normalize_inputs else ''}")
         log_memory_usage("BASIC_COMPILATION_START")
         
         if not clip_files:
             raise Exception("No clip files provided for compilation")
             
         # Calculate total duration of all clips
-        total_duration = sum(get_video_duration(clip) for clip in clip_files)
+        clip_media = probe_media_many(clip_files)
+        total_duration = sum(media.duration for media in clip_media)
         logger.info(f"Total video duration: {total_duration:.2f} seconds")
+        progress.total_seconds = total_duration
         
-        # Build memory-optimized FFmpeg command
-        cmd = ['./bin/ffmpeg', '-y']  # Overwrite output
-        
-        # Add all clip inputs
-        for clip_file in clip_files:
-            cmd.extend(['-i', clip_file])
-        
+        graph = FilterGraph()
+        sources = [graph.add_input(clip_file, media) for clip_file, media in zip(clip_files, clip_media)]
         # Add music input if provided
         has_music = music_file and os.path.exists(music_file) and music_volume > 0
-        if has_music:
-            cmd.extend(['-i', music_file])
+        music_input = graph.add_input(music_file) if has_music else None
+        
+        video_pads = [graph.stream(source) for source in sources]
+        if normalize_inputs:
+            # Single-pass: normalize each input inside the graph instead of in a separate encode
+            normalize_chain = normalize_filters(get_aspect_config(output_aspect_ratio))
+            video_pads = [graph.chain(pad, normalize_chain) for pad in video_pads]
         
-        # Simple filter complex for basic fades
         if len(clip_files) == 1:
             # Single clip - just add fade in/out
             fade_duration = min(0.5, total_duration / 4)  # Max 0.5s fade, or 1/4 of video
-            fade_out_start = max(fade_duration, total_duration - fade_duration)
-            
-            if has_music:
-                filter_complex = (
-                    f'[0:v]fade=t=in:st=0:d={fade_duration},'
-                    f'fade=t=out:st={fade_out_start}:d={fade_duration}[v];'
-                    f'[{len(clip_files)}:a]atrim=duration={total_duration},'
-                    f'volume={music_volume},'
-                    f'afade=t=in:st=0:d=1,'
-                    f'afade=t=out:st={max(1, total_duration-1)}:d=1[a]'
-                )
-                cmd.extend(['-filter_complex', filter_complex, '-map', '[v]', '-map', '[a]'])
-            else:
-                filter_complex = (
-                    f'[0:v]fade=t=in:st=0:d={fade_duration},'
-                    f'fade=t=out:st={fade_out_start}:d={fade_duration}[v]'
-                )
-                cmd.extend(['-filter_complex', filter_complex, '-map', '[v]', '-an'])
         else:
             # Multiple clips - concatenate then add fade in/out
             fade_duration = min(0.5, total_duration / 8)  # Max 0.5s fade, or 1/8 of total
-            fade_out_start = max(fade_duration, total_duration - fade_duration)
-            
-            # Build concat filter
-            concat_filter = ''.join(f'[{i}:v]' for i in range(len(clip_files)))
-            concat_filter += f'concat=n={len(clip_files)}:v=1:a=0[concatenated];'
-            
-            # Add fade in/out on concatenated video
-            concat_filter += (
-                f'[concatenated]fade=t=in:st=0:d={fade_duration},'
-                f'fade=t=out:st={fade_out_start}:d={fade_duration}[v]'
-            )
-            
-            if has_music:
-                concat_filter += (
-                    f';[{len(clip_files)}:a]atrim=duration={total_duration},'
-                    f'volume={music_volume},'
-                    f'afade=t=in:st=0:d=1,'
-                    f'afade=t=out:st={max(1, total_duration-1)}:d=1[a]'
-                )
-                cmd.extend(['-filter_complex', concat_filter, '-map', '[v]', '-map', '[a]'])
-            else:
-                cmd.extend(['-filter_complex', concat_filter, '-map', '[v]', '-an'])
-        
-        # Memory-optimized output settings
+        fade_out_start = max(fade_duration, total_duration - fade_duration)
+        video = build_concat_filter(graph, video_pads)
+        graph.output(graph.chain(video, fade_filters(fade_duration, fade_out_start, fade_in, fade_out)), 'v')
+        if has_music and not music_prepared:
+            music_pad = graph.stream(music_input, 'a')
+            graph.output(graph.chain(music_pad, music_filters(total_duration, music_volume)), 'a')
+        
+        # Drops the normalization of inputs that already match, then validates before ffmpeg runs
+        graph.optimize()
+        input_args, filter_complex = graph.compile()
+        cmd = ['./bin/ffmpeg', '-y'] + progress.args + input_args  # Overwrite output
+        cmd.extend(['-filter_complex', filter_complex, '-map', '[v]'])
+        if has_music and music_prepared:
+            cmd.extend(['-map', f'{music_input.index}:a:0'])
+        elif has_music:
+            cmd.extend(['-map', '[a]'])
+        else:
+            cmd.append('-an')
+        
+        # Memory-optimized output settings; preset/CRF come from the deadline scheduler
+        scheduler = get_scheduler()
+        profile = scheduler.profile
+        # Single-pass also decodes and scales the raw sources in this encode
+        encode_timeout = scheduler.timeout_for(total_duration * (1.2 if normalize_inputs else 1.0))
+        logger.info(f"Encoder profile {profile.name} (preset {profile.preset}, crf {profile.crf}), "
+                    f"timeout {encode_timeout:.0f}s")
         cmd.extend([
             '-c:v', 'libx264',
-            '-preset', 'faster',       # Faster encoding = less memory usage
-            '-crf', '24',              # Good quality with smaller file size
+            '-preset', profile.preset, # 'faster' unless the job is behind schedule
+            '-crf', str(profile.crf),
             '-pix_fmt', 'yuv420p',     # Web compatibility
-            '-movflags', '+faststart', # Progressive download
             '-bufsize', '1M',          # Limit buffer size
             '-maxrate', '2M',          # Limit maximum bitrate
             '-avoid_negative_ts', 'make_zero',
@@ -702,20 +2724,56 @@ def compile_video_basic_fades(clip_files: list, music_file: str, output_file: st
         ])
         
         # Add audio settings if we have music
-        if has_music:
+        if has_music and music_prepared:
+            cmd.extend(['-c:a', 'copy'])  # Already trimmed, mixed and encoded
+        elif has_music:
             cmd.extend(['-c:a', 'aac', '-b:a', '96k'])  # Lower bitrate for memory efficiency
         
+        if output_sink is None:
+            # HLS segments and the MP4 remuxed from them are on disk together
+            copies = 2 if hls_dir is not None else 1
+            reservation = get_scratch().reserve(copies * predict_encode_bytes(total_duration, 96000 if has_music else 0),
+                                                "the compile output", path=output_file)
+            get_scratch().track(output_file, 'output')
+        
+        if output_sink is not None:
+            # Fragmented MP4 needs no trailing moov rewrite, so it can be streamed while encoding
+            cmd.extend(['-movflags', FRAGMENTED_MP4_FLAGS, '-f', 'mp4', 'pipe:1'])
+            logger.info(f"Basic fades FFmpeg command (streaming): {' '.join(cmd)}")
+            log_memory_usage("FFMPEG_COMMAND_BUILT")
+            encode_start = time.time()
+            run_ffmpeg_to_sink(cmd, output_sink, timeout=encode_timeout, stage='Basic fades')
+            scheduler.record_encode(total_duration, time.time() - encode_start, profile)
+            log_memory_usage("FFMPEG_EXECUTION_COMPLETE")
+            logger.info(f"✅ Basic fades compilation streamed: {output_sink.bytes_written/1024/1024:.1f}MB output")
+            return
+        
+        if hls_dir is not None:
+            # Keyframes on the segment grid so every segment starts independently decodable
+            cmd.extend(['-force_key_frames', f'expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})'])
+            cmd.extend(hls_output_args(hls_dir))
+            log_memory_usage("FFMPEG_COMMAND_BUILT")
+            encode_start = time.time()
+            run_ffmpeg(cmd, timeout=encode_timeout, stage='Basic fades (HLS)')
+            scheduler.record_encode(total_duration, time.time() - encode_start, profile)
+            log_memory_usage("FFMPEG_EXECUTION_COMPLETE")
+            remux_hls_to_mp4(hls_dir, output_file)
+            logger.info(f"✅ Basic fades compilation successful (HLS): {os.path.getsize(output_file)/1024/1024:.1f}MB output")
+            return
+        
+        cmd.extend(['-movflags', '+faststart'])  # Progressive download
         cmd.append(output_file)
         
         logger.info(f"Basic fades FFmpeg command: {' '.join(cmd)}")
         log_memory_usage("FFMPEG_COMMAND_BUILT")
         
         # Execute FFmpeg
+        encode_start = time.time()
         result = subprocess.run(
             cmd,
             capture_output=True,
             text=True,
-            timeout=300  # 5 minute timeout - should be enough for simple concatenation
+            timeout=encode_timeout  # Sized from the timeline duration, never past the deadline
         )
         
         log_memory_usage("FFMPEG_EXECUTION_COMPLETE")
@@ -732,6 +2790,7 @@ def compile_video_basic_fades(clip_files: list, music_file: str, output_file: st
         if file_size == 0:
             raise Exception("Output file is empty")
         
+        scheduler.record_encode(total_duration, time.time() - encode_start, profile)
         logger.info(f"✅ Basic fades compilation successful: {file_size/1024/1024:.1f}MB output")
         log_memory_usage("BASIC_COMPILATION_SUCCESS")
         
@@ -741,85 +2800,369 @@ def compile_video_basic_fades(clip_files: list, music_file: str, output_file: st
     except Exception as e:
         logger.error(f"Error in basic fades compilation: {str(e)}")
         raise
+    finally:
+        progress.close()
+        if reservation is not None:
+            reservation.release()
 
 
-def build_ffmpeg_command(clip_files: list, music_file: str, output_file: str, 
-                        transition_type: str, transition_duration: float, music_volume: float, output_aspect_ratio: str = '16:9'):
-    """Build FFmpeg command for video compilation with transitions and music"""
+def compile_video_hierarchical(clip_files: list, music_file: str, output_file: str, temp_dir: str, group_size: int,
+                               music_volume: float = 0.3, output_aspect_ratio: str = '9:16',
+                               normalize_inputs: bool = False, output_sink: StreamingUpload = None,
+                               hls_dir: str = None, music_prepared: bool = False,
+                               fade_in: bool = True, fade_out: bool = True):
+    """
+    compile_video_basic_fades for more clips than one ffmpeg should open at once.
     
-    cmd = ['./bin/ffmpeg', '-y']  # -y to overwrite output file
+    The clips are compiled in order, at most group_size inputs at a time, into silent
+    group segments; only the first fades in and only the last fades out, as with
+    distributed segments. The segments share encoder settings, so they are joined
+    with -c copy and the music is muxed once. Groups run one after another, so peak
+    memory follows group_size rather than the clip count.
+    """
+    groups = plan_compile_groups(len(clip_files), group_size)
+    work_dir = os.path.join(temp_dir, 'compile_groups')
+    os.makedirs(work_dir, exist_ok=True)
+    logger.info(f"🧱 Hierarchical compile: {len(clip_files)} clips in {len(groups)} groups "
+                f"({', '.join(str(len(group)) for group in groups)} inputs)")
     
-    # Add input files
-    for clip_file in clip_files:
-        cmd.extend(['-i', clip_file])
+    scratch = get_scratch()
+    group_files = []
+    try:
+        for number, group in enumerate(groups):
+            group_file = os.path.join(work_dir, f"group_{number:03d}.mp4")
+            # The group encodes are most of the work, the final join a stream copy
+            progress_span = (0.9 * group[0] / len(clip_files), 0.9 * len(group) / len(clip_files))
+            with stage('compile_group', item=number):
+                compile_video_basic_fades([clip_files[index] for index in group], None, group_file, music_volume=0,
+                                          output_aspect_ratio=output_aspect_ratio, normalize_inputs=normalize_inputs,
+                                          fade_in=fade_in and number == 0,
+                                          fade_out=fade_out and number == len(groups) - 1,
+                                          progress_span=progress_span)
+            group_files.append(scratch.track(group_file, 'group'))
+            if not normalize_inputs:
+                # Normalized clips are only inputs to their group (raw clips stay for the two-pass fallback)
+                for index in group:
+                    scratch.release(clip_files[index])
+            memory_checkpoint(f"COMPILE_GROUP_{number}")
+        
+        compile_video_from_segments(group_files, music_file, output_file, work_dir, music_volume=music_volume,
+                                    output_sink=output_sink, hls_dir=hls_dir, music_prepared=music_prepared)
+    finally:
+        # Group segments are only inputs to the join
+        for path in group_files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def run_ffmpeg(cmd: list, timeout: int, stage: str):
+    """Run an ffmpeg command, raising with stderr on failure"""
+    logger.info(f"{stage} FFmpeg command: {' '.join(cmd)}")
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise Exception(f"FFmpeg {stage} failed: {result.stderr}")
+    return result
+
+
+def run_ffmpeg_to_sink(cmd: list, sink: StreamingUpload, timeout: int, stage: str, chunk_size: int = 1024 * 1024) -> int:
+    """
+    Run an ffmpeg command whose output is pipe:1 and feed stdout into `sink` as it is produced.
+    stderr goes to a temp file so a chatty ffmpeg can never block on a full pipe.
+    A watchdog kills ffmpeg at the deadline, so a stalled process that neither writes
+    nor exits cannot leave the read blocked. Returns the number of bytes streamed.
+    """
+    deadline = time.time() + timeout
+    with tempfile.TemporaryFile(mode='w+') as stderr_file:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file)
+        timed_out = threading.Event()
+        
+        def kill_at_deadline():
+            timed_out.set()
+            process.kill()  # The blocked read then sees EOF
+        
+        watchdog = threading.Timer(timeout, kill_at_deadline)
+        watchdog.daemon = True
+        watchdog.start()
+        streamed = 0
+        try:
+            while True:
+                data = process.stdout.read(chunk_size)
+                if not data:
+                    break
+                if timed_out.is_set():
+                    break
+                sink.write(data)
+                streamed += len(data)
+            process.wait(timeout=max(1, deadline - time.time()))
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            watchdog.cancel()
+            process.stdout.close()
+        
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        if process.returncode != 0:
+            stderr_file.seek(0)
+            raise Exception(f"FFmpeg {stage} failed: {stderr_file.read()}")
     
-    # Add music file if provided and volume > 0
-    if music_file and os.path.exists(music_file) and music_volume > 0:
-        cmd.extend(['-i', music_file])
-        has_music = True
-    else:
-        has_music = False
+    if streamed == 0:
+        raise Exception(f"FFmpeg {stage} produced no output")
+    return streamed
+
+
+def hls_output_args(hls_dir: str) -> list:
+    """ffmpeg output arguments for an event playlist of MPEG-TS segments in hls_dir"""
+    os.makedirs(hls_dir, exist_ok=True)
+    return [
+        '-f', 'hls',
+        '-hls_time', str(HLS_SEGMENT_SECONDS),
+        '-hls_playlist_type', 'event',
+        '-hls_segment_type', 'mpegts',
+        # temp_file: the playlist is renamed into place, so it never lists a half-written segment
+        '-hls_flags', 'independent_segments+temp_file',
+        '-hls_segment_filename', os.path.join(hls_dir, 'seg_%05d.ts'),
+        os.path.join(hls_dir, HlsPublisher.PLAYLIST_NAME)
+    ]
+
+
+def remux_hls_to_mp4(hls_dir: str, output_file: str):
+    """Stream-copy a finished HLS rendition into a faststart MP4"""
+    run_ffmpeg([
+        './bin/ffmpeg', '-y',
+        '-i', os.path.join(hls_dir, HlsPublisher.PLAYLIST_NAME),
+        '-c', 'copy',
+        '-bsf:a', 'aac_adtstoasc',  # ADTS (MPEG-TS) to MP4 AAC framing
+        '-movflags', '+faststart',
+        output_file
+    ], timeout=get_scheduler().cap_timeout(120), stage='HLS remux')
+    if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        raise Exception("HLS remux output file is missing or empty")
+
+
+def write_concat_list(paths: list, list_file: str):
+    """Write an ffconcat list for the concat demuxer"""
+    with open(list_file, 'w') as f:
+        f.write('ffconcat version 1.0\n')
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+def stream_signature(stream: dict) -> tuple:
+    """
+    Parameters video streams must share to be joined without re-encoding. The joined
+    stream keeps the first part's SPS/PPS (extradata), so parts encoded with other
+    settings, such as another x264 preset, must not follow it.
+    """
+    keys = ('codec_name', 'profile', 'level', 'width', 'height', 'pix_fmt', 'r_frame_rate', 'extradata_hash')
+    return tuple((stream or {}).get(key) for key in keys)
+
+
+def compile_video_smart_render(clip_files: list, music_file: str, output_file: str, temp_dir: str,
+                               music_volume: float = 0.3, output_sink: StreamingUpload = None,
+                               hls_dir: str = None, music_prepared: bool = False) -> bool:
+    """
+    Smart-render variant of compile_video_basic_fades for normalized clips.
     
-    # Always calculate total video duration for proper fade timing
-    if len(clip_files) == 1:
-        # Single clip duration
-        video_duration = get_video_duration(clip_files[0])
-    else:
-        # Multiple clips - sum their durations (approximation)
-        video_duration = sum(get_video_duration(clip) for clip in clip_files)
-        
-    # Calculate fade out start time (1 second before end, minimum at 1 second)
-    if has_music:
-        fade_out_start = max(1.0, video_duration - 1.0)
-    else:
-        fade_out_start = 0
-    
-    # Build filter complex for transitions
-    if len(clip_files) == 1:
-        # Single clip - need to process music with volume, fade, and duration
-        if has_music:
-            # Apply video fade in/out (0.5s each) and music processing
-            video_fade_out_start = max(0.5, video_duration - 0.5)
-            filter_complex = f'[0:v]fade=t=in:st=0:d=0.5,fade=t=out:st={video_fade_out_start}:d=0.5[outv];[1:a]atrim=duration={video_duration},volume={music_volume},afade=t=in:st=0:d=1,afade=t=out:st={fade_out_start}:d=1[outa]'
+    The fades only touch the first and last fade_duration seconds, so the clips are
+    joined with the concat demuxer (-c copy), only the GOPs overlapping the fades
+    are re-encoded, and the untouched middle is stream-copied. Music is muxed
+    in a final pass that copies the video. Returns False when the clips are not
+    eligible (mismatched stream parameters or codec headers, too few keyframes),
+    so the caller can use the full re-encode instead.
+    """
+    streams = [media.video for media in probe_media_many(clip_files)]
+    signatures = {stream_signature(stream) for stream in streams}
+    if None in streams or len(signatures) != 1:
+        logger.info(f"Smart render skipped: clip stream parameters or codec headers differ "
+                    f"({len(signatures)} variants)")
+        return False
+    
+    log_memory_usage("SMART_RENDER_START")
+    scheduler = get_scheduler()
+    scratch = get_scratch()
+    work_dir = os.path.join(temp_dir, 'smart_render')
+    os.makedirs(work_dir, exist_ok=True)
+    
+    # 1. Join all normalized clips without re-encoding
+    joined_file = scratch.track(os.path.join(work_dir, 'joined.mp4'), 'smart_render')
+    clips_list = os.path.join(work_dir, 'clips.ffconcat')
+    write_concat_list(clip_files, clips_list)
+    with scratch.reserve(sum(os.path.getsize(path) for path in clip_files), "the smart render join", path=joined_file):
+        run_ffmpeg(['./bin/ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', clips_list,
+                    '-map', '0:v:0', '-c', 'copy', joined_file], timeout=scheduler.cap_timeout(120),
+                   stage='Smart render join')
+    get_progress().report('compile', 0.2)
+    
+    joined = probe_media(joined_file)
+    total_duration = joined.duration
+    divisor = 4 if len(clip_files) == 1 else 8  # Same fade length rules as compile_video_basic_fades
+    fade_duration = min(0.5, total_duration / divisor)
+    fade_out_start = max(fade_duration, total_duration - fade_duration)
+    
+    # 2. Cut points: first keyframe after the fade-in, last keyframe before the fade-out
+    keyframes = joined.keyframe_times
+    head_end = next((t for t in keyframes if t >= fade_duration), None)
+    tail_start = next((t for t in reversed(keyframes) if t <= fade_out_start), None)
+    if head_end is None or tail_start is None or tail_start <= head_end:
+        logger.info(f"Smart render skipped: no keyframe-aligned middle section (keyframes={len(keyframes)})")
+        os.remove(joined_file)
+        return False
+    logger.info(f"✂️  Smart render: re-encode 0-{head_end:.2f}s and {tail_start:.2f}-{total_duration:.2f}s, "
+                f"copy {tail_start - head_end:.2f}s")
+    
+    # 3. Re-encode the head (fade in) and tail (fade out) with the normalization encoder settings
+    head_file = scratch.track(os.path.join(work_dir, 'head.mp4'), 'smart_render')
+    tail_file = scratch.track(os.path.join(work_dir, 'tail.mp4'), 'smart_render')
+    middle_file = scratch.track(os.path.join(work_dir, 'middle.mp4'), 'smart_render')
+    profile = scheduler.profile
+    encode_start = time.time()
+    with scratch.reserve(predict_encode_bytes(head_end, 0), "the smart render head", path=head_file):
+        run_ffmpeg(['./bin/ffmpeg', '-y', '-i', joined_file, '-t', f'{head_end:.6f}', '-an',
+                    '-vf', f'fade=t=in:st=0:d={fade_duration}'] + normalize_encoder_args(profile) + [head_file],
+                   timeout=scheduler.timeout_for(head_end), stage='Smart render head')
+    with scratch.reserve(predict_encode_bytes(total_duration - tail_start, 0), "the smart render tail", path=tail_file):
+        run_ffmpeg(['./bin/ffmpeg', '-y', '-ss', f'{tail_start:.6f}', '-i', joined_file, '-an',
+                    '-vf', f'fade=t=out:st={fade_out_start - tail_start:.6f}:d={fade_duration}'] + normalize_encoder_args(profile) + [tail_file],
+                   timeout=scheduler.timeout_for(total_duration - tail_start), stage='Smart render tail')
+    scheduler.record_encode(head_end + total_duration - tail_start, time.time() - encode_start, profile)
+    # Stream-copied clips, or clips from an earlier profile, carry other codec headers than this encode
+    if {stream_signature(probe_media(path).video) for path in (head_file, tail_file)} != signatures:
+        logger.info(f"Smart render skipped: the {profile.name} head/tail encode does not match the clips' codec headers")
+        for path in (joined_file, head_file, tail_file):
+            os.remove(path)
+        return False
+    get_progress().report('compile', 0.6)
+    
+    # 4. Stream-copy the middle between the two keyframes
+    with scratch.reserve(joined.size or os.path.getsize(joined_file), "the smart render middle", path=middle_file):
+        run_ffmpeg(['./bin/ffmpeg', '-y', '-ss', f'{head_end:.6f}', '-i', joined_file, '-t', f'{tail_start - head_end:.6f}',
+                    '-map', '0:v:0', '-c', 'copy', '-avoid_negative_ts', 'make_zero', middle_file],
+                   timeout=scheduler.cap_timeout(120), stage='Smart render middle')
+    os.remove(joined_file)  # Everything is cut out of it; the mux needs the room
+    get_progress().report('compile', 0.7)
+    
+    # 5. Join head + middle + tail, then mux music (video copied, audio encoded once)
+    mux_video_parts([head_file, middle_file, tail_file], os.path.join(work_dir, 'parts.ffconcat'), music_file,
+                    output_file, total_duration, music_volume=music_volume, music_prepared=music_prepared,
+                    output_sink=output_sink, hls_dir=hls_dir, stage='Smart render mux')
+    
+    # Intermediates are no longer needed
+    for path in (head_file, middle_file, tail_file):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    logger.info("✅ Smart render compilation successful")
+    log_memory_usage("SMART_RENDER_SUCCESS")
+    return True
+
+
+def mux_video_parts(parts: list, list_file: str, music_file: str, output_file: str, total_duration: float,
+                    music_volume: float = 0.3, music_prepared: bool = False, output_sink: StreamingUpload = None,
+                    hls_dir: str = None, stage: str = 'Mux'):
+    """
+    Join video parts that share stream parameters with the concat demuxer (video copied)
+    and mux the music, writing to output_sink, HLS in hls_dir, or output_file.
+    """
+    scheduler = get_scheduler()
+    reservation = None
+    if output_sink is None:
+        # The output is about as large as its parts (twice with the HLS segments alongside)
+        copies = 2 if hls_dir is not None else 1
+        reservation = get_scratch().reserve(copies * sum(os.path.getsize(path) for path in parts),
+                                            f"the {stage.lower()} output", path=output_file)
+        get_scratch().track(output_file, 'output')
+    try:
+        write_concat_list(parts, list_file)
+        cmd = ['./bin/ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_file]
+        has_music = music_file and os.path.exists(music_file) and music_volume > 0
+        if has_music and music_prepared:
+            cmd.extend(['-i', music_file, '-map', '0:v:0', '-map', '1:a:0', '-c:a', 'copy'])
+        elif has_music:
             cmd.extend([
-                '-filter_complex', filter_complex,
-                '-map', '[outv]',  # Processed video with fades
-                '-map', '[outa]',  # Processed audio from music
-                '-c:a', 'aac'
-                # Removed -shortest since we're explicitly controlling duration
-                # Note: video codec settings will be added later in video_settings
+                '-i', music_file,
+                '-filter_complex', f'[1:a]{render_chain(music_filters(total_duration, music_volume))}[a]',
+                '-map', '0:v:0', '-map', '[a]', '-c:a', 'aac', '-b:a', '96k'
             ])
         else:
-            # Video-only clip with fade in/out
-            video_fade_out_start = max(0.5, video_duration - 0.5)
-            filter_complex = f'[0:v]fade=t=in:st=0:d=0.5,fade=t=out:st={video_fade_out_start}:d=0.5[outv]'
-            cmd.extend([
-                '-filter_complex', filter_complex,
-                '-map', '[outv]',  # Processed video with fades
-                '-an'  # No audio
-                # Note: video codec settings will be added later in video_settings
-            ])
+            cmd.extend(['-map', '0:v:0', '-an'])
+        cmd.extend(['-c:v', 'copy', '-t', str(total_duration)])
+        if output_sink is not None:
+            cmd.extend(['-movflags', FRAGMENTED_MP4_FLAGS, '-f', 'mp4', 'pipe:1'])
+            run_ffmpeg_to_sink(cmd, output_sink, timeout=scheduler.cap_timeout(120), stage=stage)
+        elif hls_dir is not None:
+            # Video is copied, so segments split on the normalized clips' forced keyframes
+            run_ffmpeg(cmd + hls_output_args(hls_dir), timeout=scheduler.cap_timeout(120), stage=f'{stage} (HLS)')
+            remux_hls_to_mp4(hls_dir, output_file)
+        else:
+            cmd.extend(['-movflags', '+faststart', output_file])
+            run_ffmpeg(cmd, timeout=scheduler.cap_timeout(120), stage=stage)
+            if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+                raise Exception(f"{stage} output file is missing or empty")
+    finally:
+        if reservation is not None:
+            reservation.release()
+
+
+def compile_video_from_segments(segment_files: list, music_file: str, output_file: str, temp_dir: str,
+                                music_volume: float = 0.3, output_sink: StreamingUpload = None,
+                                hls_dir: str = None, music_prepared: bool = False):
+    """
+    Fan-in step of distributed compilation: the worker segments already carry the
+    fades and share encoder settings, so they are joined with -c copy and only the
+    music is added.
+    """
+    log_memory_usage("SEGMENT_JOIN_START", f"{len(segment_files)} segments")
+    total_duration = sum(media.duration for media in probe_media_many(segment_files))
+    mux_video_parts(segment_files, os.path.join(temp_dir, 'segments.ffconcat'), music_file, output_file,
+                    total_duration, music_volume=music_volume, music_prepared=music_prepared,
+                    output_sink=output_sink, hls_dir=hls_dir, stage='Segment join')
+    logger.info(f"✅ Joined {len(segment_files)} segments ({total_duration:.1f}s)")
+
+
+def build_ffmpeg_command(clip_files: list, music_file: str, output_file: str, 
+                        transition_type: str, transition_duration: float, music_volume: float, output_aspect_ratio: str = '16:9',
+                        intermediate: bool = False):
+    """
+    Build FFmpeg command for video compilation with transitions and music
+    (intermediate=True: a transition group, without whole-video fades and at near-lossless CRF)
+    """
+    
+    # Probe every clip once (in parallel) for total duration and per-clip transition timing
+    clip_media = probe_media_many(clip_files)
+    clip_durations = [media.duration for media in clip_media]
+    video_duration = sum(clip_durations)
+    
+    graph = FilterGraph()
+    sources = [graph.add_input(clip_file, media) for clip_file, media in zip(clip_files, clip_media)]
+    # Add music file if provided and volume > 0
+    has_music = bool(music_file and os.path.exists(music_file) and music_volume > 0)
+    music_input = graph.add_input(music_file) if has_music else None
+    
+    video_pads = [graph.stream(source) for source in sources]
+    if len(video_pads) == 1:
+        video = video_pads[0]
     else:
         # Multiple clips - add transitions
-        # Get individual clip durations for proper transition timing
-        clip_durations = [get_video_duration(clip) for clip in clip_files]
-        
-        filter_complex = build_transition_filter(
-            num_clips=len(clip_files),
-            transition_type=transition_type,
-            transition_duration=transition_duration,
-            has_music=has_music,
-            music_volume=music_volume,
-            fade_out_start=fade_out_start if has_music else 0,
-            video_duration=video_duration,  # Always pass video_duration for fade calculations
-            clip_durations=clip_durations
-        )
-        
-        cmd.extend(['-filter_complex', filter_complex])
-        if has_music:
-            cmd.extend(['-map', '[outv]', '-map', '[outa]'])
-        else:
-            cmd.extend(['-map', '[outv]', '-an'])  # No audio output
+        video = build_transition_filter(graph, video_pads, transition_type, transition_duration, clip_durations)
+    
+    # Fade the whole video in and out (0.5s each)
+    graph.output(graph.chain(video, fade_filters(0.5, max(0.5, video_duration - 0.5), not intermediate, not intermediate)), 'outv')
+    if has_music:
+        graph.output(graph.chain(graph.stream(music_input, 'a'), music_filters(video_duration, music_volume)), 'outa')
+    graph.optimize()
+    input_args, filter_complex = graph.compile()
+    
+    cmd = ['./bin/ffmpeg', '-y'] + input_args  # -y to overwrite output file
+    cmd.extend(['-filter_complex', filter_complex, '-map', '[outv]'])
+    cmd.extend(['-map', '[outa]'] if has_music else ['-an'])  # No audio output without music
     
     # Define explicit video dimensions based on aspect ratio
     aspect_dimensions = {
@@ -837,7 +3180,7 @@ def build_ffmpeg_command(clip_files: list, music_file: str, output_file: str,
         '-level:v', '3.0',         # Level 3.0 for web compatibility
         '-pix_fmt', 'yuv420p',     # Pixel format required for web playback
         '-preset', 'fast',         # Good balance of speed and quality
-        '-crf', '23',              # High quality
+        '-crf', '18' if intermediate else '23',  # High quality (intermediates are encoded again)
         '-movflags', '+faststart', # Enable progressive download
         '-avoid_negative_ts', 'make_zero',  # Handle timing issues
         '-fflags', '+genpts',      # Generate presentation timestamps
@@ -858,264 +3201,93 @@ def build_ffmpeg_command(clip_files: list, music_file: str, output_file: str,
     return cmd
 
 
-def build_transition_filter(num_clips: int, transition_type: str, transition_duration: float, 
-                           has_music: bool, music_volume: float, fade_out_start: float = 10.0, 
-                           video_duration: float = 0.0, clip_durations: list = None):
-    """Build FFmpeg filter complex for video transitions"""
-    
-    if clip_durations is None:
-        clip_durations = [5.0] * num_clips  # Default to 5 seconds per clip
+def build_transition_filter(graph: FilterGraph, video_pads: list, transition_type: str, transition_duration: float,
+                            clip_durations: list) -> Pad:
+    """Join the clips' video pads with the requested transition; returns the joined video pad"""
     
     if transition_type == 'fade':
-        return build_fade_transition_filter(num_clips, transition_duration, has_music, music_volume, fade_out_start, video_duration, clip_durations)
+        return build_fade_transition_filter(graph, video_pads, transition_duration, clip_durations)
     elif transition_type == 'dissolve' or transition_type == 'crossfade':
-        return build_crossfade_transition_filter(num_clips, transition_duration, has_music, music_volume, fade_out_start, video_duration, clip_durations)
+        return build_crossfade_transition_filter(graph, video_pads, transition_duration, clip_durations)
     elif transition_type == 'slide':
-        return build_slide_transition_filter(num_clips, transition_duration, has_music, music_volume, fade_out_start, video_duration, clip_durations)
+        return build_slide_transition_filter(graph, video_pads, transition_duration, clip_durations)
     else:
         # Default to simple cut (no transition)
-        return build_concat_filter(num_clips, has_music, music_volume, fade_out_start, video_duration)
+        return build_concat_filter(graph, video_pads)
 
 
-def build_fade_transition_filter(num_clips: int, transition_duration: float, has_music: bool, music_volume: float, fade_out_start: float, video_duration: float, clip_durations: list):
-    """Build filter for fade-to-black transitions between clips"""
-    
-    if num_clips < 2:
-        return build_concat_filter(num_clips, has_music, music_volume, fade_out_start, video_duration)
-    
-    # Build fade-to-black transitions between clips
-    # Each clip fades out to black, then next clip fades in from black (for transitions only)
-    filter_parts = []
-    
-    # Process each clip with fade out (except last) and fade in (except first) for transitions
-    for i in range(num_clips):
-        clip_filter = f'[{i}:v]'
-        clip_duration = clip_durations[i]
-        fade_out_time = max(0, clip_duration - transition_duration)
-        
-        if i == 0:
-            # First clip: only fade out at the end for transition
-            clip_filter += f'fade=t=out:st={fade_out_time}:d={transition_duration}'
-        elif i == num_clips - 1:
-            # Last clip: only fade in at the start for transition
-            clip_filter += f'fade=t=in:st=0:d={transition_duration}'
-        else:
-            # Middle clips: fade in at start, fade out at end for transitions
-            clip_filter += f'fade=t=in:st=0:d={transition_duration},fade=t=out:st={fade_out_time}:d={transition_duration}'
-        
-        clip_filter += f'[v{i}]'
-        filter_parts.append(clip_filter)
+def build_fade_transition_filter(graph: FilterGraph, video_pads: list, transition_duration: float,
+                                 clip_durations: list) -> Pad:
+    """Fade-to-black transitions: each clip fades out, the next one fades in from black"""
     
-    # Concatenate the processed clips
-    video_inputs = ''.join([f'[v{i}]' for i in range(num_clips)])
-    concat_filter = f'{video_inputs}concat=n={num_clips}:v=1:a=0[concat_v]'
-    filter_parts.append(concat_filter)
-    
-    # Add final video fade in/out (0.5s each) to the ENTIRE final video
-    final_fade_out_start = max(0.5, video_duration - 0.5) if video_duration > 0 else max(0.5, sum(clip_durations) - 0.5)
-    final_fade_filter = f'[concat_v]fade=t=in:st=0:d=0.5,fade=t=out:st={final_fade_out_start}:d=0.5[outv]'
-    filter_parts.append(final_fade_filter)
-    
-    if has_music:
-        # Add music processing
-        music_filter = f'[{num_clips}:a]atrim=duration={video_duration},volume={music_volume},afade=t=in:st=0:d=1,afade=t=out:st={fade_out_start}:d=1[outa]'
-        filter_parts.append(music_filter)
-    
-    return ';'.join(filter_parts)
+    faded = []
+    for i, pad in enumerate(video_pads):
+        fade_out_time = max(0, clip_durations[i] - transition_duration)
+        # First clip only fades out, last clip only fades in
+        faded.append(graph.chain(pad, fade_filters(transition_duration, fade_out_time,
+                                                   fade_in=i > 0, fade_out=i < len(video_pads) - 1)))
+    return build_concat_filter(graph, faded)
 
 
-def build_crossfade_transition_filter(num_clips: int, transition_duration: float, has_music: bool, music_volume: float, fade_out_start: float, video_duration: float, clip_durations: list):
-    """Build filter for crossfade (dissolve) transitions between clips"""
-    
-    if num_clips < 2:
-        return build_concat_filter(num_clips, has_music, music_volume, fade_out_start, video_duration)
-    
-    # For crossfade, we need to overlap clips and blend them
-    # This is more complex but creates smooth dissolve transitions
-    filter_parts = []
-    
-    # First clip (no modification needed)
-    current_stream = '[0:v]'
-    
-    # Calculate cumulative offset for each transition
-    cumulative_offset = 0
-    
-    # Apply crossfade between each pair of clips
-    for i in range(1, num_clips):
-        # Calculate offset based on previous clip duration minus transition overlap
-        prev_clip_duration = clip_durations[i-1]
-        offset = cumulative_offset + prev_clip_duration - transition_duration
-        
-        # Create crossfade between current stream and next clip
-        crossfade_filter = f'{current_stream}[{i}:v]xfade=transition=fade:duration={transition_duration}:offset={offset}[v{i}]'
-        filter_parts.append(crossfade_filter)
-        current_stream = f'[v{i}]'
-        
-        # Update cumulative offset for next iteration
-        cumulative_offset = offset
-    
-    # The final stream is our output video - add fade in/out to the final result
-    final_fade_out_start = max(0.5, video_duration - 0.5) if video_duration > 0 else max(0.5, sum(clip_durations) - 0.5)
-    
-    final_stream = current_stream.replace('[', '').replace(']', '')
-    if final_stream != f'v{num_clips-1}':
-        # If we only have 2 clips, add fade effects
-        filter_parts.append(f'{current_stream}fade=t=in:st=0:d=0.5,fade=t=out:st={final_fade_out_start}:d=0.5[outv]')
-    else:
-        # For multiple clips, add fade effects to the last xfade output
-        filter_parts[-1] = filter_parts[-1].replace(f'[v{num_clips-1}]', '[xfade_v]')
-        filter_parts.append(f'[xfade_v]fade=t=in:st=0:d=0.5,fade=t=out:st={final_fade_out_start}:d=0.5[outv]')
-    
-    if has_music:
-        # Add music processing
-        music_filter = f'[{num_clips}:a]atrim=duration={video_duration},volume={music_volume},afade=t=in:st=0:d=1,afade=t=out:st={fade_out_start}:d=1[outa]'
-        filter_parts.append(music_filter)
-    
-    return ';'.join(filter_parts)
+def build_xfade_sequence(graph: FilterGraph, video_pads: list, transitions: list, transition_duration: float,
+                         clip_durations: list) -> Pad:
+    """
+    Overlap consecutive clips with xfade (transitions[i] between clip i and i+1). Each
+    offset is where the next clip starts on the timeline built so far.
+    """
+    current = video_pads[0]
+    offset = 0
+    for i in range(1, len(video_pads)):
+        offset = offset + clip_durations[i-1] - transition_duration
+        current = graph.apply([current, video_pads[i]], Filter('xfade', options={
+            'transition': transitions[i-1], 'duration': transition_duration, 'offset': offset}))
+    return current
 
 
-def build_slide_transition_filter(num_clips: int, transition_duration: float, has_music: bool, music_volume: float, fade_out_start: float, video_duration: float, clip_durations: list):
-    """Build filter for slide transitions between clips"""
-    
-    if num_clips < 2:
-        return build_concat_filter(num_clips, has_music, music_volume, fade_out_start, video_duration)
-    
-    # For slide transitions, we use xfade with slide effects
-    filter_parts = []
-    
-    # First clip (no modification needed)
-    current_stream = '[0:v]'
-    
-    # Apply slide transition between each pair of clips
-    # Alternate between different slide directions for variety
+def build_crossfade_transition_filter(graph: FilterGraph, video_pads: list, transition_duration: float,
+                                      clip_durations: list) -> Pad:
+    """Crossfade (dissolve) transitions between clips"""
+    return build_xfade_sequence(graph, video_pads, ['fade'] * (len(video_pads) - 1), transition_duration,
+                                clip_durations)
+
+
+def build_slide_transition_filter(graph: FilterGraph, video_pads: list, transition_duration: float,
+                                  clip_durations: list) -> Pad:
+    """Slide transitions between clips, cycling through the slide directions for variety"""
     slide_directions = ['slideleft', 'slideright', 'slideup', 'slidedown']
-    
-    # Calculate cumulative offset for each transition
-    cumulative_offset = 0
-    
-    for i in range(1, num_clips):
-        # Choose slide direction (cycle through options)
-        direction = slide_directions[(i-1) % len(slide_directions)]
-        
-        # Calculate offset based on previous clip duration minus transition overlap
-        prev_clip_duration = clip_durations[i-1]
-        offset = cumulative_offset + prev_clip_duration - transition_duration
-        
-        # Create slide transition between current stream and next clip
-        slide_filter = f'{current_stream}[{i}:v]xfade=transition={direction}:duration={transition_duration}:offset={offset}[v{i}]'
-        filter_parts.append(slide_filter)
-        current_stream = f'[v{i}]'
-        
-        # Update cumulative offset for next iteration
-        cumulative_offset = offset
-    
-    # The final stream is our output video - add fade in/out to the final result
-    final_fade_out_start = max(0.5, video_duration - 0.5) if video_duration > 0 else max(0.5, sum(clip_durations) - 0.5)
-    
-    final_stream = current_stream.replace('[', '').replace(']', '')
-    if final_stream != f'v{num_clips-1}':
-        # If we only have 2 clips, add fade effects
-        filter_parts.append(f'{current_stream}fade=t=in:st=0:d=0.5,fade=t=out:st={final_fade_out_start}:d=0.5[outv]')
-    else:
-        # For multiple clips, add fade effects to the last xfade output
-        filter_parts[-1] = filter_parts[-1].replace(f'[v{num_clips-1}]', '[xfade_v]')
-        filter_parts.append(f'[xfade_v]fade=t=in:st=0:d=0.5,fade=t=out:st={final_fade_out_start}:d=0.5[outv]')
-    
-    if has_music:
-        # Add music processing
-        music_filter = f'[{num_clips}:a]atrim=duration={video_duration},volume={music_volume},afade=t=in:st=0:d=1,afade=t=out:st={fade_out_start}:d=1[outa]'
-        filter_parts.append(music_filter)
-    
-    return ';'.join(filter_parts)
+    transitions = [slide_directions[i % len(slide_directions)] for i in range(len(video_pads) - 1)]
+    return build_xfade_sequence(graph, video_pads, transitions, transition_duration, clip_durations)
 
 
-def build_concat_filter(num_clips: int, has_music: bool, music_volume: float, fade_out_start: float = 10.0, video_duration: float = 0.0):
-    """Build simple concatenation filter for video-only clips"""
-    
-    # Since clips have no audio, only concatenate video streams
-    video_inputs = ''.join([f'[{i}:v]' for i in range(num_clips)])
-    
-    if num_clips == 1:
-        # Single clip - add fade in/out directly
-        final_fade_out_start = max(0.5, video_duration - 0.5) if video_duration > 0 else 4.5  # Default 5s clip - 0.5s
-        concat_filter = f'[0:v]fade=t=in:st=0:d=0.5,fade=t=out:st={final_fade_out_start}:d=0.5[outv]'
-    else:
-        # Multiple clips - concatenate then add fade in/out
-        final_fade_out_start = max(0.5, video_duration - 0.5) if video_duration > 0 else max(0.5, (num_clips * 5.0) - 0.5)  # Estimate total duration
-        concat_filter = f'{video_inputs}concat=n={num_clips}:v=1:a=0[concat_v];[concat_v]fade=t=in:st=0:d=0.5,fade=t=out:st={final_fade_out_start}:d=0.5[outv]'
-    
-    if has_music:
-        # Add music as the audio track with volume control, duration trim, and fade in/out
-        # Music is always the last input (after all video clips)
-        # Trim to video duration, then apply volume and fades
-        music_filter = f'[{num_clips}:a]atrim=duration={video_duration},volume={music_volume},afade=t=in:st=0:d=1,afade=t=out:st={fade_out_start}:d=1[outa]'
-        return f'{concat_filter};{music_filter}'
-    else:
-        # No audio output
-        return concat_filter
+def build_concat_filter(graph: FilterGraph, video_pads: list) -> Pad:
+    """Simple cuts: concatenate the video pads"""
+    if len(video_pads) == 1:
+        return video_pads[0]
+    return graph.apply(video_pads, Filter('concat', options={'n': len(video_pads), 'v': 1, 'a': 0}))
 
 
 def build_simple_fallback_command(clip_files: list, music_file: str, output_file: str, music_volume: float):
     """Build ultra-simple FFmpeg command as fallback"""
     
-    cmd = ['./bin/ffmpeg', '-y']
-    
-    # Add all clip files
-    for clip_file in clip_files:
-        cmd.extend(['-i', clip_file])
+    # Probe every clip once; the duration drives both fade timing and the -t limit
+    video_duration = sum(media.duration for media in probe_media_many(clip_files))
     
+    graph = FilterGraph()
+    video_pads = [graph.stream(graph.add_input(clip_file)) for clip_file in clip_files]
     # Add music if provided and volume > 0
-    if music_file and os.path.exists(music_file) and music_volume > 0:
-        cmd.extend(['-i', music_file])
-        has_music = True
-    else:
-        has_music = False
+    has_music = bool(music_file and os.path.exists(music_file) and music_volume > 0)
     
-    # Calculate fade out timing if we have music
+    # Plain concatenation with a fade in/out on the whole video, plus the music track
+    video = build_concat_filter(graph, video_pads)
+    graph.output(graph.chain(video, fade_filters(0.5, max(0.5, video_duration - 0.5))), 'outv')
     if has_music:
-        if len(clip_files) == 1:
-            video_duration = get_video_duration(clip_files[0])
-        else:
-            video_duration = sum(get_video_duration(clip) for clip in clip_files)
-        fade_out_start = max(1.0, video_duration - 1.0)
+        music_pad = graph.stream(graph.add_input(music_file), 'a')
+        graph.output(graph.chain(music_pad, music_filters(video_duration, music_volume)), 'outa')
+    input_args, filter_complex = graph.compile()
     
-    if len(clip_files) == 1:
-        # Single clip - with video fade and audio processing for music
-        video_fade_out_start = max(0.5, video_duration - 0.5)
-        if has_music:
-            cmd.extend([
-                '-filter_complex', f'[0:v]fade=t=in:st=0:d=0.5,fade=t=out:st={video_fade_out_start}:d=0.5[outv];[1:a]atrim=duration={video_duration},volume={music_volume},afade=t=in:st=0:d=1,afade=t=out:st={fade_out_start}:d=1[outa]',
-                '-map', '[outv]',  # Processed video with fades
-                '-map', '[outa]',  # Processed audio from music
-                # Removed -shortest since we're explicitly controlling duration
-                # Note: video codec settings will be added later in output_settings
-            ])
-        else:
-            cmd.extend([
-                '-filter_complex', f'[0:v]fade=t=in:st=0:d=0.5,fade=t=out:st={video_fade_out_start}:d=0.5[outv]',
-                '-map', '[outv]',  # Processed video with fades
-                '-an'  # No audio
-                # Note: video codec settings will be added later in output_settings
-            ])
-    else:
-        # Multiple clips - video concatenation with fade effects and music processing
-        video_fade_out_start = max(0.5, video_duration - 0.5)
-        if has_music:
-            # Create video inputs for concatenation with fade effects
-            video_inputs = ''.join([f'[{i}:v]' for i in range(len(clip_files))])
-            cmd.extend([
-                '-filter_complex', 
-                f'{video_inputs}concat=n={len(clip_files)}:v=1:a=0[concat_v];[concat_v]fade=t=in:st=0:d=0.5,fade=t=out:st={video_fade_out_start}:d=0.5[v];[{len(clip_files)}:a]atrim=duration={video_duration},volume={music_volume},afade=t=in:st=0:d=1,afade=t=out:st={fade_out_start}:d=1[a]',
-                '-map', '[v]', '-map', '[a]'
-            ])
-        else:
-            # Create video inputs for concatenation with fade effects
-            video_inputs = ''.join([f'[{i}:v]' for i in range(len(clip_files))])
-            cmd.extend([
-                '-filter_complex', f'{video_inputs}concat=n={len(clip_files)}:v=1:a=0[concat_v];[concat_v]fade=t=in:st=0:d=0.5,fade=t=out:st={video_fade_out_start}:d=0.5[v]',
-                '-map', '[v]',
-                '-an'  # No audio
-            ])
+    cmd = ['./bin/ffmpeg', '-y'] + input_args
+    cmd.extend(['-filter_complex', filter_complex, '-map', '[outv]'])
+    cmd.extend(['-map', '[outa]'] if has_music else ['-an'])  # No audio without music
     
     # Simple output settings with quality maintained and web compatibility
     output_settings = [
@@ -1130,11 +3302,6 @@ def build_simple_fallback_command(clip_files: list, music_file: str, output_file
     ]
     
     # Always add duration control to prevent video freezing
-    if len(clip_files) == 1:
-        video_duration = get_video_duration(clip_files[0])
-    else:
-        video_duration = sum(get_video_duration(clip) for clip in clip_files)
-    
     output_settings.extend(['-t', str(video_duration)])  # Always limit output duration
     
     # Add audio codec if we have music
@@ -1144,4 +3311,6 @@ def build_simple_fallback_command(clip_files: list, music_file: str, output_file
     cmd.extend(output_settings)
     cmd.append(output_file)
     
-    return cmd 
\ No newline at end of file
+    return cmd 
+
+_init_timings['module_import_ms'] = round((time.time() - _module_load_start) * 1000, 1)
@@ -0,0 +1,147 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger()
+
+MANIFEST_VERSION = 1
+
+
+class JobCheckpoint:
+    """
+    Manifest of a job's completed stage outputs, so a retried invocation resumes instead
+    of starting over.
+
+    The manifest is {'version', 'fingerprint', 'meta', 'stages': {stage: {key: entry}}}
+    and is persisted through `save_manifest(manifest)` after every change. An entry
+    points at a storage object: either an artifact uploaded under `remote_prefix`
+    (owned: removed by `clear()`) or an object that already lives elsewhere, such as a
+    remote cache entry (referenced, never removed). A manifest written for a different
+    request (other `fingerprint`) is ignored. Storage access goes through the
+    `remote_download(remote_path, local_path)`, `remote_upload(local_path, remote_path)`
+    and `remote_remove(paths)` callables; no method raises.
+    """
+
+    def __init__(self, fingerprint: str, remote_prefix: str, manifest: dict = None, save_manifest=None,
+                 remote_download=None, remote_upload=None, remote_remove=None):
+        self.fingerprint = fingerprint
+        self.remote_prefix = remote_prefix
+        self.save_manifest = save_manifest
+        self.remote_download = remote_download
+        self.remote_upload = remote_upload
+        self.remote_remove = remote_remove
+        self._lock = threading.Lock()
+        self.stats = {'restored': 0, 'restore_failures': 0, 'recorded': 0}
+        if manifest and manifest.get('version') == MANIFEST_VERSION and manifest.get('fingerprint') == fingerprint:
+            self.manifest = manifest
+            self.resumed = True
+            logger.info(f"♻️  Resuming from checkpoint: {self._stage_counts()}")
+        else:
+            if manifest:
+                logger.info("Ignoring checkpoint written for a different request")
+            self.manifest = {'version': MANIFEST_VERSION, 'fingerprint': fingerprint, 'meta': {}, 'stages': {}}
+            self.resumed = False
+
+    def artifact_path(self, name: str) -> str:
+        return f"{self.remote_prefix}/{name}"
+
+    def get_meta(self, name: str, default=None):
+        with self._lock:
+            return self.manifest['meta'].get(name, default)
+
+    def set_meta(self, name: str, value):
+        with self._lock:
+            if self.manifest['meta'].get(name) == value:
+                return
+            self.manifest['meta'][name] = value
+        self._persist()
+
+    def entry(self, stage: str, key) -> dict:
+        with self._lock:
+            return self.manifest['stages'].get(stage, {}).get(str(key))
+
+    def restore(self, stage: str, key, local_path: str) -> dict:
+        """Download a recorded output to local_path; returns its entry, or None if unavailable"""
+        entry = self.entry(stage, key)
+        if entry is None or self.remote_download is None:
+            return None
+        try:
+            self.remote_download(entry['path'], local_path)
+            if os.path.getsize(local_path) > 0:
+                self._count('restored')
+                return entry
+        except Exception as e:
+            logger.warning(f"Could not restore checkpointed {stage} {key}: {e}")
+        self._count('restore_failures')
+        with self._lock:
+            self.manifest['stages'].get(stage, {}).pop(str(key), None)
+        return None
+
+    def record(self, stage: str, key, local_path: str = None, remote_path: str = None, owned: bool = None,
+               **meta) -> bool:
+        """
+        Record a completed output: upload local_path as an owned artifact, or reference
+        remote_path where it already exists (owned=True hands it to `clear()` as well).
+        Returns False when it could not be recorded.
+        """
+        if owned is None:
+            owned = remote_path is None
+        if remote_path is None:
+            if local_path is None or self.remote_upload is None:
+                return False
+            remote_path = self.artifact_path(f"{stage}_{key}{os.path.splitext(local_path)[1]}")
+            try:
+                self.remote_upload(local_path, remote_path)
+            except Exception as e:
+                logger.warning(f"Failed to checkpoint {stage} {key}: {e}")
+                return False
+        with self._lock:
+            self.manifest['stages'].setdefault(stage, {})[str(key)] = dict(meta, path=remote_path, owned=owned,
+                                                                              recorded_at=time.time())
+        self._count('recorded')
+        return self._persist()
+
+    def clear(self):
+        """Job finished: remove owned artifacts and drop the manifest"""
+        with self._lock:
+            owned = [entry['path'] for entries in self.manifest['stages'].values()
+                     for entry in entries.values() if entry.get('owned')]
+            self.manifest = None
+        if owned and self.remote_remove is not None:
+            try:
+                self.remote_remove(owned)
+            except Exception as e:
+                logger.warning(f"Failed to remove checkpoint artifacts: {e}")
+        if self.save_manifest is not None:
+            try:
+                self.save_manifest(None)
+            except Exception as e:
+                logger.warning(f"Failed to clear checkpoint manifest: {e}")
+
+    def summary(self) -> dict:
+        return dict(self.stats, resumed=self.resumed, stages=self._stage_counts())
+
+    def _stage_counts(self) -> dict:
+        with self._lock:
+            if self.manifest is None:
+                return {}
+            return {stage: len(entries) for stage, entries in self.manifest['stages'].items()}
+
+    def _persist(self) -> bool:
+        if self.save_manifest is None:
+            return True
+        # Serialized so a slower write can never overwrite a newer manifest
+        with self._lock:
+            if self.manifest is None:
+                return False
+            try:
+                self.save_manifest(self.manifest)
+                return True
+            except Exception as e:
+                logger.warning(f"Failed to save checkpoint manifest: {e}")
+                return False
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
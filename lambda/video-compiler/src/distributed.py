@@ -0,0 +1,147 @@
+import importlib
+import json
+import logging
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger()
+
+
+class SegmentWorkerError(Exception):
+    """Raised when a worker invocation fails or returns an error result"""
+    pass
+
+
+def split_segments(clip_seconds: list, segment_seconds: float, max_segments: int) -> list:
+    """
+    Split clips (by index, order preserved) into contiguous segments of roughly equal
+    duration: enough segments that each holds about `segment_seconds` of media, at most
+    `max_segments` and never more than one per clip. Returns a list of index lists.
+    """
+    if not clip_seconds:
+        return []
+    total = sum(clip_seconds)
+    count = max(1, min(max_segments, len(clip_seconds), math.ceil(total / max(segment_seconds, 1))))
+    target = total / count
+
+    segments = []
+    current = []
+    accumulated = 0.0
+    for index, seconds in enumerate(clip_seconds):
+        current.append(index)
+        accumulated += seconds
+        clips_left = len(clip_seconds) - index - 1
+        segments_left = count - len(segments) - 1
+        # Close the segment at its share of the timeline, keeping a clip for every later segment
+        if segments_left > 0 and (accumulated >= target * (len(segments) + 1) or clips_left == segments_left):
+            segments.append(current)
+            current = []
+    if current:
+        segments.append(current)
+    return segments
+
+
+def _check_result(index: int, result) -> dict:
+    if not isinstance(result, dict):
+        raise SegmentWorkerError(f"Segment {index} worker returned {type(result).__name__}")
+    if result.get('statusCode', 200) != 200 or result.get('error'):
+        raise SegmentWorkerError(f"Segment {index} worker failed: {result.get('error') or result}")
+    return result
+
+
+class LambdaTransport:
+    """
+    Fans segments out as synchronous (RequestResponse) invocations of a Lambda function,
+    normally this one. `client` is a boto3 Lambda client whose read timeout outlasts
+    the worker's own timeout.
+    """
+    name = 'lambda'
+
+    def __init__(self, function_name: str, client, max_concurrency: int = 16):
+        self.function_name = function_name
+        self.client = client
+        self.max_concurrency = max_concurrency
+
+    def invoke_all(self, payloads: list, on_result=None) -> list:
+        """Invoke one worker per payload; results keep payload order. `on_result(index, result)` sees each success"""
+        if not payloads:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(payloads)),
+                                thread_name_prefix='segment-invoke') as executor:
+            futures = [executor.submit(self._invoke, index, payload, on_result) for index, payload in enumerate(payloads)]
+            return [future.result() for future in futures]
+
+    def _invoke(self, index: int, payload: dict, on_result=None) -> dict:
+        started = time.time()
+        response = self.client.invoke(
+            FunctionName=self.function_name,
+            InvocationType='RequestResponse',
+            Payload=json.dumps(payload).encode('utf-8')
+        )
+        body = response['Payload'].read()
+        try:
+            result = json.loads(body or b'{}')
+        except ValueError:
+            raise SegmentWorkerError(f"Segment {index} worker returned invalid JSON: {body[:200]!r}")
+        if response.get('FunctionError'):
+            message = result.get('errorMessage') if isinstance(result, dict) else result
+            raise SegmentWorkerError(f"Segment {index} worker raised: {message}")
+        logger.info(f"🛰️  Segment {index} worker finished in {time.time() - started:.1f}s")
+        result = _check_result(index, result)
+        if on_result is not None:
+            on_result(index, result)
+        return result
+
+
+class LocalContext:
+    """Minimal stand-in for the Lambda context object when a worker runs in-process"""
+
+    def __init__(self, seconds: float, request_id: str = 'local'):
+        self.aws_request_id = request_id
+        self._deadline = time.time() + seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.time()) * 1000))
+
+
+def _run_local_worker(handler: str, payload: dict, seconds: float, request_id: str) -> dict:
+    module_name, _, function_name = handler.partition(':')
+    function = getattr(importlib.import_module(module_name), function_name)
+    return function(payload, LocalContext(seconds, request_id))
+
+
+class LocalProcessTransport:
+    """
+    Runs each segment through `handler` ('module:function') in a local process pool,
+    so distributed compilation can be exercised without AWS (tests, benchmarks).
+    """
+    name = 'local'
+
+    def __init__(self, handler: str, max_workers: int = 2, seconds_per_invocation: float = 900):
+        self.handler = handler
+        self.max_workers = max_workers
+        self.seconds_per_invocation = seconds_per_invocation
+
+    def invoke_all(self, payloads: list, on_result=None) -> list:
+        """Same contract as LambdaTransport.invoke_all"""
+        if not payloads:
+            return []
+        with ProcessPoolExecutor(max_workers=max(1, min(self.max_workers, len(payloads)))) as executor:
+            futures = {executor.submit(_run_local_worker, self.handler, payload, self.seconds_per_invocation,
+                                       f"local-segment-{index}"): index
+                       for index, payload in enumerate(payloads)}
+            results = [None] * len(payloads)
+            errors = []
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = _check_result(index, future.result())
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if on_result is not None:
+                    on_result(index, results[index])
+            if errors:
+                raise errors[0]
+            return results
@@ -0,0 +1,413 @@
+import logging
+import math
+from dataclasses import dataclass, field
+
+from media_probe import MediaInfo, parse_rate
+
+logger = logging.getLogger()
+
+# Filters that take and produce audio; everything else is treated as video
+AUDIO_FILTERS = {'atrim', 'volume', 'afade', 'anull', 'amix', 'asetpts', 'aformat', 'aresample'}
+# Single-input filters that leave frame size, SAR and frame rate unchanged
+GEOMETRY_PRESERVING = {'fade', 'null', 'setpts', 'trim', 'format'}
+# Fade options that set the window; fades that differ in anything else (color, alpha, curve) never merge
+_FADE_TIMING_OPTIONS = {'t', 'type', 'st', 'start_time', 'd', 'duration'}
+# Options that time a fade (fade) or afade in frames/samples rather than seconds
+_FADE_COUNT_OPTIONS = ('s', 'start_frame', 'n', 'nb_frames', 'ss', 'start_sample', 'ns', 'nb_samples')
+
+
+class FilterGraphError(Exception):
+    """Raised when a filter graph is malformed (caught before ffmpeg is launched)"""
+    pass
+
+
+@dataclass
+class Filter:
+    """One filter instance: `name=arg:arg:key=value`"""
+    name: str
+    args: tuple = ()
+    options: dict = field(default_factory=dict)
+
+    def render(self) -> str:
+        params = [str(arg) for arg in self.args] + [f"{key}={value}" for key, value in self.options.items()]
+        return f"{self.name}={':'.join(params)}" if params else self.name
+
+
+def parse_chain(text: str) -> list:
+    """Parse a simple comma-separated chain such as a -vf string (no escaped separators)"""
+    filters = []
+    for part in filter(None, text.split(',')):
+        name, _, params = part.partition('=')
+        args = []
+        options = {}
+        for param in filter(None, params.split(':')):
+            key, sep, value = param.partition('=')
+            if sep:
+                options[key] = value
+            else:
+                args.append(param)
+        filters.append(Filter(name, tuple(args), options))
+    return filters
+
+
+def render_chain(filters: list) -> str:
+    """-vf / -af string for a linear chain"""
+    return ','.join(f.render() for f in filters) or 'null'
+
+
+@dataclass(eq=False)
+class Input:
+    """An ffmpeg input file; `media` (probed) lets the optimizer reason about its streams"""
+    path: str
+    media: MediaInfo = None
+    index: int = None
+
+
+@dataclass(eq=False)
+class Pad:
+    """One stream edge: an input file stream (`source`) or a filter output, `label`led if mapped"""
+    kind: str
+    source: Input = None
+    label: str = None
+
+
+@dataclass(eq=False)
+class Node:
+    filter: Filter
+    inputs: list
+    outputs: list
+
+
+class FilterGraph:
+    """
+    Typed -filter_complex graph.
+
+    Builders register inputs, take stream pads from them and apply filters, each
+    application becoming one node with explicit input and output pads; graph
+    outputs get a label for -map. `optimize()` removes work that cannot change the
+    result (no-op scale/pad/setsar/fps on inputs that already match, zero-length,
+    repeated or overlapped fades, passthroughs).
+    `compile()` validates the graph and returns the -i arguments and the filter
+    string, rendering linear runs as comma chains so only real branch points get labels.
+    """
+
+    def __init__(self):
+        self.inputs = []
+        self.nodes = []
+        self.stats = {}
+
+    def add_input(self, path: str, media: MediaInfo = None) -> Input:
+        source = Input(path, media)
+        self.inputs.append(source)
+        return source
+
+    def stream(self, source: Input, kind: str = 'v') -> Pad:
+        """A fresh reference to an input's video ('v') or audio ('a') stream"""
+        return Pad(kind, source=source)
+
+    def apply(self, inputs, filter_: Filter, outputs: int = 1):
+        """Add a node reading `inputs` (a pad or list of pads); returns its output pad(s)"""
+        inputs = [inputs] if isinstance(inputs, Pad) else list(inputs)
+        kind = 'a' if filter_.name in AUDIO_FILTERS else 'v'
+        node = Node(filter_, inputs, [Pad(kind) for _ in range(outputs)])
+        self.nodes.append(node)
+        return node.outputs[0] if outputs == 1 else node.outputs
+
+    def chain(self, pad: Pad, filters: list) -> Pad:
+        for filter_ in filters:
+            pad = self.apply(pad, filter_)
+        return pad
+
+    def output(self, pad: Pad, label: str) -> str:
+        """Expose a pad as `[label]` for -map; an input stream gets a passthrough node first"""
+        if pad.source is not None or pad.label is not None:
+            pad = self.apply(pad, Filter('anull' if pad.kind == 'a' else 'null'))
+        pad.label = label
+        return f'[{label}]'
+
+    # Optimization
+
+    def optimize(self) -> dict:
+        """Simplify the graph in place; returns counts of what was removed"""
+        before = len(self.nodes)
+        stats = {'nodes_before': before, 'noop_geometry': 0, 'redundant_fades': 0, 'passthrough': 0}
+        self._drop_noop_geometry(stats)
+        self._drop_redundant_fades(stats)
+        self._drop_passthrough(stats)
+        stats['nodes_after'] = len(self.nodes)
+        self.stats = stats
+        if stats['nodes_after'] < before:
+            logger.info(f"🧩 Filter graph optimized: {stats}")
+        return stats
+
+    def _consumers(self) -> dict:
+        consumers = {}
+        for node in self.nodes:
+            for pad in node.inputs:
+                consumers.setdefault(pad, []).append(node)
+        return consumers
+
+    def _bypass(self, node: Node, consumers: dict) -> bool:
+        """Remove a single-input single-output node, wiring its input straight to its consumers"""
+        in_pad, out_pad = node.inputs[0], node.outputs[0]
+        if out_pad.label is not None:
+            # The label has to move to the input, which only works for an unlabeled filter output
+            if in_pad.source is not None or in_pad.label is not None or len(consumers.get(in_pad, [])) != 1:
+                return False
+            in_pad.label = out_pad.label
+        for consumer in consumers.pop(out_pad, []):
+            consumer.inputs = [in_pad if pad is out_pad else pad for pad in consumer.inputs]
+            consumers.setdefault(in_pad, []).append(consumer)
+        consumers[in_pad] = [c for c in consumers.get(in_pad, []) if c is not node]
+        self.nodes.remove(node)
+        return True
+
+    def _drop_noop_geometry(self, stats: dict):
+        """Drop scale/pad/setsar/fps whose input already has the target geometry (e.g. single-pass inputs)"""
+        consumers = self._consumers()
+        props = {}
+        for node in list(self.nodes):
+            source_props = self._pad_props(node.inputs[0], props) if len(node.inputs) == 1 else None
+            noop, result = _geometry_transfer(node.filter, source_props)
+            if noop:
+                if self._bypass(node, consumers):
+                    stats['noop_geometry'] += 1
+                else:
+                    node.filter = Filter('null')
+                props[node.outputs[0]] = source_props
+            else:
+                for pad in node.outputs:
+                    props[pad] = result
+
+    def _drop_redundant_fades(self, stats: dict):
+        """
+        Drop fades with an explicit zero frame (sample) count, and merge adjacent
+        same-direction fades where one is covered by the other: a fade in multiplies
+        everything before its start by zero, so a fade in that ends by then changes
+        nothing (likewise a fade out starting after the other has finished). Only fades
+        with an explicit positive duration are compared by time; ffmpeg times the rest
+        by frame (sample) count. Overlapping ramps multiply into a curve no single fade
+        reproduces, so those stay as two filters.
+        """
+        consumers = self._consumers()
+        for node in list(self.nodes):
+            if node.filter.name not in ('fade', 'afade'):
+                continue
+            if _is_zero_length_fade(node.filter):
+                if self._bypass(node, consumers):
+                    stats['redundant_fades'] += 1
+                continue
+            previous = self._producer(node.inputs[0])
+            if previous is None or previous.filter.name != node.filter.name or len(consumers.get(node.inputs[0], [])) != 1:
+                continue
+            covered = _covered_fade(previous.filter, node.filter)
+            if covered is node.filter and self._bypass(node, consumers):
+                stats['redundant_fades'] += 1
+            elif covered is previous.filter and self._bypass(previous, consumers):
+                stats['redundant_fades'] += 1
+
+    def _drop_passthrough(self, stats: dict):
+        consumers = self._consumers()
+        for node in list(self.nodes):
+            name, filter_ = node.filter.name, node.filter
+            is_noop = name in ('null', 'anull') or (name == 'volume' and filter_.args and _to_float(filter_.args[0]) == 1.0)
+            if is_noop and len(node.inputs) == 1 and self._bypass(node, consumers):
+                stats['passthrough'] += 1
+
+    def _producer(self, pad: Pad) -> Node:
+        for node in self.nodes:
+            if any(output is pad for output in node.outputs):
+                return node
+        return None
+
+    def _pad_props(self, pad: Pad, props: dict) -> dict:
+        if pad.source is not None:
+            return _media_props(pad.source.media) if pad.kind == 'v' else None
+        return props.get(pad)
+
+    # Validation and rendering
+
+    def validate(self):
+        """Raise FilterGraphError for anything ffmpeg would reject or silently misroute"""
+        if not self.nodes:
+            raise FilterGraphError("Filter graph is empty")
+        produced = set()
+        consumed = {}
+        labels = set()
+        for position, node in enumerate(self.nodes):
+            expected = 'a' if node.filter.name in AUDIO_FILTERS else 'v'
+            for pad in node.inputs:
+                if pad.source is not None:
+                    if pad.source not in self.inputs:
+                        raise FilterGraphError(f"{node.filter.name} reads an input that is not registered")
+                elif pad not in produced:
+                    raise FilterGraphError(f"{node.filter.name} (node {position}) reads a pad no earlier node produces")
+                if pad.kind != expected:
+                    raise FilterGraphError(f"{node.filter.name} expects {expected} input, got {pad.kind}")
+                if pad.source is None:
+                    consumed[pad] = consumed.get(pad, 0) + 1
+            _check_filter(node)
+            for pad in node.outputs:
+                produced.add(pad)
+                if pad.label is not None:
+                    if pad.label in labels:
+                        raise FilterGraphError(f"Output label [{pad.label}] is used twice")
+                    labels.add(pad.label)
+        for pad in produced:
+            uses = consumed.get(pad, 0)
+            if pad.label is not None and uses:
+                raise FilterGraphError(f"Output [{pad.label}] is also consumed inside the graph")
+            if pad.label is None and uses != 1:
+                raise FilterGraphError(f"An unlabeled filter output is consumed {uses} times")
+        if not labels:
+            raise FilterGraphError("Filter graph has no labeled outputs")
+
+    def compile(self) -> tuple:
+        """Validate, number the inputs and return (input args, filter_complex string)"""
+        self.validate()
+        input_args = []
+        for index, source in enumerate(self.inputs):
+            source.index = index
+            input_args.extend(['-i', source.path])
+
+        consumers = self._consumers()
+        next_in_chain = {}
+        for node in self.nodes:
+            if len(node.outputs) == 1 and node.outputs[0].label is None:
+                readers = consumers.get(node.outputs[0], [])
+                if len(readers) == 1 and len(readers[0].inputs) == 1:
+                    next_in_chain[node] = readers[0]
+        continued = set(next_in_chain.values())
+
+        auto_labels = {}
+
+        def ref(pad: Pad) -> str:
+            if pad.source is not None:
+                return f'[{pad.source.index}:{pad.kind}]'
+            if pad.label is not None:
+                return f'[{pad.label}]'
+            return auto_labels.setdefault(pad, f'[g{len(auto_labels)}]')
+
+        chains = []
+        for node in self.nodes:
+            if node in continued:
+                continue
+            text = ''.join(ref(pad) for pad in node.inputs) + node.filter.render()
+            while node in next_in_chain:
+                node = next_in_chain[node]
+                text += ',' + node.filter.render()
+            chains.append(text + ''.join(ref(pad) for pad in node.outputs))
+        return input_args, ';'.join(chains)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _media_props(media: MediaInfo) -> dict:
+    if media is None or not media.width or not media.height or media.rotation % 90:
+        return None
+    sar = (media.video or {}).get('sample_aspect_ratio')
+    constant_fps = media.fps > 0 and abs(media.fps - media.avg_fps) <= 0.01
+    # ffmpeg autorotates on decode, so a clip shot in portrait reaches the graph with its sides swapped
+    width, height = (media.height, media.width) if media.rotation % 180 else (media.width, media.height)
+    return {
+        'width': width,
+        'height': height,
+        'square_pixels': sar in (None, '1:1', '0:1', 'N/A'),
+        'fps': media.fps if constant_fps else None
+    }
+
+
+def _fade_window(filter_: Filter) -> tuple:
+    """
+    (direction, start, duration) of a fade timed in seconds, None otherwise: without
+    a positive duration ffmpeg times the fade by its frame (sample) count instead
+    """
+    options = filter_.options
+    if any(key in options for key in _FADE_COUNT_OPTIONS):
+        return None
+    direction = str(options.get('t', options.get('type', 'in')))
+    start = _to_float(options.get('st', options.get('start_time', 0)))
+    duration = _to_float(options.get('d', options.get('duration')))
+    if filter_.args or start is None or duration is None or duration <= 0:
+        return None
+    return direction, start, duration
+
+
+def _is_zero_length_fade(filter_: Filter) -> bool:
+    """Whether the fade's frame (sample) count is explicitly zero"""
+    counts = ('ns', 'nb_samples') if filter_.name == 'afade' else ('n', 'nb_frames')
+    return any(_to_float(filter_.options[key]) == 0 for key in counts if key in filter_.options)
+
+
+def _covered_fade(first: Filter, second: Filter) -> Filter:
+    """Whichever of two chained fades the other makes redundant, or None"""
+    if first.render() == second.render():
+        return second
+    extras = [{k: v for k, v in f.options.items() if k not in _FADE_TIMING_OPTIONS} for f in (first, second)]
+    windows = (_fade_window(first), _fade_window(second))
+    if extras[0] != extras[1] or None in windows or windows[0][0] != windows[1][0]:
+        return None
+    (direction, start_a, duration_a), (_, start_b, duration_b) = windows
+    if direction == 'in':
+        # Frames before a fade in's start are black (silent) already
+        if start_b + duration_b <= start_a:
+            return second
+        if start_a + duration_a <= start_b:
+            return first
+    elif direction == 'out':
+        # Frames after a fade out's end are black (silent) already
+        if start_b >= start_a + duration_a:
+            return second
+        if start_a >= start_b + duration_b:
+            return first
+    return None
+
+
+def _geometry_transfer(filter_: Filter, props: dict) -> tuple:
+    """(is_noop, output props) of one filter given its input's frame props (None = unknown)"""
+    name = filter_.name
+    if name in GEOMETRY_PRESERVING:
+        return False, props
+    target = None
+    if name in ('scale', 'pad') and len(filter_.args) >= 2:
+        target = (_to_float(filter_.args[0]), _to_float(filter_.args[1]))
+    if props is None:
+        if name == 'pad' and target:
+            return False, {'width': target[0], 'height': target[1], 'square_pixels': False, 'fps': None}
+        return False, None
+    size = (props['width'], props['height'])
+    if name == 'scale' and target:
+        # Scaling to the current size (any force_original_aspect_ratio mode) changes nothing
+        return size == target, (props if size == target else None)
+    if name == 'pad' and target:
+        return size == target, dict(props, width=target[0], height=target[1])
+    if name == 'setsar' and filter_.args and str(filter_.args[0]) in ('1', '1/1', '1:1'):
+        return props['square_pixels'], dict(props, square_pixels=True)
+    if name == 'fps' and filter_.args:
+        rate = parse_rate(str(filter_.args[0])) or _to_float(filter_.args[0])
+        matches = props['fps'] is not None and rate is not None and abs(props['fps'] - rate) <= 0.01
+        return matches, dict(props, fps=rate)
+    return False, None
+
+
+def _check_filter(node: Node):
+    filter_ = node.filter
+    for key, value in filter_.options.items():
+        number = _to_float(value)
+        if isinstance(value, float) and not math.isfinite(value):
+            raise FilterGraphError(f"{filter_.name}: {key}={value} is not a finite number")
+        if key in ('st', 'offset') and number is not None and number < 0:
+            raise FilterGraphError(f"{filter_.name}: {key}={value} is negative")
+        if key in ('d', 'duration') and number is not None and number <= 0 and filter_.name in ('xfade', 'atrim'):
+            raise FilterGraphError(f"{filter_.name}: {key}={value} must be positive")
+    if filter_.name == 'concat':
+        count = int(filter_.options.get('n', 2))
+        if count != len(node.inputs):
+            raise FilterGraphError(f"concat n={count} but {len(node.inputs)} inputs")
+    if filter_.name == 'xfade' and len(node.inputs) != 2:
+        raise FilterGraphError(f"xfade needs 2 inputs, got {len(node.inputs)}")
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+logger = logging.getLogger()
+
+
+def make_cache_key(*parts) -> str:
+    """Content-addressed key: sha256 over the JSON encoding of every key part"""
+    payload = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MediaCache:
+    """
+    Two-tier cache for processed media files.
+
+    The local tier is a directory under /tmp that outlives a single invocation,
+    so warm Lambda containers keep their entries; it is trimmed LRU-first to
+    `max_local_bytes`. The optional remote tier is reached through the
+    `remote_download(remote_path, local_path)` and
+    `remote_upload(local_path, remote_path)` callables, which keeps this class
+    independent of the storage client. Entries handed out are hard links (or
+    copies), so eviction never pulls a file out from under a running job.
+    """
+
+    def __init__(self, local_dir: str, max_local_bytes: int, suffix: str = '.mp4',
+                 remote_prefix: str = None, remote_download=None, remote_upload=None):
+        self.local_dir = local_dir
+        self.max_local_bytes = max_local_bytes
+        self.suffix = suffix
+        self.remote_prefix = remote_prefix
+        self.remote_download = remote_download
+        self.remote_upload = remote_upload
+        self._lock = threading.Lock()
+        self.stats = {'local_hits': 0, 'remote_hits': 0, 'misses': 0, 'stores': 0, 'remote_stores': 0, 'evictions': 0}
+        os.makedirs(self.local_dir, exist_ok=True)
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.local_dir, f"{key}{self.suffix}")
+
+    def remote_path(self, key: str) -> str:
+        return f"{self.remote_prefix}/{key[:2]}/{key}{self.suffix}"
+
+    def fetch(self, key: str, dest_path: str) -> str:
+        """
+        Materialize a cached entry at dest_path.
+        Returns 'local' or 'remote' on a hit, None on a miss.
+        """
+        cached = self.local_path(key)
+        if os.path.exists(cached):
+            os.utime(cached)  # Bump LRU position
+            _link_or_copy(cached, dest_path)
+            self._count('local_hits')
+            return 'local'
+
+        if self.remote_download and self.remote_prefix:
+            partial = f"{cached}.{threading.get_ident()}.part"
+            try:
+                self.remote_download(self.remote_path(key), partial)
+                if os.path.getsize(partial) > 0:
+                    os.replace(partial, cached)
+                    self._evict()
+                    _link_or_copy(cached, dest_path)
+                    self._count('remote_hits')
+                    return 'remote'
+            except Exception as e:
+                logger.info(f"Remote cache miss for {key[:12]}: {e}")
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+
+        self._count('misses')
+        return None
+
+    def store(self, key: str, source_path: str, upload: bool = True):
+        """Add a file to the local tier and (optionally) the remote tier; never raises"""
+        cached = self.local_path(key)
+        try:
+            if not os.path.exists(cached):
+                partial = f"{cached}.{threading.get_ident()}.part"
+                _link_or_copy(source_path, partial)
+                os.replace(partial, cached)
+                self._count('stores')
+                self._evict()
+        except Exception as e:
+            logger.warning(f"Failed to store {source_path} in local cache: {e}")
+
+        if upload and self.remote_upload and self.remote_prefix:
+            try:
+                # The cache's own link survives the caller deleting source_path while this runs
+                self.remote_upload(cached if os.path.exists(cached) else source_path, self.remote_path(key))
+                self._count('remote_stores')
+            except Exception as e:
+                logger.warning(f"Failed to upload {key[:12]} to remote cache: {e}")
+
+    def local_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self) -> list:
+        entries = []
+        for name in os.listdir(self.local_dir):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.local_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _evict(self):
+        """Drop least recently used entries until the local tier fits its budget"""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e[2])
+            total = sum(size for _, size, _ in entries)
+            for path, size, _ in entries:
+                if total <= self.max_local_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    self.stats['evictions'] += 1
+                    logger.info(f"🗑️  Evicted cache entry {os.path.basename(path)} ({size/1024/1024:.1f}MB)")
+                except FileNotFoundError:
+                    pass
+
+    def free_space(self, bytes_needed: int) -> int:
+        """
+        Evict least recently used entries until bytes_needed are freed (a scratch-space
+        evictor). Entries hard-linked into a running job free nothing and are kept.
+        Returns the bytes freed.
+        """
+        freed = 0
+        with self._lock:
+            for path, size, _ in sorted(self._entries(), key=lambda e: e[2]):
+                if freed >= bytes_needed:
+                    break
+                try:
+                    if os.stat(path).st_nlink > 1:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                freed += size
+                self.stats['evictions'] += 1
+                logger.info(f"🗑️  Evicted cache entry {os.path.basename(path)} for scratch space ({size/1024/1024:.1f}MB)")
+        return freed
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+
+def _link_or_copy(source: str, dest: str):
+    """Hard link when possible (same filesystem), otherwise copy"""
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from metrics import stage
+
+logger = logging.getLogger()
+
+FFPROBE_PATH = './bin/ffprobe'
+
+# One ffprobe call returns container info, every stream and the video packet flags.
+# extradata_hash fingerprints the codec headers (H.264 SPS/PPS), which streams must share
+# to be joined without re-encoding
+_SHOW_ENTRIES = ':'.join([
+    'format=duration,size,bit_rate,format_name',
+    'stream=index,codec_type,codec_name,profile,level,width,height,pix_fmt,'
+    'r_frame_rate,avg_frame_rate,sample_aspect_ratio,duration,extradata_hash',
+    'stream_tags=rotate',
+    'stream_side_data=side_data_type,rotation',
+    'packet=stream_index,pts_time,flags',
+])
+# Remote probes skip the packet list, which would mean reading the whole file
+_REMOTE_SHOW_ENTRIES = _SHOW_ENTRIES.rsplit(':packet=', 1)[0]
+
+_CACHE_MAX_ENTRIES = 512
+
+
+class MediaProbeError(Exception):
+    """Raised when ffprobe cannot read a media file"""
+    pass
+
+
+@dataclass
+class MediaInfo:
+    """Probed media properties of one file"""
+    path: str
+    duration: float
+    size: int
+    format_name: str
+    streams: list = field(default_factory=list)
+    video: dict = None
+    has_audio: bool = False
+    keyframe_times: list = field(default_factory=list)
+
+    @property
+    def codec(self) -> str:
+        return (self.video or {}).get('codec_name')
+
+    @property
+    def width(self) -> int:
+        return (self.video or {}).get('width')
+
+    @property
+    def height(self) -> int:
+        return (self.video or {}).get('height')
+
+    @property
+    def pix_fmt(self) -> str:
+        return (self.video or {}).get('pix_fmt')
+
+    @property
+    def fps(self) -> float:
+        return parse_rate((self.video or {}).get('r_frame_rate'))
+
+    @property
+    def avg_fps(self) -> float:
+        return parse_rate((self.video or {}).get('avg_frame_rate'))
+
+    @property
+    def rotation(self) -> int:
+        """Display rotation in degrees (0-359) from the display matrix or a legacy rotate tag"""
+        video = self.video or {}
+        for side_data in video.get('side_data_list') or []:
+            if side_data.get('rotation') is not None:
+                return int(_to_float(side_data.get('rotation')) or 0) % 360
+        return int(_to_float((video.get('tags') or {}).get('rotate')) or 0) % 360
+
+    def max_keyframe_gap(self) -> float:
+        """Longest stretch without a video keyframe, from the start (None when packets were not probed)"""
+        if not self.keyframe_times:
+            return None
+        times = [0.0] + self.keyframe_times
+        return max(later - earlier for earlier, later in zip(times, times[1:]))
+
+
+def parse_rate(rate: str) -> float:
+    """Parse an ffprobe rational such as '30000/1001' into a float (0.0 if invalid)"""
+    try:
+        num, _, den = (rate or '0/1').partition('/')
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {'probes': 0, 'hits': 0}
+
+
+def probe_media(path: str) -> MediaInfo:
+    """
+    Probe a file with a single JSON ffprobe call.
+    Results are memoized per (path, mtime, size), so repeated lookups of an
+    unchanged file never spawn another ffprobe. Raises MediaProbeError.
+    """
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        raise MediaProbeError(f"Cannot probe {path}: {e}")
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            _stats['hits'] += 1
+            return _cache[key]
+
+    with stage('probe', item=os.path.basename(path)):
+        info = _run_ffprobe(path)
+
+    with _cache_lock:
+        _stats['probes'] += 1
+        _cache[key] = info
+        while len(_cache) > _CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return info
+
+
+def probe_media_many(paths: list, max_workers: int = 4) -> list:
+    """Probe a list of files in parallel; results keep the input order"""
+    if len(paths) <= 1:
+        return [probe_media(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(paths))), thread_name_prefix='probe') as executor:
+        return list(executor.map(probe_media, paths))
+
+
+def probe_remote_media(url: str, input_args: list = None, label: str = None) -> MediaInfo:
+    """
+    Probe a remote file (e.g. a signed storage URL) for container and stream info.
+    Packets are not listed, so ffprobe only reads the header (plus a ranged read of
+    a trailing moov) and keyframe_times stays empty. `input_args` go before the URL
+    (e.g. HTTP reconnect options); `label` replaces the URL in logs and errors.
+    Results are memoized per URL, so the scheduling probe and a later HTTP
+    normalization of the same signed URL share one ffprobe. Raises MediaProbeError.
+    """
+    key = ('remote', url)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            _stats['hits'] += 1
+            return _cache[key]
+
+    with stage('probe', item='remote'):
+        info = _run_ffprobe(url, entries=_REMOTE_SHOW_ENTRIES, input_args=input_args, label=label)
+
+    with _cache_lock:
+        _stats['probes'] += 1
+        _cache[key] = info
+        while len(_cache) > _CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return info
+
+
+def probe_remote_media_many(urls: list, input_args: list = None, max_workers: int = 16) -> list:
+    """
+    Probe many remote files in parallel; results keep the input order, with None where
+    a URL is missing or unreadable. Query strings (signed URL tokens) stay out of the logs.
+    """
+    def probe(url):
+        if not url:
+            return None
+        try:
+            return probe_remote_media(url, input_args, label=url.split('?', 1)[0])
+        except MediaProbeError as e:
+            logger.warning(str(e))
+            return None
+
+    if not urls:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls))), thread_name_prefix='probe') as executor:
+        return list(executor.map(probe, urls))
+
+
+def get_probe_stats() -> dict:
+    with _cache_lock:
+        return dict(_stats, cached_entries=len(_cache))
+
+
+def _run_ffprobe(path: str, entries: str = _SHOW_ENTRIES, input_args: list = None, label: str = None) -> MediaInfo:
+    label = label or path
+    cmd = [
+        FFPROBE_PATH,
+        '-v', 'error',
+        '-show_entries', entries,
+        '-show_data_hash', 'CRC32',  # Cheapest hash; packet data is hashed too, but never printed
+        '-of', 'json'
+    ] + list(input_args or []) + [path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+    except subprocess.TimeoutExpired:
+        raise MediaProbeError(f"ffprobe timed out for {label}")
+    if result.returncode != 0:
+        raise MediaProbeError(f"ffprobe failed for {label}: {result.stderr.strip()}")
+
+    try:
+        data = json.loads(result.stdout or '{}')
+    except ValueError as e:
+        raise MediaProbeError(f"ffprobe returned invalid JSON for {label}: {e}")
+
+    fmt = data.get('format') or {}
+    streams = data.get('streams') or []
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+
+    duration = _to_float(fmt.get('duration')) or _to_float((video or {}).get('duration'))
+    if not duration or duration <= 0:
+        raise MediaProbeError(f"No duration reported for {label}")
+
+    keyframe_times = []
+    if video is not None:
+        for packet in data.get('packets') or []:
+            if packet.get('stream_index') == video.get('index') and 'K' in (packet.get('flags') or ''):
+                pts_time = _to_float(packet.get('pts_time'))
+                if pts_time is not None:
+                    keyframe_times.append(pts_time)
+
+    info = MediaInfo(
+        path=path,
+        duration=duration,
+        size=int(fmt.get('size') or 0),
+        format_name=fmt.get('format_name'),
+        streams=streams,
+        video=video,
+        has_audio=any(s.get('codec_type') == 'audio' for s in streams),
+        keyframe_times=sorted(keyframe_times)
+    )
+    logger.info(f"Probed {label}: {duration:.2f}s, {info.codec} {info.width}x{info.height}, "
+                f"{len(info.keyframe_times)} keyframes")
+    return info
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,154 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import psutil
+
+logger = logging.getLogger()
+
+
+class ProcessTreeSampler:
+    """
+    Background sampler of resident memory for this process and all of its descendants.
+
+    Almost all of the job's memory lives in ffmpeg children, which psutil.Process()
+    alone never sees. Every `interval` seconds the thread sums the RSS of the Lambda
+    process plus every child (recursively) and keeps the samples, so the peak of any
+    time window (a job, a stage) can be read back afterwards. Each child is also
+    tracked by pid with its own peak, labelled by its executable and output target,
+    which gives per-ffmpeg-invocation peaks, and keeps the CPU time the child had
+    used at its last sample, so `children_cpu_seconds()` can charge it to whoever
+    started that command. Children that live for less than one interval (typically
+    ffprobe) may not be sampled.
+    """
+
+    def __init__(self, interval: float = 0.1, max_samples: int = 20000):
+        self.interval = interval
+        self._process = psutil.Process()
+        self._samples = deque(maxlen=max_samples)
+        self._children = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = None
+
+    def start(self):
+        """Start sampling (idempotent); the thread is a daemon and survives warm invocations"""
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name='memory-sampler', daemon=True)
+            self._worker.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join()
+
+    def reset_processes(self):
+        """Forget per-child peaks (call at the start of each job)"""
+        with self._lock:
+            self._children = {}
+
+    def sample(self) -> float:
+        """Take one sample now and return the process tree RSS in MB"""
+        now = time.time()
+        total = self._rss(self._process)
+        try:
+            children = self._process.children(recursive=True)
+        except psutil.Error:
+            children = []
+        listed = time.time()  # Later than every listed child's start, so it can be compared with a stage's start
+        child_rss = []
+        for child in children:
+            rss = self._rss(child)
+            if rss:
+                # Read every time: a child caught between fork and exec still shows this process's command
+                child_rss.append((child, rss, self._cpu(child), self._cmdline(child)))
+                total += rss
+
+        total_mb = total / 1024 / 1024
+        with self._lock:
+            self._samples.append((now, total_mb))
+            for child, rss, cpu, command in child_rss:
+                record = self._children.get(child.pid)
+                if record is None:
+                    record = {'pid': child.pid, 'peak_mb': 0.0, 'cpu_seconds': 0.0,
+                              'first_seen': listed, 'last_seen': listed}
+                    self._children[child.pid] = record
+                record['name'] = self._describe(child.pid, command)
+                record['command'] = tuple(command)
+                record['peak_mb'] = max(record['peak_mb'], rss / 1024 / 1024)
+                record['cpu_seconds'] = max(record['cpu_seconds'], cpu)
+                record['last_seen'] = listed
+        return total_mb
+
+    def peak_between(self, start: float, end: float = None) -> float:
+        """Highest sampled tree RSS (MB) in [start, end]; 0.0 if nothing was sampled"""
+        end = end if end is not None else time.time()
+        with self._lock:
+            return max((mb for at, mb in self._samples if start <= at <= end), default=0.0)
+
+    def process_peaks(self, since: float = None, limit: int = 10) -> list:
+        """Per-child peaks (largest first), optionally only children seen after `since`"""
+        with self._lock:
+            records = [dict(r) for r in self._children.values() if since is None or r['last_seen'] >= since]
+        records.sort(key=lambda r: r['peak_mb'], reverse=True)
+        return [{
+            'pid': r['pid'],
+            'name': r['name'],
+            'peak_mb': round(r['peak_mb'], 1),
+            'seconds_observed': round(r['last_seen'] - r['first_seen'], 1)
+        } for r in records[:limit]]
+
+    def children_cpu_seconds(self, commands, since: float) -> float:
+        """CPU seconds, as of their last sample, of children first seen at `since` or later running one of `commands`"""
+        commands = set(commands)
+        with self._lock:
+            return sum(r['cpu_seconds'] for r in self._children.values()
+                       if r['command'] in commands and r['first_seen'] >= since)
+
+    def sample_count(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                logger.debug(f"Memory sample failed: {e}")
+            self._stop.wait(self.interval)
+
+    @staticmethod
+    def _rss(process) -> int:
+        try:
+            return process.memory_info().rss
+        except psutil.Error:
+            return 0
+
+    @staticmethod
+    def _cpu(process) -> float:
+        try:
+            times = process.cpu_times()
+            return times.user + times.system
+        except psutil.Error:
+            return 0.0
+
+    @staticmethod
+    def _cmdline(process) -> list:
+        try:
+            return process.cmdline()
+        except psutil.Error:
+            return []
+
+    @staticmethod
+    def _describe(pid: int, cmdline: list) -> str:
+        """'ffmpeg -> normalized_003.mp4': executable plus its last argument (the output)"""
+        if not cmdline:
+            return f"pid {pid}"
+        name = os.path.basename(cmdline[0])
+        if len(cmdline) > 1:
+            return f"{name} -> {os.path.basename(cmdline[-1])}"
+        return name
@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import psutil
+
+logger = logging.getLogger()
+
+# Metric name -> CloudWatch unit for every per-stage value emitted as EMF
+_STAGE_METRICS = {
+    'WallTime': 'Seconds',
+    'BusyTime': 'Seconds',
+    'CpuTime': 'Seconds',
+    'Bytes': 'Bytes',
+    'PeakMemory': 'Megabytes',
+    'Count': 'Count',
+    'Errors': 'Count'
+}
+
+
+def _cpu_seconds() -> float:
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+# Commands each open stage block has started on this thread, innermost block last
+_spawned = threading.local()
+
+
+def _record_spawn(event: str, args: tuple):
+    """Audit hook: note every subprocess a stage block starts, whichever call site starts it"""
+    if event != 'subprocess.Popen':
+        return
+    blocks = getattr(_spawned, 'blocks', None)
+    if not blocks or not isinstance(args[1], (list, tuple)):
+        return
+    try:
+        command = tuple(os.fsdecode(arg) for arg in args[1])
+    except TypeError:
+        return  # Never fail the Popen call itself; the child just goes uncounted
+    for commands in blocks:
+        commands.append(command)
+
+
+sys.addaudithook(_record_spawn)
+
+
+def _current_rss_mb() -> float:
+    try:
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except Exception:
+        return 0.0
+
+
+class StageHandle:
+    """Handed out by `stage()` so the timed block can report the bytes it moved"""
+
+    def __init__(self):
+        self.bytes = 0
+
+    def add_bytes(self, count: int):
+        self.bytes += int(count or 0)
+
+
+class StageRecorder:
+    """
+    Collects wall time, CPU time, bytes and peak memory for named job stages.
+
+    Stages may run concurrently (per-clip downloads and normalizations), so every
+    timed block is kept as its own entry and aggregated in `summary()`. A block's
+    CPU time is its own thread's (`time.thread_time()`) plus, with a
+    `memory_sampler`, the CPU of the ffmpeg children it started, as of their last
+    sample, so overlapping blocks never count each other's work. Children that
+    exit within one sampling interval are not counted, nor is work handed to other
+    threads; `process_cpu_seconds()` is the job-wide total. Peak memory comes from
+    `memory_sampler` (a ProcessTreeSampler): the highest process-tree RSS sampled
+    during the block, ffmpeg children included. Without a sampler only this process
+    is measured, at the start and end of the block.
+    """
+
+    def __init__(self, memory_sampler=None):
+        self.memory_sampler = memory_sampler
+        self.entries = []
+        self.dimensions = {}
+        self._cpu_started = _cpu_seconds()
+        self._lock = threading.Lock()
+
+    def process_cpu_seconds(self) -> float:
+        """Process-wide CPU time since the job started, reaped ffmpeg children included"""
+        return round(max(0.0, _cpu_seconds() - self._cpu_started), 3)
+
+    @contextmanager
+    def stage(self, name: str, item=None):
+        handle = StageHandle()
+        started = time.time()
+        thread_cpu_started = time.thread_time()
+        commands = []
+        if not hasattr(_spawned, 'blocks'):
+            _spawned.blocks = []
+        _spawned.blocks.append(commands)
+        start_rss = _current_rss_mb() if self.memory_sampler is None else 0.0
+        failed = False
+        try:
+            yield handle
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            ended = time.time()
+            cpu_seconds = max(0.0, time.thread_time() - thread_cpu_started)
+            _spawned.blocks.pop()  # Blocks on one thread always close innermost first
+            if self.memory_sampler is not None:
+                cpu_seconds += self.memory_sampler.children_cpu_seconds(commands, started)
+                # Include a sample taken now so blocks shorter than the sampling interval still report
+                peak = max(self.memory_sampler.peak_between(started, ended), self.memory_sampler.sample())
+            else:
+                peak = max(start_rss, _current_rss_mb())
+            entry = {
+                'stage': name,
+                'item': item,
+                'start': started,
+                'end': ended,
+                'cpu_seconds': cpu_seconds,
+                'bytes': handle.bytes,
+                'peak_memory_mb': peak,
+                'failed': failed
+            }
+            with self._lock:
+                self.entries.append(entry)
+
+    def summary(self) -> dict:
+        """Per-stage aggregate, in the order stages first started"""
+        with self._lock:
+            entries = sorted(self.entries, key=lambda e: e['start'])
+
+        stages = {}
+        for entry in entries:
+            totals = stages.setdefault(entry['stage'], {
+                'count': 0, 'errors': 0, 'first_start': entry['start'], 'last_end': entry['end'],
+                'busy_seconds': 0.0, 'cpu_seconds': 0.0, 'bytes': 0, 'peak_memory_mb': 0.0, 'items': []
+            })
+            totals['count'] += 1
+            totals['errors'] += int(entry['failed'])
+            totals['last_end'] = max(totals['last_end'], entry['end'])
+            totals['busy_seconds'] += entry['end'] - entry['start']
+            totals['cpu_seconds'] += entry['cpu_seconds']
+            totals['bytes'] += entry['bytes']
+            totals['peak_memory_mb'] = max(totals['peak_memory_mb'], entry['peak_memory_mb'])
+            if entry['item'] is not None:
+                totals['items'].append({'item': entry['item'], 'seconds': round(entry['end'] - entry['start'], 3)})
+
+        result = {}
+        for name, totals in stages.items():
+            result[name] = {
+                'count': totals['count'],
+                'errors': totals['errors'],
+                # Elapsed from the first block starting to the last one ending (blocks may overlap)
+                'wall_seconds': round(totals['last_end'] - totals['first_start'], 3),
+                'busy_seconds': round(totals['busy_seconds'], 3),
+                'cpu_seconds': round(totals['cpu_seconds'], 3),
+                'bytes': totals['bytes'],
+                'peak_memory_mb': round(totals['peak_memory_mb'], 1)
+            }
+            if totals['items']:
+                result[name]['items'] = totals['items']
+        return result
+
+    def emit_emf(self, namespace: str, properties: dict = None):
+        """
+        Write one CloudWatch Embedded Metric Format line per stage to stdout.
+        The Lambda log agent turns these into metrics (dimension: Stage); the
+        `properties` are kept as searchable fields on each line.
+        """
+        timestamp = int(time.time() * 1000)
+        for name, totals in self.summary().items():
+            record = {
+                '_aws': {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': namespace,
+                        'Dimensions': [['Stage']],
+                        'Metrics': [{'Name': metric, 'Unit': unit} for metric, unit in _STAGE_METRICS.items()]
+                    }]
+                },
+                'Stage': name,
+                'WallTime': totals['wall_seconds'],
+                'BusyTime': totals['busy_seconds'],
+                'CpuTime': totals['cpu_seconds'],
+                'Bytes': totals['bytes'],
+                'PeakMemory': totals['peak_memory_mb'],
+                'Count': totals['count'],
+                'Errors': totals['errors']
+            }
+            record.update(self.dimensions)
+            record.update(properties or {})
+            # EMF must be a bare JSON line, so bypass the logger's prefix
+            sys.stdout.write(json.dumps(record, default=str) + '\n')
+        sys.stdout.flush()
+
+
+_recorder = StageRecorder()
+
+
+def start_job(memory_sampler=None, **dimensions) -> StageRecorder:
+    """Begin a fresh recorder for one invocation; `stage()` records into it"""
+    global _recorder
+    _recorder = StageRecorder(memory_sampler=memory_sampler)
+    _recorder.dimensions = dimensions
+    return _recorder
+
+
+def get_recorder() -> StageRecorder:
+    return _recorder
+
+
+def stage(name: str, item=None):
+    """Time a block as part of the current job: `with stage('download', item=i) as s: s.add_bytes(n)`"""
+    return _recorder.stage(name, item=item)
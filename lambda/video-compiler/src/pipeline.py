@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+
+class PipelineCancelled(Exception):
+    """Raised for work that was skipped because another pipeline task failed"""
+    pass
+
+
+class PipelineExecutor:
+    """
+    Small thread-based stage executor.
+
+    Each stage gets its own bounded worker pool. Work is chained between stages
+    with `then`, so an item moves to the next stage as soon as its previous step
+    finishes instead of waiting for the whole stage to drain. Every task records
+    a (stage, label, start, end) interval so overlap and critical-path timings
+    can be reported afterwards.
+    """
+
+    def __init__(self, stage_workers: dict):
+        self.stage_workers = dict(stage_workers)
+        self.pools = {
+            stage: ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f'pipeline-{stage}')
+            for stage, workers in self.stage_workers.items()
+        }
+        self.cancel_event = threading.Event()
+        self.intervals = []
+        self._lock = threading.Lock()
+        self._first_error = None
+        self.start_time = time.time()
+
+    def submit(self, stage: str, fn, *args, label=None) -> Future:
+        """Run fn(*args) on the stage pool, recording its interval"""
+        queued_at = time.time()
+
+        def run():
+            if self.cancel_event.is_set():
+                raise PipelineCancelled(f"{stage} task {label} skipped")
+            started_at = time.time()
+            try:
+                return fn(*args)
+            except PipelineCancelled:
+                raise
+            except Exception as e:
+                self.fail(e)
+                raise
+            finally:
+                with self._lock:
+                    self.intervals.append({
+                        'stage': stage,
+                        'label': label,
+                        'queued': queued_at,
+                        'start': started_at,
+                        'end': time.time()
+                    })
+
+        return self.pools[stage].submit(run)
+
+    def then(self, upstream: Future, stage: str, fn, label=None) -> Future:
+        """Feed the result of `upstream` into fn on `stage` as soon as it is ready"""
+        downstream = Future()
+
+        def forward(done: Future):
+            if done.cancelled():
+                downstream.set_exception(PipelineCancelled(f"{stage} task {label} upstream cancelled"))
+                return
+            error = done.exception()
+            if error is not None:
+                downstream.set_exception(error)
+                return
+            try:
+                inner = self.submit(stage, fn, done.result(), label=label)
+            except RuntimeError as e:
+                # Pool already shut down because the pipeline failed
+                downstream.set_exception(PipelineCancelled(str(e)))
+                return
+            inner.add_done_callback(lambda f: _copy_future_state(f, downstream))
+
+        upstream.add_done_callback(forward)
+        return downstream
+
+    def fail(self, error: Exception):
+        """Record the first failure and signal every other task to stop"""
+        with self._lock:
+            if self._first_error is None:
+                self._first_error = error
+                logger.error(f"⛔ Pipeline failure, cancelling remaining work: {error}")
+        self.cancel_event.set()
+
+    def wait_all(self, futures: list) -> list:
+        """Wait for futures in order; re-raises the first real failure"""
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception:
+                if self._first_error is not None:
+                    raise self._first_error
+                raise
+        return results
+
+    def shutdown(self, detach: tuple = ()):
+        """Stop the pools; stages in `detach` keep running their queued tasks in the background"""
+        for stage, pool in self.pools.items():
+            if stage in detach:
+                pool.shutdown(wait=False)
+            else:
+                pool.shutdown(wait=True, cancel_futures=True)
+
+    def timings(self) -> dict:
+        """Per-stage busy/active time plus overlap and the critical path"""
+        wall_end = time.time()
+        with self._lock:
+            intervals = list(self.intervals)
+
+        stages = {}
+        for stage in self.stage_workers:
+            spans = [(i['start'], i['end']) for i in intervals if i['stage'] == stage]
+            stages[stage] = {
+                'tasks': len(spans),
+                'busy_seconds': round(sum(end - start for start, end in spans), 3),
+                'active_seconds': round(_union_length(spans), 3),
+                'queue_wait_seconds': round(sum(i['start'] - i['queued'] for i in intervals if i['stage'] == stage), 3)
+            }
+
+        all_spans = [(i['start'], i['end']) for i in intervals]
+        active_total = _union_length(all_spans)
+        summed_active = sum(s['active_seconds'] for s in stages.values())
+
+        return {
+            'wall_seconds': round(wall_end - self.start_time, 3),
+            'stages': stages,
+            # Time saved versus running the stages back to back
+            'overlap_seconds': round(max(0.0, summed_active - active_total), 3),
+            'critical_path': self._critical_path(intervals)
+        }
+
+    def _critical_path(self, intervals: list) -> list:
+        """Chain of tasks (by label) that finished last, including queue waits"""
+        labelled = [i for i in intervals if i['label'] is not None]
+        if not labelled:
+            return []
+        last_label = max(labelled, key=lambda i: i['end'])['label']
+        chain = sorted((i for i in labelled if i['label'] == last_label), key=lambda i: i['start'])
+        return [{
+            'stage': i['stage'],
+            'label': i['label'],
+            'start_offset': round(i['start'] - self.start_time, 3),
+            'wait_seconds': round(i['start'] - i['queued'], 3),
+            'run_seconds': round(i['end'] - i['start'], 3)
+        } for i in chain]
+
+
+def _copy_future_state(source: Future, target: Future):
+    if source.cancelled():
+        target.set_exception(PipelineCancelled("task cancelled"))
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def _union_length(spans: list) -> float:
+    """Total length covered by a set of (start, end) intervals"""
+    total = 0.0
+    current_start = current_end = None
+    for start, end in sorted(spans):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
@@ -0,0 +1,236 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger()
+
+# Share of the overall percent each stage contributes; stages may overlap (streaming pipeline)
+STAGE_WEIGHTS = {'download': 20, 'normalize': 30, 'compile': 45, 'upload': 5}
+# Distributed jobs: the workers download, normalize and encode their segments; the fan-in only joins
+DISTRIBUTED_STAGE_WEIGHTS = {'segments': 85, 'compile': 10, 'upload': 5}
+
+# Enough of the end of an ffmpeg -progress file to hold its last complete block
+_PROGRESS_TAIL_BYTES = 2048
+
+
+class FfmpegProgress:
+    """
+    One ffmpeg run reporting through `-progress <file>`. `args` go on the command
+    line (empty when nobody listens); the reporter reads the file's last out_time on
+    each tick, so ffmpeg's twice-a-second updates cost nothing in between.
+    """
+
+    def __init__(self, reporter, stage: str, path: str, offset: float, span: float):
+        self.reporter = reporter
+        self.stage = stage
+        self.path = path
+        self.offset = offset
+        self.span = span
+        self.total_seconds = 0.0  # Set once the caller knows the output duration
+        self.args = ['-progress', path] if path else []
+
+    def poll(self):
+        if not self.path or self.total_seconds <= 0:
+            return
+        out_seconds = read_ffmpeg_out_time(self.path)
+        if out_seconds is not None:
+            self.reporter.report(self.stage, self.offset + self.span * min(1.0, out_seconds / self.total_seconds))
+
+    def close(self):
+        if not self.path:
+            return
+        self.reporter._unwatch(self)
+        self.poll()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def read_ffmpeg_out_time(path: str) -> float:
+    """Last out_time reported in an ffmpeg -progress file, in seconds (None before the first block)"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - _PROGRESS_TAIL_BYTES))
+            lines = f.read().decode('utf-8', 'replace').splitlines()
+    except OSError:
+        return None
+    for line in reversed(lines):
+        # out_time_ms is microseconds as well (a long-standing ffmpeg quirk)
+        key, _, value = line.partition('=')
+        if key in ('out_time_us', 'out_time_ms'):
+            try:
+                return max(0, int(value)) / 1000000
+            except ValueError:
+                continue
+    return None
+
+
+class ProgressReporter:
+    """
+    Coalesces stage/percent events from the hot paths into at most one write every
+    `interval_seconds`, made by a background thread, so no download, encode or
+    ffmpeg loop ever waits on a database round trip.
+
+    Each stage has a completion fraction; the overall percent is the weighted sum
+    (`weights`), never moving backwards. `write(state)` receives
+    {'stage', 'percent', 'detail', 'updated_at'} and may raise: a failed write is
+    logged and the next tick tries again with the newest state. Without `write`
+    the reporter only keeps state (jobs without a video_id, segment workers).
+    """
+
+    def __init__(self, write=None, interval_seconds: float = 2.0, weights: dict = None):
+        self._write = write
+        self.interval_seconds = interval_seconds
+        self.weights = dict(weights or STAGE_WEIGHTS)
+        self._fractions = {}
+        self._counts = {}
+        self._stage = 'queued'
+        self._detail = None
+        self._percent = 0
+        self._dirty = False
+        self._watches = []
+        self._watch_number = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'events': 0, 'writes': 0, 'failed_writes': 0}
+
+    def start(self) -> 'ProgressReporter':
+        if self._write is not None and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='progress-reporter', daemon=True)
+            self._thread.start()
+        return self
+
+    def set_weights(self, weights: dict):
+        with self._lock:
+            self.weights = dict(weights)
+
+    def report(self, stage: str, fraction: float = None, detail: str = None):
+        """Stage `stage` is `fraction` (0-1) done; only the latest state is kept until the next write"""
+        with self._lock:
+            self.stats['events'] += 1
+            if fraction is not None:
+                self._fractions[stage] = max(self._fractions.get(stage, 0.0), min(1.0, fraction))
+            percent = max(self._percent, self._overall_percent())
+            if stage != self._stage or detail != self._detail or percent != self._percent:
+                self._dirty = True
+            self._stage = stage
+            self._detail = detail
+            self._percent = percent
+
+    def advance(self, stage: str, total: int, detail: str = None):
+        """One more of `total` items of `stage` finished (thread-safe counter)"""
+        with self._lock:
+            done = self._counts[stage] = self._counts.get(stage, 0) + 1
+        self.report(stage, done / max(1, total), detail or f"{min(done, total)}/{total}")
+
+    def complete(self, *stages: str):
+        for stage in stages:
+            self.report(stage, 1.0)
+
+    def watch_ffmpeg(self, stage: str, directory: str, offset: float = 0.0, span: float = 1.0) -> FfmpegProgress:
+        """
+        Progress of one ffmpeg run as `stage` going from `offset` to `offset + span`.
+        Put `.args` on the command, set `.total_seconds`, and `.close()` when it exits.
+        """
+        if self._write is None:
+            return FfmpegProgress(self, stage, None, offset, span)
+        with self._lock:
+            self._watch_number += 1
+            path = os.path.join(directory, f"ffmpeg_progress_{self._watch_number:03d}.txt")
+            watch = FfmpegProgress(self, stage, path, offset, span)
+            self._watches.append(watch)
+        return watch
+
+    def state(self) -> dict:
+        with self._lock:
+            return {
+                'stage': self._stage,
+                'percent': self._percent,
+                'detail': self._detail,
+                'updated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+            }
+
+    def close(self, stage: str = None, flush: bool = True) -> dict:
+        """
+        Stop the writer thread (waiting for a write in flight) and return the final state.
+        With `stage` the job is finished: 100% under that stage. With `flush` a state not
+        yet written goes out now; otherwise the caller writes it with its own update.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(5.0, self.interval_seconds * 2))
+            self._thread = None
+        if stage is not None:
+            with self._lock:
+                self._stage = stage
+                self._detail = None
+                self._percent = 100
+                self._dirty = True
+        if flush:
+            self._flush()
+        return self.state()
+
+    def _overall_percent(self) -> int:
+        total = sum(self.weights.values()) or 1
+        done = sum(weight * self._fractions.get(stage, 0.0) for stage, weight in self.weights.items())
+        # 100 is reserved for the finished job
+        return min(99, int(done * 100 / total))
+
+    def _unwatch(self, watch: FfmpegProgress):
+        with self._lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self._flush()
+
+    def _flush(self):
+        if self._write is None:
+            return
+        with self._lock:
+            watches = list(self._watches)
+        for watch in watches:
+            watch.poll()
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._dirty = False
+            state = self.state()
+            try:
+                self._write(state)
+                self.stats['writes'] += 1
+            except Exception as e:
+                self.stats['failed_writes'] += 1
+                with self._lock:
+                    self._dirty = True
+                logger.warning(f"Progress update failed: {e}")
+
+
+_reporter = ProgressReporter()
+
+
+def start_progress(write=None, interval_seconds: float = 2.0, weights: dict = None) -> ProgressReporter:
+    """Start a job's reporter; a reporter left over from a previous invocation is stopped without writing"""
+    global _reporter
+    _reporter.close(flush=False)
+    _reporter = ProgressReporter(write, interval_seconds, weights).start()
+    return _reporter
+
+
+def finish_progress(stage: str = None, flush: bool = True) -> dict:
+    """Stop the job's reporter (see ProgressReporter.close); later events go to a silent one"""
+    global _reporter
+    reporter = _reporter
+    _reporter = ProgressReporter()
+    return reporter.close(stage, flush)
+
+
+def get_progress() -> ProgressReporter:
+    return _reporter
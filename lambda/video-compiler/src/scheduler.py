@@ -0,0 +1,203 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger()
+
+
+@dataclass(frozen=True)
+class EncoderProfile:
+    """One rung of the encoder ladder: x264 preset/CRF plus a resolution tier"""
+    name: str
+    preset: str
+    crf: int
+    scale: float = 1.0  # Fraction of the aspect config's width/height
+    speed: float = 1.0  # Encode throughput relative to the first profile
+
+
+# Ordered from best quality to fastest. Every preset here keeps x264's High profile, but presets
+# differ in reference frames, B-frames and PPS flags, so parts encoded with different rungs do
+# not share codec headers (SPS/PPS) and cannot be joined with -c copy: jobs that plan such a
+# join pin the preset (see DeadlineScheduler.plan).
+ENCODER_PROFILES = (
+    EncoderProfile('standard', 'faster', 24),
+    EncoderProfile('fast', 'veryfast', 25, speed=1.5),
+    EncoderProfile('rapid', 'superfast', 26, speed=2.2),
+    EncoderProfile('reduced', 'superfast', 26, scale=0.75, speed=3.6),
+    EncoderProfile('minimal', 'superfast', 27, scale=0.5, speed=7.0),
+)
+
+
+class DeadlineScheduler:
+    """
+    Picks encoder settings so a job finishes before the Lambda deadline.
+
+    Encode cost is modelled as media seconds divided by throughput: `speed` is how many
+    media seconds the whole machine encodes per wall second with the first profile at
+    full resolution, and each profile multiplies it by its own `speed`. `plan()` takes
+    the probed clip durations and picks the best profile whose estimate fits in
+    `headroom` of the time left. The resolution tier is fixed there, because clips of
+    different sizes cannot be concatenated; after every encode `record_encode()` folds
+    the measured throughput into `speed` and, if the remaining work no longer fits,
+    steps down to a faster preset of the same tier for the rest of the job (unless the
+    preset is pinned, because the job joins its encodes with -c copy).
+    """
+
+    def __init__(self, deadline: float, speed: float, profiles: tuple = ENCODER_PROFILES, headroom: float = 0.8):
+        self.deadline = deadline
+        self.speed = speed
+        self.profiles = profiles
+        self.headroom = headroom
+        self.profile = profiles[0]
+        self.clip_seconds = {}
+        self.compile_seconds = 0.0
+        self.done_clips = set()
+        self.compile_done = False
+        self.planned = None
+        self.switches = []
+        self.measurements = []
+        self._lock = threading.Lock()
+
+    def time_left(self) -> float:
+        return self.deadline - time.time()
+
+    def estimate_seconds(self, media_seconds: float, profile: EncoderProfile = None, share: float = 1.0) -> float:
+        """Expected wall time to encode `media_seconds` with `share` of the CPUs"""
+        profile = profile or self.profile
+        return media_seconds / (self.speed * profile.speed * max(share, 0.01))
+
+    def remaining_work(self) -> float:
+        """Media seconds still to encode: unfinished clips plus the compile encode"""
+        with self._lock:
+            pending = sum(seconds for index, seconds in self.clip_seconds.items() if index not in self.done_clips)
+            return pending + (0.0 if self.compile_done else self.compile_seconds)
+
+    def plan(self, clip_seconds: list, compile_seconds: float, profile_name: str = None,
+             scale: float = None, pin_preset: bool = False) -> EncoderProfile:
+        """
+        Choose the profile for a job. `clip_seconds` are the per-clip normalization
+        encodes (empty for single-pass), `compile_seconds` the media seconds the compile
+        step encodes. `profile_name` forces a profile (no mid-job fallback then);
+        `scale` pins the resolution tier (distributed segments must all match) and
+        `pin_preset` keeps the chosen profile for the whole job (copy-based joins).
+        """
+        with self._lock:
+            self.clip_seconds = dict(enumerate(clip_seconds))
+            self.compile_seconds = compile_seconds
+            self.done_clips = set()
+            self.compile_done = False
+        work = self.remaining_work()
+        budget = self.time_left() * self.headroom
+
+        forced = next((p for p in self.profiles if p.name == profile_name), None)
+        candidates = [p for p in self.profiles if scale is None or p.scale == scale] or list(self.profiles)
+        if forced is not None:
+            chosen = forced
+        else:
+            chosen = next((p for p in candidates if self.estimate_seconds(work, p) <= budget), candidates[-1])
+        self.profile = chosen
+        self.planned = {
+            'profile': chosen.name,
+            'forced': forced is not None,
+            'pinned': pin_preset,
+            'media_seconds': round(work, 1),
+            'estimated_seconds': round(self.estimate_seconds(work, chosen), 1),
+            'budget_seconds': round(budget, 1),
+            'speed': round(self.speed, 3)
+        }
+        if forced is None and self.estimate_seconds(work, chosen) > budget:
+            logger.warning(f"⏱️  Even the fastest encoder profile may miss the deadline: {self.planned}")
+        logger.info(f"⏱️  Encode schedule: {self.planned}")
+        return chosen
+
+    def timeout_for(self, media_seconds: float, share: float = 1.0, minimum: float = 30) -> float:
+        """Subprocess timeout for one encode: a generous multiple of its estimate, never past the deadline"""
+        expected = self.estimate_seconds(media_seconds, share=share)
+        return max(minimum, min(expected * 3 + minimum, self.time_left()))
+
+    def cap_timeout(self, seconds: float, minimum: float = 10) -> float:
+        """Clamp a fixed timeout (copy/remux steps) to the time left"""
+        return max(minimum, min(seconds, self.time_left()))
+
+    def mark_done(self, index: int):
+        """A clip finished without an encode (cache hit, stream copy, fallback)"""
+        with self._lock:
+            self.done_clips.add(index)
+
+    def record_encode(self, media_seconds: float, seconds: float, profile: EncoderProfile, share: float = 1.0,
+                      index: int = None):
+        """
+        Fold one finished encode into the throughput estimate, then check the rest of the job
+        still fits. `index` is the clip for normalizations, None for the compile encode.
+        """
+        with self._lock:
+            if index is None:
+                self.compile_done = True
+            else:
+                self.done_clips.add(index)
+                self.clip_seconds[index] = media_seconds
+            if media_seconds > 0 and seconds > 0.5:
+                measured = media_seconds / seconds / max(share, 0.01) / profile.speed
+                # Smooth over per-clip noise (very short clips are dominated by startup)
+                self.speed = measured if not self.measurements else 0.5 * self.speed + 0.5 * measured
+                self.measurements.append({'profile': profile.name, 'media_seconds': round(media_seconds, 2),
+                                          'seconds': round(seconds, 2), 'share': round(share, 2)})
+        self._check_progress()
+
+    def _check_progress(self):
+        if self.planned is None or self.planned['forced'] or self.planned['pinned']:
+            return
+        work = self.remaining_work()
+        if work <= 0:
+            return
+        left = self.time_left() * self.headroom
+        # Only presets change mid-job: the resolution tier is fixed once clips exist
+        ladder = [p for p in self.profiles if p.scale == self.profile.scale]
+        position = ladder.index(self.profile)
+        while self.estimate_seconds(work) > left and position + 1 < len(ladder):
+            position += 1
+            previous = self.profile
+            self.profile = ladder[position]
+            self.switches.append({
+                'from': previous.name,
+                'to': self.profile.name,
+                'at_seconds_left': round(self.time_left(), 1),
+                'remaining_media_seconds': round(work, 1)
+            })
+            logger.warning(f"⏩ Behind schedule ({work:.1f}s of media left, {left:.0f}s budget): "
+                           f"switching encoder profile {previous.name} -> {self.profile.name}")
+
+    def summary(self) -> dict:
+        return {
+            'planned': self.planned,
+            'final_profile': self.profile.name,
+            'switches': list(self.switches),
+            'speed': round(self.speed, 3),
+            'encodes': len(self.measurements),
+            'seconds_left': round(self.time_left(), 1)
+        }
+
+
+# Throughput measured by the previous job; warm containers start from it instead of the prior
+_measured_speed = None
+_scheduler = DeadlineScheduler(deadline=time.time() + 900, speed=1.0)
+
+
+def start_schedule(seconds_left: float, speed_prior: float, headroom: float = 0.8) -> DeadlineScheduler:
+    """Begin a fresh schedule for one invocation that must finish within `seconds_left`"""
+    global _scheduler
+    _scheduler = DeadlineScheduler(deadline=time.time() + seconds_left, speed=_measured_speed or speed_prior,
+                                   headroom=headroom)
+    return _scheduler
+
+
+def finish_schedule():
+    """Remember the job's measured throughput for the next warm invocation"""
+    global _measured_speed
+    if _scheduler.measurements:
+        _measured_speed = _scheduler.speed
+
+
+def get_scheduler() -> DeadlineScheduler:
+    return _scheduler
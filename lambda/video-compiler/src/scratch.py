@@ -0,0 +1,213 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+
+class ScratchBudgetExceeded(Exception):
+    """Raised before work whose predicted output does not fit in the scratch budget"""
+    pass
+
+
+class ScratchSpace:
+    """
+    Byte accounting for one job's intermediates in ephemeral storage (/tmp).
+
+    Artifacts are registered by path with a kind ('raw', 'normalized', 'music',
+    'output', ...). Their sizes are read from disk whenever usage is computed, so
+    writers never report sizes, and a deleted artifact simply drops out. `release()`
+    marks an artifact as no longer needed: it stays on disk until space is actually
+    required, then `reserve()` evicts released artifacts oldest first, followed by
+    the registered evictors (e.g. local cache tiers trimming entries no job uses).
+    `reserve()` is called before an encode with its predicted output size and
+    raises ScratchBudgetExceeded if the output still would not fit, instead of
+    letting ffmpeg die with ENOSPC halfway through. The reservation is held until the
+    encode ends, so concurrent encodes (parallel normalizations) cannot all pass
+    the check against the same free bytes.
+    """
+
+    def __init__(self, root: str, budget_bytes: int = 0):
+        self.root = root
+        self.budget_bytes = budget_bytes  # 0: limited by free space on the filesystem only
+        self._artifacts = {}
+        self._evictors = []
+        self._reservations = []
+        self._lock = threading.Lock()
+        # Check-and-reserve is one step, so two reservations never see the same free bytes
+        self._reserve_lock = threading.Lock()
+        self.stats = {'reservations': 0, 'rejected': 0, 'evictions': 0, 'evicted_bytes': 0, 'evictor_bytes': 0,
+                      'peak_bytes': 0}
+
+    def track(self, path: str, kind: str) -> str:
+        """Register an artifact (existing or about to be written); returns the path"""
+        with self._lock:
+            self._artifacts[os.path.abspath(str(path))] = {'kind': kind, 'released_at': None}
+        return str(path)
+
+    def release(self, path: str):
+        """The job no longer needs this artifact; it may be evicted when space runs short"""
+        with self._lock:
+            artifact = self._artifacts.get(os.path.abspath(str(path)))
+            if artifact is not None and artifact['released_at'] is None:
+                artifact['released_at'] = time.time()
+
+    def add_evictor(self, evictor):
+        """`evictor(bytes_needed) -> bytes_freed`, asked for space after released artifacts are gone"""
+        self._evictors.append(evictor)
+
+    def used_bytes(self) -> int:
+        """Bytes of the job's files under root, tracked or not"""
+        total = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(directory, name)).st_size
+                except FileNotFoundError:
+                    pass
+        self.stats['peak_bytes'] = max(self.stats['peak_bytes'], total)
+        return total
+
+    def reserved_bytes(self) -> int:
+        """Bytes promised to encodes in flight and not yet written by them"""
+        with self._lock:
+            reservations = list(self._reservations)
+        return sum(reservation.outstanding() for reservation in reservations)
+
+    def free_bytes(self) -> int:
+        """Room left for new files: the budget minus usage and reservations, never more than the filesystem has free"""
+        free = shutil.disk_usage(self.root).free
+        if self.budget_bytes > 0:
+            free = min(free, self.budget_bytes - self.used_bytes())
+        return max(0, free - self.reserved_bytes())
+
+    def reserve(self, predicted_bytes: int, what: str, path: str = None) -> 'Reservation':
+        """
+        Set aside `predicted_bytes` for `what`, evicting if needed; raises ScratchBudgetExceeded
+        when they cannot be found. Release the returned Reservation when the encode ends
+        (it is a context manager). With `path`, bytes already written there count against it.
+        """
+        predicted_bytes = int(predicted_bytes)
+        with self._reserve_lock:
+            self.stats['reservations'] += 1
+            free = self.free_bytes()
+            if free < predicted_bytes:
+                self._evict_released(predicted_bytes - free)
+                free = self.free_bytes()
+            for evictor in self._evictors:
+                if free >= predicted_bytes:
+                    break
+                try:
+                    freed = evictor(predicted_bytes - free)
+                except Exception as e:
+                    logger.warning(f"Scratch evictor failed: {e}")
+                    continue
+                self.stats['evictor_bytes'] += freed
+                free = self.free_bytes()
+            if free < predicted_bytes:
+                self.stats['rejected'] += 1
+                raise ScratchBudgetExceeded(
+                    f"Not enough ephemeral storage for {what}: needs ~{predicted_bytes/1024/1024:.0f}MB, "
+                    f"{free/1024/1024:.0f}MB free ({self.used_bytes()/1024/1024:.0f}MB used by this job, "
+                    f"{self.reserved_bytes()/1024/1024:.0f}MB reserved"
+                    f"{f', budget {self.budget_bytes/1024/1024:.0f}MB' if self.budget_bytes else ''})")
+            reservation = Reservation(self, predicted_bytes, path)
+            with self._lock:
+                self._reservations.append(reservation)
+            return reservation
+
+    def _end_reservation(self, reservation: 'Reservation'):
+        with self._lock:
+            if reservation in self._reservations:
+                self._reservations.remove(reservation)
+
+    def summary(self) -> dict:
+        by_kind = {}
+        with self._lock:
+            artifacts = list(self._artifacts.items())
+        for path, artifact in artifacts:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            by_kind[artifact['kind']] = by_kind.get(artifact['kind'], 0) + size
+        return dict(self.stats,
+                    used_mb=round(self.used_bytes() / 1024 / 1024, 1),
+                    peak_mb=round(self.stats['peak_bytes'] / 1024 / 1024, 1),
+                    budget_mb=round(self.budget_bytes / 1024 / 1024, 1) if self.budget_bytes else None,
+                    by_kind_mb={kind: round(size / 1024 / 1024, 1) for kind, size in by_kind.items()})
+
+    def _evict_released(self, bytes_needed: int):
+        with self._lock:
+            released = sorted(((path, artifact) for path, artifact in self._artifacts.items()
+                               if artifact['released_at'] is not None), key=lambda item: item[1]['released_at'])
+        freed = 0
+        for path, artifact in released:
+            if freed >= bytes_needed:
+                break
+            try:
+                st = os.stat(path)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            else:
+                # A hard link elsewhere (e.g. a cache entry) keeps the blocks allocated
+                if st.st_nlink == 1:
+                    freed += st.st_size
+                self.stats['evictions'] += 1
+                logger.info(f"🗑️  Evicted {artifact['kind']} intermediate {os.path.basename(path)} "
+                            f"({st.st_size/1024/1024:.1f}MB)")
+            with self._lock:
+                self._artifacts.pop(path, None)
+        self.stats['evicted_bytes'] += freed
+
+
+class Reservation:
+    """Space set aside by ScratchSpace.reserve until release() (or the end of a with block)"""
+
+    def __init__(self, scratch: ScratchSpace, predicted_bytes: int, path: str = None):
+        self.scratch = scratch
+        self.predicted_bytes = predicted_bytes
+        self.path = path
+
+    def outstanding(self) -> int:
+        """The part of the prediction not yet on disk (it already counts as used)"""
+        if self.path is None:
+            return self.predicted_bytes
+        try:
+            written = os.path.getsize(self.path)
+        except OSError:
+            written = 0
+        return max(0, self.predicted_bytes - written)
+
+    def release(self):
+        self.scratch._end_reservation(self)
+
+    def __enter__(self) -> 'Reservation':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+_scratch = ScratchSpace(tempfile.gettempdir())
+
+
+@contextmanager
+def scratch_space(root: str, budget_bytes: int = 0):
+    """Scratch accounting for one invocation whose files live under `root`"""
+    global _scratch
+    previous = _scratch
+    _scratch = ScratchSpace(root, budget_bytes)
+    try:
+        yield _scratch
+    finally:
+        _scratch = previous
+
+
+def get_scratch() -> ScratchSpace:
+    return _scratch
@@ -0,0 +1,461 @@
+import base64
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger()
+
+# Supabase resumable uploads require every chunk except the last to be exactly 6MB
+TUS_CHUNK_SIZE = 6 * 1024 * 1024
+
+
+class StreamingUploadError(Exception):
+    """Raised when a streaming (resumable) upload cannot be completed"""
+    pass
+
+
+class DownloadCancelled(Exception):
+    """Raised inside a download worker when another clip download has failed"""
+    pass
+
+
+class StorageDownloadError(Exception):
+    """Raised when a download fails for good (non-retryable status or attempts exhausted)"""
+    pass
+
+
+class PooledSession(requests.Session):
+    """
+    requests.Session tuned for storage traffic.
+
+    One keep-alive connection pool (up to `pool_size` sockets per host) is shared by
+    every download and upload, so signed-URL GETs and TUS PATCHes reuse TLS
+    connections instead of handshaking per file. Every request gets a default
+    (connect, read) timeout and is recorded: latency to response headers, errors,
+    and how many connections urllib3 had to open, which gives the reuse rate.
+    """
+
+    def __init__(self, pool_size: int = 16, connect_timeout: float = 10, read_timeout: float = 60,
+                 max_attempts: int = 4, backoff: float = 0.5):
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.default_timeout = (connect_timeout, read_timeout)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self._stats_lock = threading.Lock()
+        self._pools = {}
+        self.reset_stats()
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault('timeout', self.default_timeout)
+        started = time.time()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except requests.RequestException:
+            with self._stats_lock:
+                self._requests += 1
+                self._errors += 1
+            raise
+        elapsed = time.time() - started
+        pool = getattr(response.raw, '_pool', None)
+        with self._stats_lock:
+            self._requests += 1
+            self._latencies.append(elapsed)
+            if pool is not None and id(pool) not in self._pools:
+                self._pools[id(pool)] = pool
+                self._baseline.setdefault(id(pool), 0)
+        return response
+
+    def reset_stats(self):
+        """Start a new measurement window (per invocation); the pool itself is kept"""
+        with self._stats_lock:
+            self._requests = 0
+            self._errors = 0
+            self._retries = 0
+            self._resumed_bytes = 0
+            self._latencies = deque(maxlen=2000)
+            self._baseline = {key: pool.num_connections for key, pool in self._pools.items()}
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            opened = sum(pool.num_connections - self._baseline.get(key, 0) for key, pool in self._pools.items())
+            latencies = sorted(self._latencies)
+            requests_made = self._requests
+            stats = {
+                'requests': requests_made,
+                'connections_opened': opened,
+                'connections_reused': max(0, requests_made - self._errors - opened),
+                'errors': self._errors,
+                'retries': self._retries,
+                'resumed_bytes': self._resumed_bytes
+            }
+        if latencies:
+            stats['latency_ms'] = {
+                'p50': round(latencies[len(latencies) // 2] * 1000, 1),
+                'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+                'max': round(latencies[-1] * 1000, 1)
+            }
+        return stats
+
+    def download(self, url: str, local_path: str, cancel_event: threading.Event = None,
+                 chunk_size: int = 1024 * 1024) -> int:
+        """
+        Stream url into local_path, returns bytes written.
+
+        Transient failures (connection errors, timeouts, 5xx/408/429, truncated bodies)
+        are retried with jittered exponential backoff; each retry asks for
+        `Range: bytes=<offset>-` so already received bytes are kept. A server that
+        ignores the range (200) restarts the file. `cancel_event` is checked per chunk.
+        """
+        offset = 0
+        last_error = None
+        with open(local_path, 'wb') as f:
+            for attempt in range(self.max_attempts):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise DownloadCancelled(f"Download of {local_path} cancelled")
+                headers = {'Range': f'bytes={offset}-'} if offset else {}
+                try:
+                    with self.get(url, headers=headers, stream=True) as response:
+                        if offset and response.status_code == 416:
+                            return offset  # Everything already received
+                        if response.status_code not in (200, 206):
+                            if response.status_code < 500 and response.status_code not in (408, 429):
+                                raise StorageDownloadError(f"GET returned {response.status_code}: {response.text[:200]}")
+                            raise requests.RequestException(f"GET returned {response.status_code}")
+                        if offset and response.status_code == 200:
+                            # Range ignored: the body is the whole object again
+                            f.seek(0)
+                            f.truncate()
+                            offset = 0
+                        elif offset:
+                            with self._stats_lock:
+                                self._resumed_bytes += offset
+                        expected = response.headers.get('Content-Length')
+                        received = 0
+                        for chunk in response.iter_content(chunk_size):
+                            if cancel_event is not None and cancel_event.is_set():
+                                raise DownloadCancelled(f"Download of {local_path} cancelled")
+                            f.write(chunk)
+                            received += len(chunk)
+                            offset += len(chunk)
+                        if expected is not None and received < int(expected):
+                            raise requests.RequestException(f"Body truncated at {received} of {expected} bytes")
+                        f.flush()
+                        return offset
+                except requests.RequestException as e:
+                    last_error = e
+                    if attempt + 1 < self.max_attempts:
+                        with self._stats_lock:
+                            self._retries += 1
+                        delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.0)
+                        logger.warning(f"Download attempt {attempt+1}/{self.max_attempts} failed at byte {offset}, "
+                                       f"retrying in {delay:.1f}s: {e}")
+                        time.sleep(delay)
+        raise StorageDownloadError(f"Download failed after {self.max_attempts} attempts: {last_error}")
+
+
+class StreamingUpload:
+    """
+    Upload a file of unknown length to Supabase storage while it is still being produced.
+
+    Uses the storage TUS endpoint with a deferred Upload-Length: bytes passed to
+    `write` are cut into 6MB chunks and PATCHed by a background thread, so the
+    producer (an ffmpeg pipe) keeps encoding while earlier parts upload. At most
+    `max_pending_chunks` chunks are buffered in memory; `write` blocks beyond
+    that. `finish` sends the final chunk with the total length.
+    """
+
+    def __init__(self, supabase_url: str, service_key: str, bucket: str, object_path: str,
+                 content_type: str = 'video/mp4', upsert: bool = True, max_pending_chunks: int = 4,
+                 session: requests.Session = None):
+        self.endpoint = f"{supabase_url.rstrip('/')}/storage/v1/upload/resumable"
+        self.bucket = bucket
+        self.object_path = object_path
+        self.content_type = content_type
+        self.upsert = upsert
+        self.session = session or requests.Session()
+        self.headers = {
+            'Authorization': f'Bearer {service_key}',
+            'apikey': service_key,
+            'Tus-Resumable': '1.0.0'
+        }
+        self.location = None
+        self.offset = 0
+        self.bytes_written = 0
+        self.parts_uploaded = 0
+        self._buffer = bytearray()
+        self._queue = queue.Queue(maxsize=max(1, max_pending_chunks))
+        self._error = None
+        self._worker = None
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self):
+        metadata = {
+            'bucketName': self.bucket,
+            'objectName': self.object_path,
+            'contentType': self.content_type,
+            'cacheControl': '3600'
+        }
+        headers = dict(self.headers)
+        headers['Upload-Defer-Length'] = '1'
+        headers['Upload-Metadata'] = ','.join(
+            f"{key} {base64.b64encode(value.encode('utf-8')).decode('ascii')}" for key, value in metadata.items())
+        if self.upsert:
+            headers['x-upsert'] = 'true'
+
+        try:
+            response = self.session.post(self.endpoint, headers=headers, timeout=30)
+        except requests.RequestException as e:
+            raise StreamingUploadError(f"Could not create resumable upload: {e}")
+        if response.status_code not in (200, 201):
+            raise StreamingUploadError(f"Could not create resumable upload ({response.status_code}): {response.text}")
+        self.location = response.headers.get('Location')
+        if not self.location:
+            raise StreamingUploadError("Resumable upload created without a Location header")
+        if self.location.startswith('/'):
+            self.location = self.endpoint.split('/storage/')[0] + self.location
+
+        self.started_at = time.time()
+        self._worker = threading.Thread(target=self._upload_loop, name='streaming-upload', daemon=True)
+        self._worker.start()
+        logger.info(f"📤 Streaming upload started for {self.bucket}/{self.object_path}")
+        return self
+
+    def write(self, data: bytes):
+        """Buffer produced bytes; full chunks are handed to the upload thread"""
+        self._raise_if_failed()
+        self._buffer.extend(data)
+        self.bytes_written += len(data)
+        # Keep at least one byte back so the final PATCH always carries the total length
+        while len(self._buffer) > TUS_CHUNK_SIZE:
+            chunk = bytes(self._buffer[:TUS_CHUNK_SIZE])
+            del self._buffer[:TUS_CHUNK_SIZE]
+            self._put(chunk)
+
+    def finish(self) -> int:
+        """Upload the remaining bytes with the final length and wait for completion"""
+        self._raise_if_failed()
+        self._put((bytes(self._buffer), True))
+        self._buffer = bytearray()
+        self._put(None)
+        self._worker.join()
+        self._raise_if_failed()
+        self.finished_at = time.time()
+        logger.info(f"✅ Streaming upload complete: {self.bytes_written/1024/1024:.1f}MB in {self.parts_uploaded} parts")
+        return self.bytes_written
+
+    def abort(self):
+        """Stop the upload thread and discard the partial upload (best effort)"""
+        if self._error is None:
+            self._error = StreamingUploadError("Upload aborted")
+        if self._worker is not None and self._worker.is_alive():
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+        if self.location:
+            try:
+                self.session.delete(self.location, headers=self.headers, timeout=10)
+            except Exception as e:
+                logger.warning(f"Failed to discard partial upload {self.location}: {e}")
+
+    def _put(self, item):
+        # Block while the uploader is busy, but notice if it has died
+        while True:
+            self._raise_if_failed()
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _upload_loop(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                if self._error is not None:
+                    return
+                if isinstance(item, tuple):
+                    chunk, final = item
+                else:
+                    chunk, final = item, False
+                self._patch(chunk, final)
+        except Exception as e:
+            self._error = e
+            logger.error(f"Streaming upload failed: {e}")
+            # Drain so a blocked producer can observe the failure
+            while not self._queue.empty():
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _patch(self, chunk: bytes, final: bool, attempts: int = 3):
+        headers = dict(self.headers)
+        headers['Content-Type'] = 'application/offset+octet-stream'
+        if final:
+            headers['Upload-Length'] = str(self.offset + len(chunk))
+
+        start_offset = self.offset
+        for attempt in range(attempts):
+            # Resume from whatever the server already has of this chunk
+            sent = self.offset - start_offset
+            headers['Upload-Offset'] = str(self.offset)
+            try:
+                response = self.session.patch(self.location, headers=headers, data=chunk[sent:], timeout=120)
+                if response.status_code == 204:
+                    self.offset = int(response.headers.get('Upload-Offset', self.offset + len(chunk) - sent))
+                    self.parts_uploaded += 1
+                    return
+                error = f"PATCH returned {response.status_code}: {response.text}"
+            except requests.RequestException as e:
+                error = str(e)
+            logger.warning(f"Upload part at offset {self.offset} failed (attempt {attempt+1}/{attempts}): {error}")
+            time.sleep(0.5 * (2 ** attempt))
+            self.offset = self._server_offset()
+        raise StreamingUploadError(f"Upload part at offset {start_offset} failed after {attempts} attempts")
+
+    def _server_offset(self) -> int:
+        try:
+            response = self.session.head(self.location, headers=self.headers, timeout=15)
+            return int(response.headers.get('Upload-Offset', self.offset))
+        except Exception:
+            return self.offset
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise StreamingUploadError(f"Streaming upload failed: {self._error}")
+
+
+class HlsPublisher:
+    """
+    Publish an HLS rendition to storage while ffmpeg is still writing it.
+
+    A background thread polls `local_dir` for the playlist. ffmpeg rewrites the
+    playlist (atomically, with -hls_flags temp_file) only after a segment is
+    complete, so every segment listed there is safe to upload. New segments are
+    uploaded first, then the playlist, so a player never sees a reference to a
+    missing segment. `on_first_playlist(remote_playlist_path)` fires once the
+    first playlist is live; `on_abort(remote_playlist_path)` fires when an aborted
+    publisher had made it live, before anything is deleted, so whoever advertised
+    the playlist can withdraw it first.
+
+    `upload(local_path, remote_path, content_type, cache_control)` does the actual
+    storage write (with upsert, since the playlist is rewritten). `remove(remote_paths)`
+    (optional) deletes objects; `abort()` uses it to discard what was published.
+    """
+
+    PLAYLIST_NAME = 'index.m3u8'
+
+    def __init__(self, local_dir: str, remote_dir: str, upload, on_first_playlist=None, poll_interval: float = 1.0,
+                 remove=None, on_abort=None):
+        self.local_dir = local_dir
+        self.remote_dir = remote_dir.rstrip('/')
+        self.upload = upload
+        self.remove = remove
+        self.on_first_playlist = on_first_playlist
+        self.on_abort = on_abort
+        self.poll_interval = poll_interval
+        self.uploaded_segments = set()
+        self.playlist_uploads = 0
+        self.first_playlist_at = None
+        self._last_playlist = None
+        self._stop = threading.Event()
+        self._error = None
+        self._worker = None
+        self.started_at = None
+
+    @property
+    def remote_playlist_path(self) -> str:
+        return f"{self.remote_dir}/{self.PLAYLIST_NAME}"
+
+    def start(self):
+        os.makedirs(self.local_dir, exist_ok=True)
+        self.started_at = time.time()
+        self._worker = threading.Thread(target=self._poll_loop, name='hls-publisher', daemon=True)
+        self._worker.start()
+        logger.info(f"📺 HLS publisher watching {self.local_dir} -> {self.remote_dir}")
+        return self
+
+    def finish(self):
+        """Stop polling and publish whatever is left, including the final (ENDLIST) playlist"""
+        self._stop.set()
+        self._worker.join()
+        if self._error is not None:
+            raise StreamingUploadError(f"HLS publishing failed: {self._error}")
+        self._publish()
+        logger.info(f"✅ HLS published: {len(self.uploaded_segments)} segments, {self.playlist_uploads} playlist updates")
+
+    def abort(self):
+        """Stop polling and delete the segments and playlist published so far (best effort)"""
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join()
+        if self.first_playlist_at is not None and self.on_abort is not None:
+            try:
+                self.on_abort(self.remote_playlist_path)
+            except Exception as e:
+                logger.warning(f"on_abort callback failed: {e}")
+        remote_paths = [f"{self.remote_dir}/{segment}" for segment in sorted(self.uploaded_segments)]
+        if self.playlist_uploads:
+            remote_paths.insert(0, self.remote_playlist_path)  # Players stop finding it before its segments go
+        if self.remove is None or not remote_paths:
+            return
+        try:
+            self.remove(remote_paths)
+            logger.info(f"🗑️  Discarded {len(remote_paths)} published HLS objects under {self.remote_dir}")
+        except Exception as e:
+            logger.warning(f"Failed to discard published HLS objects under {self.remote_dir}: {e}")
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self._publish()
+            except Exception as e:
+                self._error = e
+                logger.error(f"HLS publishing failed: {e}")
+                return
+
+    def _publish(self):
+        playlist_file = os.path.join(self.local_dir, self.PLAYLIST_NAME)
+        try:
+            with open(playlist_file, 'r') as f:
+                playlist = f.read()
+        except FileNotFoundError:
+            return
+        if playlist == self._last_playlist:
+            return
+
+        for line in playlist.splitlines():
+            segment = line.strip()
+            if not segment or segment.startswith('#') or segment in self.uploaded_segments:
+                continue
+            self.upload(os.path.join(self.local_dir, segment), f"{self.remote_dir}/{segment}",
+                        'video/mp2t', '31536000')
+            self.uploaded_segments.add(segment)
+
+        # Playlists change while encoding, keep them out of CDN caches
+        self.upload(playlist_file, self.remote_playlist_path, 'application/vnd.apple.mpegurl', 'no-cache')
+        self.playlist_uploads += 1
+        self._last_playlist = playlist
+
+        if self.first_playlist_at is None:
+            self.first_playlist_at = time.time()
+            logger.info(f"📺 First HLS playlist live after {self.first_playlist_at - self.started_at:.1f}s")
+            if self.on_first_playlist is not None:
+                try:
+                    self.on_first_playlist(self.remote_playlist_path)
+                except Exception as e:
+                    logger.warning(f"on_first_playlist callback failed: {e}")
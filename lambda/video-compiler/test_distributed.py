@@ -0,0 +1,28 @@
+from distributed import split_segments
+
+
+def test_no_clips_no_segments():
+    assert split_segments([], 60, 8) == []
+
+
+def test_short_job_stays_one_segment():
+    assert split_segments([10, 20, 15], 60, 8) == [[0, 1, 2]]
+
+
+def test_segments_are_contiguous_and_balanced():
+    segments = split_segments([30] * 8, 60, 8)
+    assert segments == [[0, 1], [2, 3], [4, 5], [6, 7]]
+
+
+def test_segment_count_is_capped():
+    segments = split_segments([30] * 8, 30, 3)
+    assert len(segments) == 3
+    assert [index for segment in segments for index in segment] == list(range(8))
+
+
+def test_every_segment_gets_a_clip():
+    # One long clip first must not leave later segments empty
+    segments = split_segments([300, 5, 5, 5], 60, 4)
+    assert len(segments) == 4
+    assert all(segments)
+    assert [index for segment in segments for index in segment] == [0, 1, 2, 3]
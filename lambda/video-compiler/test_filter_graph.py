@@ -0,0 +1,139 @@
+import pytest
+
+from filter_graph import Filter, FilterGraph, FilterGraphError, parse_chain, render_chain
+from media_probe import MediaInfo
+
+NORMALIZE_CHAIN = ('scale=1920:1080:force_original_aspect_ratio=decrease,'
+                   'pad=1920:1080:(ow-iw)/2:(oh-ih)/2:black,setsar=1')
+
+
+def probed(width, height, rotation=None, fps='30/1'):
+    video = {'codec_type': 'video', 'width': width, 'height': height, 'r_frame_rate': fps,
+             'avg_frame_rate': fps, 'sample_aspect_ratio': '1:1'}
+    if rotation is not None:
+        video['side_data_list'] = [{'side_data_type': 'Display Matrix', 'rotation': rotation}]
+    return MediaInfo(path='clip.mp4', duration=5.0, size=1000, format_name='mp4', video=video)
+
+
+def normalized_graph(media):
+    graph = FilterGraph()
+    source = graph.add_input('clip.mp4', media)
+    graph.output(graph.chain(graph.stream(source), parse_chain(NORMALIZE_CHAIN)), 'outv')
+    return graph
+
+
+def fade(direction, start, duration, **options):
+    return Filter('fade', options=dict({'t': direction, 'st': start, 'd': duration}, **options))
+
+
+def faded_graph(fades):
+    graph = FilterGraph()
+    source = graph.add_input('clip.mp4')
+    graph.output(graph.chain(graph.stream(source), fades), 'outv')
+    return graph
+
+
+def test_parse_and_render_chain_round_trip():
+    assert render_chain(parse_chain(NORMALIZE_CHAIN)) == NORMALIZE_CHAIN
+    assert render_chain([]) == 'null'
+
+
+def test_noop_geometry_dropped_for_matching_input():
+    graph = normalized_graph(probed(1920, 1080))
+    graph.optimize()
+    # The labeled output needs a node, so the last no-op becomes a passthrough
+    assert graph.compile()[1] == '[0:v]null[outv]'
+
+
+def test_geometry_kept_for_other_sizes():
+    graph = normalized_graph(probed(1280, 720))
+    graph.optimize()
+    assert graph.compile()[1] == f'[0:v]{NORMALIZE_CHAIN}[outv]'
+
+
+def test_rotated_clip_compared_with_sides_swapped():
+    # Stored landscape but displayed portrait: ffmpeg autorotates, so the graph sees 1080x1920
+    graph = normalized_graph(probed(1920, 1080, rotation=-90))
+    graph.optimize()
+    assert graph.compile()[1] == f'[0:v]{NORMALIZE_CHAIN}[outv]'
+
+    # Stored portrait, displayed landscape: already the target once rotated
+    graph = normalized_graph(probed(1080, 1920, rotation=90))
+    graph.optimize()
+    assert graph.compile()[1] == '[0:v]null[outv]'
+
+
+def test_zero_length_and_repeated_fades_dropped():
+    zero_frames = Filter('fade', options={'t': 'out', 's': 240, 'n': 0})
+    graph = faded_graph([fade('in', 0, 0.5), fade('in', 0, 0.5), zero_frames])
+    stats = graph.optimize()
+    assert stats['redundant_fades'] == 2
+    assert graph.compile()[1] == '[0:v]fade=t=in:st=0:d=0.5[outv]'
+
+
+def test_fades_without_a_duration_kept():
+    # No d means ffmpeg's 25 frames, and d=0 means "use nb_frames": neither is zero-length
+    no_duration = Filter('fade', options={'t': 'in', 'st': 0})
+    fades = [no_duration, fade('in', 2, 0.5), fade('out', 9, 0)]
+    graph = faded_graph(fades)
+    assert graph.optimize()['redundant_fades'] == 0
+    assert graph.compile()[1] == '[0:v]' + render_chain(fades) + '[outv]'
+
+
+def test_covered_fades_merged():
+    # The second fade out starts after the first has already gone to black
+    graph = faded_graph([fade('out', 9, 0.5), fade('out', 9.5, 0.5)])
+    assert graph.optimize()['redundant_fades'] == 1
+    assert graph.compile()[1] == '[0:v]fade=t=out:st=9:d=0.5[outv]'
+
+    # The first fade in ends before the second starts, so it only darkens black frames
+    graph = faded_graph([fade('in', 0, 0.5), fade('in', 1, 0.5)])
+    assert graph.optimize()['redundant_fades'] == 1
+    assert graph.compile()[1] == '[0:v]fade=t=in:st=1:d=0.5[outv]'
+
+
+def test_overlapping_or_different_fades_kept():
+    fades = [fade('in', 0, 1), fade('in', 0.5, 1), fade('out', 8, 1, color='white'), fade('out', 9.5, 0.5)]
+    graph = faded_graph(fades)
+    assert graph.optimize()['redundant_fades'] == 0
+    assert graph.compile()[1] == '[0:v]' + render_chain(fades) + '[outv]'
+
+
+def test_passthrough_filters_dropped():
+    graph = FilterGraph()
+    music = graph.add_input('music.mp3')
+    graph.output(graph.chain(graph.stream(music, 'a'), [Filter('volume', (1.0,)), Filter('afade', options={
+        't': 'in', 'st': 0, 'd': 1})]), 'outa')
+    assert graph.optimize()['passthrough'] == 1
+    assert graph.compile() == (['-i', 'music.mp3'], '[0:a]afade=t=in:st=0:d=1[outa]')
+
+
+def test_branches_get_labels_and_inputs_are_numbered():
+    graph = FilterGraph()
+    first, second = graph.add_input('a.mp4'), graph.add_input('b.mp4')
+    joined = graph.apply([graph.stream(first), graph.stream(second)],
+                         Filter('concat', options={'n': 2, 'v': 1, 'a': 0}))
+    graph.output(graph.chain(joined, [fade('in', 0, 0.5)]), 'outv')
+    input_args, filter_complex = graph.compile()
+    assert input_args == ['-i', 'a.mp4', '-i', 'b.mp4']
+    assert filter_complex == '[0:v][1:v]concat=n=2:v=1:a=0,fade=t=in:st=0:d=0.5[outv]'
+
+
+def test_validate_rejects_malformed_graphs():
+    graph = FilterGraph()
+    first = graph.add_input('a.mp4')
+    graph.output(graph.apply([graph.stream(first)], Filter('concat', options={'n': 2})), 'outv')
+    with pytest.raises(FilterGraphError, match='concat n=2 but 1 inputs'):
+        graph.compile()
+
+    graph = FilterGraph()
+    source = graph.add_input('a.mp4')
+    graph.output(graph.chain(graph.stream(source), [fade('in', -1, 0.5)]), 'outv')
+    with pytest.raises(FilterGraphError, match='negative'):
+        graph.compile()
+
+    graph = FilterGraph()
+    source = graph.add_input('a.mp4')
+    graph.apply(graph.stream(source), Filter('null'))
+    with pytest.raises(FilterGraphError):
+        graph.compile()
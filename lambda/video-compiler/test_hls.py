@@ -0,0 +1,89 @@
+import os
+import time
+
+import app
+
+
+class FakeUpdate:
+    def __init__(self, row, values):
+        self.row = row
+        self.values = values
+        self.filters = {}
+
+    def eq(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def execute(self):
+        if all(self.row.get(column) == value for column, value in self.filters.items()):
+            self.row.update(self.values)
+
+
+class FakeSupabase:
+    """One final_videos row; every storage delete checks the row never points at it"""
+
+    def __init__(self, row):
+        self.row = row
+        self.removed = []
+
+    def from_(self, table):
+        return self
+
+    def update(self, values):
+        return FakeUpdate(self.row, values)
+
+    @property
+    def storage(self):
+        return self
+
+    def remove(self, remote_paths):
+        assert self.row['hls_playlist_url'] not in [public_url(path) for path in remote_paths]
+        self.removed.extend(remote_paths)
+
+
+def public_url(path):
+    return f"https://storage.test/{path}"
+
+
+def fake_supabase(monkeypatch):
+    supabase = FakeSupabase({'id': 'video-1', 'hls_playlist_url': None})
+    monkeypatch.setattr(app, 'get_supabase', lambda: supabase)
+    monkeypatch.setattr(app, 'generate_public_url', public_url)
+    monkeypatch.setattr(app, 'upload_to_supabase_storage', lambda *args, **kwargs: None)
+    return supabase
+
+
+def publish_attempt(tmp_path, attempt_number):
+    local_dir = str(tmp_path / str(attempt_number))
+    publisher = app.open_hls_publisher(local_dir, f"hls/{attempt_number}", 'video-1', 'user-1')
+    with open(os.path.join(local_dir, 'segment_000.ts'), 'wb') as f:
+        f.write(b'\0' * 100)
+    with open(os.path.join(local_dir, 'index.m3u8'), 'w') as f:
+        f.write('#EXTM3U\n#EXTINF:2.0,\nsegment_000.ts\n')
+    deadline = time.time() + 5
+    while publisher.first_playlist_at is None and time.time() < deadline:
+        time.sleep(0.05)
+    assert publisher.first_playlist_at is not None
+    return publisher
+
+
+def test_fallback_attempt_replaces_the_aborted_playlist(monkeypatch, tmp_path):
+    supabase = fake_supabase(monkeypatch)
+    first = publish_attempt(tmp_path, 1)
+    assert supabase.row['hls_playlist_url'] == public_url('hls/1/index.m3u8')
+    first.abort()
+    assert supabase.row['hls_playlist_url'] is None
+    assert supabase.removed == ['hls/1/index.m3u8', 'hls/1/segment_000.ts']
+
+    second = publish_attempt(tmp_path, 2)
+    second.finish()
+    assert supabase.row['hls_playlist_url'] == public_url('hls/2/index.m3u8')
+
+
+def test_abort_keeps_a_newer_playlist_url(monkeypatch, tmp_path):
+    supabase = fake_supabase(monkeypatch)
+    first = publish_attempt(tmp_path, 1)
+    # The row already moved on to another playlist: withdrawing must not clear it
+    supabase.row['hls_playlist_url'] = public_url('hls/2/index.m3u8')
+    first.abort()
+    assert supabase.row['hls_playlist_url'] == public_url('hls/2/index.m3u8')
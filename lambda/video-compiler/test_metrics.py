@@ -0,0 +1,61 @@
+import json
+import subprocess
+import sys
+import threading
+import time
+
+from memory_monitor import ProcessTreeSampler
+from metrics import StageRecorder
+
+BUSY = 'import time\nend = time.process_time() + {seconds}\nwhile time.process_time() < end:\n    pass\n'
+
+
+def spin(seconds):
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+
+def test_concurrent_blocks_count_only_their_own_thread():
+    recorder = StageRecorder()
+    started = threading.Barrier(2)
+
+    def idle():
+        with recorder.stage('download', item=1):
+            started.wait()
+            time.sleep(0.3)
+
+    worker = threading.Thread(target=idle)
+    worker.start()
+    with recorder.stage('normalize', item=0):
+        started.wait()
+        spin(0.3)
+    worker.join()
+    summary = recorder.summary()
+    assert summary['normalize']['cpu_seconds'] >= 0.25
+    assert summary['download']['cpu_seconds'] < 0.1
+
+
+def test_child_cpu_is_charged_to_the_stage_that_started_it():
+    sampler = ProcessTreeSampler(interval=0.02).start()
+    recorder = StageRecorder(memory_sampler=sampler)
+    try:
+        with recorder.stage('normalize'):
+            subprocess.run([sys.executable, '-c', BUSY.format(seconds=0.5)], check=True)
+        with recorder.stage('upload'):
+            time.sleep(0.05)
+    finally:
+        sampler.stop()
+    summary = recorder.summary()
+    assert summary['normalize']['cpu_seconds'] >= 0.3
+    assert summary['upload']['cpu_seconds'] < 0.1
+
+
+def test_emf_reports_cpu_time(capsys):
+    recorder = StageRecorder()
+    with recorder.stage('compile'):
+        spin(0.05)
+    recorder.emit_emf('VideoCompiler')
+    record = json.loads(capsys.readouterr().out)
+    assert {'Name': 'CpuTime', 'Unit': 'Seconds'} in record['_aws']['CloudWatchMetrics'][0]['Metrics']
+    assert record['CpuTime'] >= 0.04
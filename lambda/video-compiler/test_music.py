@@ -1 +1,40 @@
- 
\ No newline at end of file
+import app
+from filter_graph import render_chain
+
+
+def rendition_filter(monkeypatch, tmp_path, video_duration):
+    commands = []
+
+    def run_ffmpeg(cmd, timeout, stage):
+        commands.append(cmd)
+        with open(cmd[-1], 'wb') as f:
+            f.write(b'\0' * 1000)
+
+    monkeypatch.setattr(app, 'run_ffmpeg', run_ffmpeg)
+    rendition = app.prepare_music_rendition('music.mp3', None, video_duration, 0.3, str(tmp_path))
+    cmd = commands[0]
+    return rendition, cmd[cmd.index('-af') + 1]
+
+
+def test_music_filters_fade_out_ends_at_the_duration():
+    assert render_chain(app.music_filters(12.0, 0.3)) == (
+        'atrim=duration=12.0,volume=0.3,afade=t=in:st=0:d=1,afade=t=out:st=11.0:d=1')
+
+
+def test_rendition_runs_to_the_bucket_but_fades_at_the_video_end(monkeypatch, tmp_path):
+    rendition, audio_filter = rendition_filter(monkeypatch, tmp_path, 12.1)
+    # Long enough for the -t cut at 12.1s, silent by then
+    assert rendition['duration'] == 12.5
+    assert audio_filter == 'atrim=duration=12.5,volume=0.3,afade=t=in:st=0:d=1,afade=t=out:st=11.1:d=1'
+
+
+def test_rendition_for_a_bucket_aligned_video(monkeypatch, tmp_path):
+    rendition, audio_filter = rendition_filter(monkeypatch, tmp_path, 12.0)
+    assert rendition['duration'] == 12.0
+    assert audio_filter.endswith('afade=t=out:st=11.0:d=1')
+
+
+def test_rendition_duration_rounds_up():
+    assert app.music_rendition_duration(12.01) == 12.5
+    assert app.music_rendition_duration(12.5) == 12.5
+    assert app.music_rendition_duration(0.2) == 0.5
@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from pipeline import PipelineCancelled, PipelineExecutor
+
+
+def test_then_chains_each_item_through_the_stages():
+    executor = PipelineExecutor({'download': 2, 'normalize': 2})
+    try:
+        futures = [executor.then(executor.submit('download', lambda n=n: n, label=n), 'normalize',
+                                 lambda n: n * 10, label=n)
+                   for n in range(4)]
+        assert executor.wait_all(futures) == [0, 10, 20, 30]
+    finally:
+        executor.shutdown()
+    timings = executor.timings()
+    assert set(timings['stages']) == {'download', 'normalize'}
+
+
+def test_first_failure_cancels_the_rest():
+    executor = PipelineExecutor({'download': 1})
+
+    def fail():
+        raise ValueError('download failed')
+
+    try:
+        failing = executor.submit('download', fail, label=0)
+        later = executor.submit('download', lambda: 'never', label=1)
+        with pytest.raises(ValueError, match='download failed'):
+            executor.wait_all([failing, later])
+        assert executor.cancel_event.is_set()
+        with pytest.raises(PipelineCancelled):
+            later.result()
+    finally:
+        executor.shutdown()
+
+
+def test_detached_stage_keeps_running_after_shutdown():
+    executor = PipelineExecutor({'cache': 1})
+    release = threading.Event()
+    upload = executor.submit('cache', lambda: release.wait(5) and 'uploaded', label=0)
+    executor.shutdown(detach=('cache',))
+    assert not upload.done()
+    release.set()
+    assert upload.result(timeout=5) == 'uploaded'
@@ -0,0 +1,68 @@
+import time
+
+from scheduler import ENCODER_PROFILES, DeadlineScheduler
+
+
+def scheduler(seconds_left=100.0, speed=1.0):
+    return DeadlineScheduler(deadline=time.time() + seconds_left, speed=speed, headroom=0.8)
+
+
+def test_plan_picks_best_profile_that_fits():
+    s = scheduler(seconds_left=100, speed=1.0)
+    # 60 media seconds fit in the 80s budget at full quality
+    assert s.plan([30, 30], 0).name == 'standard'
+
+    s = scheduler(seconds_left=100, speed=1.0)
+    # 100s needs 1.5x the speed: the first rung that is fast enough
+    assert s.plan([50, 50], 0).name == 'fast'
+
+
+def test_plan_falls_back_to_fastest_and_respects_scale():
+    s = scheduler(seconds_left=10, speed=1.0)
+    assert s.plan([600], 0) is ENCODER_PROFILES[-1]
+
+    s = scheduler(seconds_left=10, speed=1.0)
+    profile = s.plan([600], 0, scale=1.0)
+    assert profile.scale == 1.0
+    assert profile.name == 'rapid'
+
+
+def test_forced_profile_is_kept():
+    s = scheduler(seconds_left=100, speed=1.0)
+    assert s.plan([10], 0, profile_name='minimal').name == 'minimal'
+    s.record_encode(10, 100, s.profile, index=0)
+    assert s.profile.name == 'minimal'
+    assert s.summary()['planned']['forced'] is True
+
+
+def test_record_encode_steps_down_a_preset_when_behind():
+    s = scheduler(seconds_left=100, speed=1.0)
+    s.plan([10, 10, 10], 5)
+    # The first clip encoded at 1/6 of the assumed speed: the rest no longer fits
+    s.record_encode(10, 60, s.profile, index=0)
+    assert s.profile.name != 'standard'
+    assert s.profile.scale == 1.0  # The resolution tier never changes mid-job
+    assert s.switches and s.switches[0]['from'] == 'standard'
+
+
+def test_pinned_preset_never_switches():
+    s = scheduler(seconds_left=100, speed=1.0)
+    s.plan([10, 10, 10], 5, pin_preset=True)
+    s.record_encode(10, 60, s.profile, index=0)
+    assert s.profile.name == 'standard'
+    assert s.switches == []
+
+
+def test_remaining_work_and_timeouts():
+    s = scheduler(seconds_left=100, speed=2.0)
+    s.plan([10, 20], 6)
+    assert s.remaining_work() == 36
+    s.mark_done(1)
+    assert s.remaining_work() == 16
+    assert s.estimate_seconds(10) == 5
+    assert s.estimate_seconds(10, share=0.5) == 10
+    # Generous multiple of the estimate, but never past the deadline
+    assert 44 <= s.timeout_for(10) <= 45
+    assert s.timeout_for(1000) <= 100
+    assert s.cap_timeout(500) <= 100
+    assert s.cap_timeout(5, minimum=10) == 10
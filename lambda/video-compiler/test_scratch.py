@@ -0,0 +1,111 @@
+import os
+import threading
+
+import pytest
+
+from scratch import ScratchBudgetExceeded, ScratchSpace, get_scratch, scratch_space
+
+MB = 1024 * 1024
+
+
+def write(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    return str(path)
+
+
+def test_usage_counts_every_file_under_root(tmp_path):
+    scratch = ScratchSpace(str(tmp_path), budget_bytes=10 * MB)
+    write(tmp_path / 'untracked.bin', MB)
+    scratch.track(write(tmp_path / 'raw.mp4', 2 * MB), 'raw')
+    assert scratch.used_bytes() == 3 * MB
+    assert scratch.free_bytes() == 7 * MB
+    assert scratch.summary()['by_kind_mb'] == {'raw': 2.0}
+
+
+def test_reserve_rejects_what_does_not_fit(tmp_path):
+    scratch = ScratchSpace(str(tmp_path), budget_bytes=4 * MB)
+    scratch.track(write(tmp_path / 'raw.mp4', 2 * MB), 'raw')
+    with pytest.raises(ScratchBudgetExceeded, match='Not enough ephemeral storage for the encode'):
+        scratch.reserve(3 * MB, 'the encode')
+    assert scratch.stats['rejected'] == 1
+
+
+def test_reserve_evicts_released_artifacts_oldest_first(tmp_path):
+    scratch = ScratchSpace(str(tmp_path), budget_bytes=5 * MB)
+    older = scratch.track(write(tmp_path / 'older.mp4', 2 * MB), 'raw')
+    newer = scratch.track(write(tmp_path / 'newer.mp4', 2 * MB), 'raw')
+    kept = scratch.track(write(tmp_path / 'kept.mp4', MB), 'normalized')
+    scratch.release(older)
+    scratch.release(newer)
+    with scratch.reserve(2 * MB, 'the encode'):
+        assert not os.path.exists(older)
+        assert os.path.exists(newer) and os.path.exists(kept)
+    assert scratch.stats['evictions'] == 1
+
+
+def test_evictors_run_after_released_artifacts(tmp_path):
+    scratch = ScratchSpace(str(tmp_path), budget_bytes=3 * MB)
+    cached = write(tmp_path / 'cache_entry.mp4', 2 * MB)
+    asked = []
+
+    def evict_cache(bytes_needed):
+        asked.append(bytes_needed)
+        os.remove(cached)
+        return 2 * MB
+
+    scratch.add_evictor(evict_cache)
+    scratch.reserve(2 * MB, 'the encode').release()
+    assert asked == [MB]
+    assert scratch.stats['evictor_bytes'] == 2 * MB
+
+
+def test_reservations_hold_space_until_released(tmp_path):
+    scratch = ScratchSpace(str(tmp_path), budget_bytes=4 * MB)
+    first = scratch.reserve(3 * MB, 'the first encode')
+    assert scratch.reserved_bytes() == 3 * MB
+    with pytest.raises(ScratchBudgetExceeded):
+        scratch.reserve(2 * MB, 'the second encode')
+    first.release()
+    assert scratch.reserved_bytes() == 0
+    scratch.reserve(2 * MB, 'the second encode').release()
+
+
+def test_reservation_counts_bytes_already_written(tmp_path):
+    scratch = ScratchSpace(str(tmp_path), budget_bytes=10 * MB)
+    output = str(tmp_path / 'normalized_000.mp4')
+    with scratch.reserve(4 * MB, 'the encode', path=output) as reservation:
+        write(output, MB)
+        # The written megabyte is used space now, not reservation
+        assert reservation.outstanding() == 3 * MB
+        assert scratch.free_bytes() == 6 * MB
+
+
+def test_concurrent_reservations_never_share_free_bytes(tmp_path):
+    scratch = ScratchSpace(str(tmp_path), budget_bytes=10 * MB)
+    granted = []
+    rejected = []
+    barrier = threading.Barrier(5)
+
+    def encode():
+        barrier.wait()
+        try:
+            granted.append(scratch.reserve(3 * MB, 'a parallel encode'))
+        except ScratchBudgetExceeded:
+            rejected.append(True)
+
+    threads = [threading.Thread(target=encode) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (len(granted), len(rejected)) == (3, 2)
+    assert scratch.reserved_bytes() == 9 * MB
+
+
+def test_scratch_space_scopes_the_job(tmp_path):
+    outer = get_scratch()
+    with scratch_space(str(tmp_path), budget_bytes=MB) as scratch:
+        assert get_scratch() is scratch
+        assert scratch.root == str(tmp_path)
+    assert get_scratch() is outer
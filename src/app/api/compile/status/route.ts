@@ -54,7 +54,7 @@ export async function GET(request: NextRequest) {
     
     const { data: finalVideo, error: dbError } = await supabaseAdmin
       .from('final_videos')
-      .select('id, status, file_path, error_message, created_at, completed_at')
+      .select('id, status, file_path, error_message, created_at, completed_at, hls_playlist_url, progress')
       .eq('id', videoId)
       .eq('user_id', user.id) // Ensure user can only check their own videos
       .single()
@@ -88,7 +88,9 @@ export async function GET(request: NextRequest) {
       file_path: finalVideo.file_path,
       error_message: finalVideo.error_message,
       created_at: finalVideo.created_at,
-      completed_at: finalVideo.completed_at
+      completed_at: finalVideo.completed_at,
+      hls_playlist_url: finalVideo.hls_playlist_url,
+      progress: finalVideo.progress
     }
 
     console.log('📤 Returning response:', JSON.stringify(responseData, null, 2))
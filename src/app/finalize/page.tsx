@@ -51,6 +51,8 @@ export default function FinalizePage() {
   const [elapsedTime, setElapsedTime] = useState(0)
   const [currentPhase, setCurrentPhase] = useState<'starting' | 'processing' | 'finishing'>('starting')
   const [expectedDuration, setExpectedDuration] = useState(0)
+  // Percent reported by the compiler (final_videos.progress); the time estimate is used until it arrives
+  const [reportedPercent, setReportedPercent] = useState<number | null>(null)
   const [phaseTimers, setPhaseTimers] = useState<{ phase2?: NodeJS.Timeout; phase3?: NodeJS.Timeout }>({})
 
   // Load user's clips and music tracks
@@ -281,6 +283,7 @@ export default function FinalizePage() {
     setSaving(true)
     setStartTime(Date.now())
     setCurrentPhase('starting')
+    setReportedPercent(null)
     
     // Calculate expected duration based on clip count
     const clipCount = selectedClipIds.size
@@ -476,7 +479,10 @@ export default function FinalizePage() {
           throw new Error(status.error_message || 'Video compilation failed')
         } else if (status.status === 'processing') {
           // Still processing, continue polling
-          console.log(`⏳ Video still processing (attempt ${attempts}/${maxAttempts})`)
+          console.log(`⏳ Video still processing (attempt ${attempts}/${maxAttempts})`, status.progress)
+          if (typeof status.progress?.percent === 'number') {
+            setReportedPercent(status.progress.percent)
+          }
           
           if (attempts < maxAttempts) {
             console.log(`⏰ Scheduling next poll in 5 seconds...`)
@@ -874,6 +880,7 @@ export default function FinalizePage() {
                           className="bg-gradient-to-r from-white to-purple-200 h-2 rounded-full transition-all duration-1000 ease-out relative"
                           style={{ 
                             width: (() => {
+                              if (reportedPercent !== null) return Math.max(reportedPercent, 2) + '%'
                               if (!expectedDuration || !startTime) return '2%'
                               const progressPercent = Math.min((elapsedTime / expectedDuration) * 100, 95)
                               // Show actual progress without artificial minimums
@@ -895,9 +902,11 @@ export default function FinalizePage() {
                         </span>
                         <span className="font-mono">
                           {elapsedTime}s elapsed
-                          {expectedDuration > 0 && (
-                            ` • ${Math.min(Math.round((elapsedTime / expectedDuration) * 100), 95)}%`
-                          )}
+                          {reportedPercent !== null
+                            ? ` • ${reportedPercent}%`
+                            : expectedDuration > 0 && (
+                              ` • ${Math.min(Math.round((elapsedTime / expectedDuration) * 100), 95)}%`
+                            )}
                         </span>
                       </div>
                     </div>
@@ -0,0 +1,12 @@
+-- Create private storage bucket for video compiler intermediates
+-- Holds normalized clips keyed by content hash: normalized/v1/{hash[0:2]}/{hash}.mp4
+-- Only the Lambda (service role) reads and writes here, so no user policies are needed
+INSERT INTO storage.buckets (id, name, public, file_size_limit, allowed_mime_types)
+VALUES (
+  'compile-cache',
+  'compile-cache',
+  false,
+  104857600, -- 100MB limit per object (normalized 720p clips are a few MB)
+  ARRAY['video/mp4']
+)
+ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,13 @@
+-- Progressive playback: the video compiler publishes an HLS rendition while encoding
+-- Segments live next to the final MP4: final_videos/{user_id}/{request_id}/hls/{attempt}/
+UPDATE storage.buckets
+SET allowed_mime_types = ARRAY[
+  'video/mp4', 'video/quicktime', 'video/x-msvideo',
+  'application/vnd.apple.mpegurl', 'application/x-mpegurl', 'video/mp2t'
+]
+WHERE id = 'final-videos';
+
+-- Written as soon as the first playlist is live, before the MP4 is complete
+ALTER TABLE public.final_videos ADD COLUMN IF NOT EXISTS hls_playlist_url TEXT;
+
+COMMENT ON COLUMN public.final_videos.hls_playlist_url IS 'Public URL of the HLS playlist, playable while the video is still processing';
@@ -0,0 +1,5 @@
+-- The video compiler caches ready-to-mux AAC music renditions next to normalized clips:
+-- music/v1/{hash[0:2]}/{hash}.m4a
+UPDATE storage.buckets
+SET allowed_mime_types = ARRAY['video/mp4', 'audio/mp4']
+WHERE id = 'compile-cache';
@@ -0,0 +1,6 @@
+-- Per-job performance breakdown written by the video compiler on completion
+-- processing_stats.stages holds wall/busy/CPU seconds, bytes and peak memory per stage
+-- (download, cache_lookup, probe, normalize, music, compile, upload)
+ALTER TABLE public.final_videos ADD COLUMN IF NOT EXISTS processing_stats JSONB;
+
+COMMENT ON COLUMN public.final_videos.processing_stats IS 'Compile job metrics (timings, cache hits, per-stage breakdown)';
@@ -0,0 +1,5 @@
+-- Resume state for compile jobs: a retried invocation for the same video reads the manifest
+-- and skips the stages it lists (normalized clips, distributed segments). Cleared on success.
+ALTER TABLE public.final_videos ADD COLUMN IF NOT EXISTS checkpoint JSONB;
+
+COMMENT ON COLUMN public.final_videos.checkpoint IS 'Compile job checkpoint manifest (completed stage outputs in compile-cache storage)';
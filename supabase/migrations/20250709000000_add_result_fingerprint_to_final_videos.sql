@@ -0,0 +1,10 @@
+-- Result cache for the video compiler: a deterministic fingerprint of the compile request
+-- (clips + source ETags, music, output settings, encoder version). A new request whose
+-- fingerprint matches a completed video of the same user reuses that video's output.
+ALTER TABLE public.final_videos ADD COLUMN IF NOT EXISTS result_fingerprint TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_final_videos_result_fingerprint
+ON public.final_videos(user_id, result_fingerprint)
+WHERE result_fingerprint IS NOT NULL AND status = 'completed';
+
+COMMENT ON COLUMN public.final_videos.result_fingerprint IS 'Compile request fingerprint used to reuse identical completed videos';
@@ -0,0 +1,6 @@
+-- Live progress of compile jobs, polled through /api/compile/status while status = 'processing'
+-- {stage, percent, detail, updated_at}; written at most every PROGRESS_INTERVAL_SECONDS by the
+-- video compiler, and a last time with the completed/failed update
+ALTER TABLE public.final_videos ADD COLUMN IF NOT EXISTS progress JSONB;
+
+COMMENT ON COLUMN public.final_videos.progress IS 'Compile job progress (current stage, overall percent, last update time)';